@@ -0,0 +1,291 @@
+"""
+Vision hot-path micro-benchmark
+- Maestros y frames sintéticos con semilla (720p, 1080p, 4K, etiqueta 300 dpi)
+- Defectos conocidos sembrados con DefectSimulator(seed)
+- Tiempos por etapa (align, compare, color, diagnostics): p50/p95/p99, fps, memoria pico
+- Recall de detección contra los defectos sembrados, salida JSON
+- Opcional: frames reales desde un vídeo o carpeta de imágenes (--source)
+
+Usage:
+    python benchmark_vision.py --resolutions 720p,1080p --frames 20 --out bench.json
+    python benchmark_vision.py --modes full,pyramid --screen
+    python benchmark_vision.py --source press.mp4 --master master.png --frames 200
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from color_module import ColorMonitor
+from diagnostics import Diagnostics
+from frame_source import FileFrameSource
+from frame_analysis import color_patch
+from inspection import Inspector, DETECTION_OPTIONS
+from simulator import DefectSimulator, score_detections
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "label300": (1200, 1800),  # 4x6 in label at 300 dpi
+}
+
+STEPS = ("align", "compare", "color", "diagnostics")
+
+
+def synthetic_master(width: int, height: int, seed: int) -> np.ndarray:
+    """Label-like artwork: paper, colour blocks, rules, text and a barcode (deterministic per seed)."""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 245, dtype=np.uint8)
+    scale = max(1.0, min(width, height) / 720.0)
+    for _ in range(int(40 * scale)):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(20, 200) * scale), int(rng.integers(20, 120) * scale)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.rectangle(img, (x, y), (x + w, y + h), color, -1 if rng.random() < 0.6 else max(1, int(2 * scale)))
+    for _ in range(int(15 * scale)):
+        p1 = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        p2 = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.line(img, p1, p2, (20, 20, 20), max(1, int(scale)))
+    for _ in range(int(60 * scale)):
+        text = "".join(chr(int(c)) for c in rng.integers(65, 91, int(rng.integers(4, 12))))
+        org = (int(rng.integers(0, width - 50)), int(rng.integers(20, height)))
+        cv2.putText(img, text, org, cv2.FONT_HERSHEY_SIMPLEX, float(rng.uniform(0.4, 1.2) * scale), (0, 0, 0), max(1, int(scale)))
+    # Barcode block
+    bx, by = width // 10, height - height // 5
+    x = bx
+    while x < bx + width // 3:
+        bar = int(rng.integers(1, 4) * scale)
+        cv2.rectangle(img, (x, by), (x + bar, by + height // 10), (0, 0, 0), -1)
+        x += bar + int(rng.integers(1, 4) * scale)
+    return img
+
+
+def master_pyramid(img: np.ndarray, levels: int = 3):
+    pyramid = [img]
+    for _ in range(levels - 1):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def live_frame(master: np.ndarray, simulator: DefectSimulator, rng: np.random.Generator, defects: int,
+               base: np.ndarray = None):
+    """Master (or a recorded `base` frame) + planted defects, then a small seeded shift/rotation and sensor noise."""
+    defective = simulator.add_defects(master if base is None else base, count=defects)
+    h, w = master.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), float(rng.uniform(-0.3, 0.3)), 1.0)
+    m[:, 2] += rng.uniform(-5, 5, 2)
+    live = cv2.warpAffine(defective, m, (w, h), borderMode=cv2.BORDER_REPLICATE)
+    noise = rng.normal(0, 2.0, live.shape)
+    return np.clip(live.astype(np.float32) + noise, 0, 255).astype(np.uint8), list(simulator.last_defects)
+
+
+def percentiles(samples: list) -> dict:
+    arr = np.asarray(samples, dtype=np.float64)
+    if arr.size == 0:
+        return {}
+    return {
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "p99": round(float(np.percentile(arr, 99)), 3),
+        "mean": round(float(arr.mean()), 3),
+    }
+
+
+def source_frames(args, count: int):
+    """Master and `count` frames from --source (looped), resized to the master."""
+    source = FileFrameSource(args.source, fps=0, loop=True, preload=args.preload)
+    frames = []
+    try:
+        for _ in range(count + (0 if args.master else 1)):
+            ok, frame = source.read()
+            if not ok:
+                raise ValueError(f"Could not read frames from {args.source}")
+            frames.append(np.array(frame))
+    finally:
+        source.release()
+    master = cv2.imread(args.master, cv2.IMREAD_COLOR) if args.master else frames.pop(0)
+    if master is None:
+        raise ValueError(f"Could not read master {args.master}")
+    h, w = master.shape[:2]
+    return master, [f if f.shape[:2] == (h, w) else cv2.resize(f, (w, h)) for f in frames]
+
+
+def run_case(name: str, size: tuple, mode: str, args) -> dict:
+    seed = args.seed
+    recorded = None
+    if args.source:
+        master, recorded = source_frames(args, args.warmup + args.frames)
+        height, width = master.shape[:2]
+    else:
+        width, height = size
+        master = synthetic_master(width, height, seed)
+    pyramid = master_pyramid(master)
+    inspector = Inspector()
+    inspector.configure({"screen": args.screen}, DETECTION_OPTIONS)
+    setup_start = time.perf_counter()
+    inspector.set_master(master, key=("bench", name, seed), pyramid=pyramid)
+    setup_ms = (time.perf_counter() - setup_start) * 1000.0
+    monitor = ColorMonitor()
+    simulator = DefectSimulator(seed=seed)
+    rng = np.random.default_rng(seed)
+    # Frames are generated up front so only the measured steps are timed
+    frames = [live_frame(master, simulator, rng, args.defects, base=recorded[i] if recorded else None)
+              for i in range(args.warmup + args.frames)]
+
+    timings = {step: [] for step in STEPS}
+    totals = []
+    planted_total = found_total = unmatched_total = 0
+    registration_failures = 0
+    peak_traced = 0
+
+    for i, (live, planted) in enumerate(frames):
+        measured = i >= args.warmup
+        trace = measured and i == len(frames) - 1 and args.memory
+        if trace:
+            tracemalloc.start()
+        step_ms = {}
+
+        start = time.perf_counter()
+        aligned, _ = inspector.align_images(master, live, mode=mode)
+        step_ms["align"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, _, _, defects = inspector.compare_images(master, aligned, diff_threshold=args.diff_threshold,
+                                                    min_blob_area=args.min_blob_area, pyramid=pyramid)
+        step_ms["compare"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        patch = color_patch({}, aligned)
+        b, g, r = cv2.mean(patch)[:3]
+        rgb = cv2.cvtColor(np.uint8([[[b, g, r]]]), cv2.COLOR_BGR2RGB)[0, 0]
+        monitor.record_measurement(*monitor.rgb_to_lab(rgb))
+        step_ms["color"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        Diagnostics.calculate_image_quality(live)
+        step_ms["diagnostics"] = time.perf_counter() - start
+
+        if trace:
+            peak_traced = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if not measured:
+            continue
+        for step, seconds in step_ms.items():
+            timings[step].append(seconds * 1000.0)
+        totals.append(sum(step_ms.values()) * 1000.0)
+        if not inspector.last_registration_ok:
+            registration_failures += 1
+        planted_count, found, unmatched = score_detections(planted, defects, args.min_changed_px)
+        planted_total += planted_count
+        found_total += found
+        unmatched_total += unmatched
+
+    total_s = sum(totals) / 1000.0
+    return {
+        "resolution": name,
+        "width": width,
+        "height": height,
+        "mode": mode,
+        "screen": args.screen,
+        "frames": len(totals),
+        "master_setup_ms": round(setup_ms, 3),
+        "timings_ms": {**{step: percentiles(values) for step, values in timings.items()}, "total": percentiles(totals)},
+        "fps": round(len(totals) / total_s, 2) if total_s > 0 else 0.0,
+        "peak_traced_mb": round(peak_traced / 1e6, 2) if args.memory else None,
+        "registration_failures": registration_failures,
+        "planted": planted_total,
+        "detected": found_total,
+        "recall": round(found_total / planted_total, 4) if planted_total else None,
+        "unmatched_detections": unmatched_total,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Seeded vision hot-path benchmark (JSON output)")
+    parser.add_argument("--resolutions", default="720p,1080p,4k,label300", help=f"comma list of {', '.join(RESOLUTIONS)} or WxH")
+    parser.add_argument("--modes", default="full", help="alignment modes: full, pyramid, phase, track")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--defects", type=int, default=5, help="planted defects per frame")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--diff-threshold", type=int, default=30)
+    parser.add_argument("--min-blob-area", type=int, default=50)
+    parser.add_argument("--min-changed-px", type=int, default=50, help="planted defects changing fewer pixels are not counted for recall")
+    parser.add_argument("--screen", action="store_true", help="enable two-stage screening in compare_images")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc pass")
+    parser.add_argument("--min-recall", type=float, default=None, help="exit with status 1 if any case falls below")
+    parser.add_argument("--source", default="", help="video file or image folder to take frames from (replaces --resolutions)")
+    parser.add_argument("--master", default="", help="master image for --source (default: its first frame)")
+    parser.add_argument("--preload", action="store_true", help="decode --source through the memory-mapped frame cache")
+    parser.add_argument("--out", default="", help="write JSON here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    cases = []
+    if args.source:
+        args.resolutions = ""
+        cases.append(("source", None))
+    for token in [t.strip() for t in args.resolutions.split(",") if t.strip()]:
+        if token.lower() in RESOLUTIONS:
+            cases.append((token.lower(), RESOLUTIONS[token.lower()]))
+        elif "x" in token:
+            w, h = token.lower().split("x")
+            cases.append((token, (int(w), int(h))))
+        else:
+            parser.error(f"Unknown resolution '{token}'")
+
+    results = []
+    for name, size in cases:
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            print(f"[bench] {name} {f'{size[0]}x{size[1]}' if size else args.source} mode={mode}", file=sys.stderr)
+            results.append(run_case(name, size, mode, args))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "seed": args.seed,
+            "frames": args.frames,
+            "warmup": args.warmup,
+            "defects_per_frame": args.defects,
+            "source": args.source or None,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "opencv_threads": cv2.getNumThreads(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+        # Process-wide high-water mark (includes OpenCV buffers tracemalloc cannot see)
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1) if resource else None,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+    if args.min_recall is not None:
+        low = [r for r in results if r["recall"] is not None and r["recall"] < args.min_recall]
+        if low:
+            print(f"[bench] recall below {args.min_recall}: {[(r['resolution'], r['mode'], r['recall']) for r in low]}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,48 @@
 import cv2
 import numpy as np
 import platform
+import threading
+import time
+import logging
+
+from frame_source import FileFrameSource
+
+logger = logging.getLogger(__name__)
+
+FILE_CAMERA_ID = -2
+
 
 class CameraService:
+    """
+    Real cameras are drained by a capture thread that keeps only the newest
+    frame (driver buffers are not always honoured by CAP_PROP_BUFFERSIZE), so
+    get_frame() returns immediately and never hands out a stale buffered frame.
+    Each frame carries a sequence number and its capture timestamp.
+    Camera id -2 is a video file or image folder (FileFrameSource) set by
+    `source` in connect(); it runs through the same capture thread.
+    """
+
     def __init__(self):
         self.cap = None
         self.current_camera_id = None
+        self._cond = threading.Condition()
+        self._cap_lock = threading.Lock()
+        # Serializes connect()/release(); callers may hold it around a switch
+        self.connect_lock = threading.RLock()
+        self._thread = None
+        self._stop_capture = None  # Event of the current capture thread
+        self._latest = None  # (frame, meta)
+        self._seq = 0
+        self._last_read_seq = 0
+        self.captured = 0
+        self.dropped = 0      # captured frames replaced before anyone read them
+        self.duplicates = 0   # reads that got the same frame as the previous read
+        self.read_errors = 0
+        self.last_error = None
+        self._camera_list = None
+        self._camera_list_ts = 0.0
+        self._scan_thread = None
+        self.source_config = None  # FileFrameSource kwargs for FILE_CAMERA_ID
 
     def _open_capture(self, camera_id: int):
         if platform.system().lower().startswith("win"):
@@ -25,36 +62,79 @@ class CameraService:
             return cv2.VideoCapture(camera_id, cv2.CAP_DSHOW)
         return cv2.VideoCapture(camera_id)
 
-    def list_cameras(self):
+    def _probe_cameras(self, max_index: int = 5):
         """
-        Scans for available cameras.
-        Note: OpenCV doesn't natively list devices reliably on all OSs without probing.
-        We will probe the first 5 indices.
+        Probes the first indices one after another (OpenCV doesn't natively
+        list devices reliably on all OSs). The connected device is reported
+        without reopening it.
         """
         available_cameras = []
         # Add a Virtual Camera for testing logic without hardware
         available_cameras.append({"id": -1, "name": "Virtual Test Camera"})
 
-        for i in range(5):
+        for i in range(max_index):
+            if i == self.current_camera_id and isinstance(self.cap, cv2.VideoCapture):
+                available_cameras.append({"id": i, "name": f"Camera {i}"})
+                continue
             cap = self._probe_capture(i)
             if cap.isOpened():
                 available_cameras.append({"id": i, "name": f"Camera {i}"})
-                cap.release()
+            cap.release()
         return available_cameras
 
-    def connect(self, camera_id: int, fallback_to_virtual: bool = True):
+    def refresh_cameras(self):
+        """Starts a background probe unless one is already running."""
+        with self._cond:
+            if self._scan_thread is not None and self._scan_thread.is_alive():
+                return
+            self._scan_thread = threading.Thread(target=self._scan_cameras, name="camera-scan", daemon=True)
+            self._scan_thread.start()
+
+    def _scan_cameras(self):
+        try:
+            cameras = self._probe_cameras()
+        except Exception as e:
+            logger.warning(f"Camera scan failed: {e}")
+            return
+        with self._cond:
+            self._camera_list = cameras
+            self._camera_list_ts = time.monotonic()
+            self._cond.notify_all()
+
+    def list_cameras(self, max_age_s: float = 60.0, wait: float = 0.0):
+        """
+        Cached camera list. A stale or missing cache triggers a background
+        probe; `wait` bounds how long to wait for it when nothing is cached.
+        """
+        with self._cond:
+            fresh = self._camera_list is not None and time.monotonic() - self._camera_list_ts < max_age_s
+        if not fresh:
+            self.refresh_cameras()
+        with self._cond:
+            if self._camera_list is None and wait > 0:
+                self._cond.wait_for(lambda: self._camera_list is not None, wait)
+            if self._camera_list is None:
+                return [{"id": -1, "name": "Virtual Test Camera"}]
+            return list(self._camera_list)
+
+    def connect(self, camera_id: int, fallback_to_virtual: bool = True, source: dict = None):
         """
         Connect to camera with optional fallback to virtual camera
         
         Args:
             camera_id: Camera index to connect (-1 for virtual)
             fallback_to_virtual: If True, switch to virtual camera if real camera fails
+            source: FileFrameSource options (path, fps, loop, preload) for camera_id -2;
+                defaults to the last source used
         
         Returns:
             dict with connection status and actual camera used
         """
-        if self.cap is not None and isinstance(self.cap, cv2.VideoCapture):
-            self.cap.release()
+        with self.connect_lock:
+            return self._connect(camera_id, fallback_to_virtual, source)
+
+    def _connect(self, camera_id: int, fallback_to_virtual: bool, source: dict):
+        self.release()
         
         self.current_camera_id = camera_id
         
@@ -68,6 +148,34 @@ class CameraService:
                 "message": "Connected to Virtual Camera"
             }
         
+        # Video file / image folder
+        if camera_id == FILE_CAMERA_ID:
+            if source is not None:
+                self.source_config = dict(source)
+            if not self.source_config or not self.source_config.get("path"):
+                raise Exception("No file source configured")
+            try:
+                self.cap = FileFrameSource(**self.source_config)
+            except Exception as e:
+                if not fallback_to_virtual:
+                    raise Exception(f"Could not open source {self.source_config['path']}: {e}")
+                self.cap = "VIRTUAL"
+                self.current_camera_id = -1
+                return {
+                    "success": True,
+                    "camera_id": -1,
+                    "camera_name": "Virtual Test Camera (Fallback)",
+                    "warning": f"Could not open source {self.source_config['path']}: {e}, switched to Virtual Camera"
+                }
+            self._start_capture()
+            return {
+                "success": True,
+                "camera_id": FILE_CAMERA_ID,
+                "camera_name": f"File {self.source_config['path']}",
+                "source": self.cap.status(),
+                "message": "Connected to file source"
+            }
+
         # Try to open real camera
         self.cap = self._open_capture(camera_id)
         
@@ -89,6 +197,7 @@ class CameraService:
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
         self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._start_capture()
         
         return {
             "success": True,
@@ -97,45 +206,157 @@ class CameraService:
             "message": "Connected to real camera"
         }
 
-    def get_frame(self):
+    def _start_capture(self):
+        # Each thread gets its own stop event: a thread that outlives release()
+        # is never revived by the next connect()
+        self._stop_capture = threading.Event()
+        self._thread = threading.Thread(target=self._capture_loop, args=(self.cap, self._stop_capture),
+                                        name="camera-capture", daemon=True)
+        self._thread.start()
+
+    def _capture_loop(self, cap, stop: threading.Event):
+        lockstep = getattr(cap, "lockstep", False)
+        while not stop.is_set():
+            if lockstep:
+                # Unpaced file source: next frame only once the current one was read
+                with self._cond:
+                    while not stop.is_set() and self._latest is not None and self._last_read_seq < self._seq:
+                        self._cond.wait(0.1)
+                if stop.is_set():
+                    break
+            with self._cap_lock:
+                ret, frame = cap.read()
+            ts_mono_ns = time.monotonic_ns()
+            ts = time.time()
+            if stop.is_set():
+                break
+            if getattr(cap, "finished", False):
+                # Non-looping file source ran out: stop like an unplugged camera
+                self.last_error = "Source finished"
+                break
+            if not ret or frame is None:
+                self.read_errors += 1
+                self.last_error = "Failed to read frame"
+                time.sleep(0.01)
+                continue
+            self._store(frame, ts_mono_ns, ts)
+
+    def _store(self, frame: np.ndarray, ts_mono_ns: int, ts: float) -> dict:
+        with self._cond:
+            if self._latest is not None and self._latest[1]["seq"] > self._last_read_seq:
+                self.dropped += 1
+            self._seq += 1
+            self.captured += 1
+            meta = {"seq": self._seq, "ts_mono_ns": ts_mono_ns, "ts": ts}
+            self._latest = (frame, meta)
+            self._cond.notify_all()
+            return meta
+
+    def _virtual_frame(self) -> np.ndarray:
+        # Generate a test pattern
+        img = np.zeros((720, 1280, 3), dtype=np.uint8)
+        # Draw some moving graphics based on time (mock)
+        t = time.time()
+        cv2.putText(img, f"Virtual Camera Test {t:.2f}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        # Moving rectangle
+        x = int((t * 100) % 1200)
+        cv2.rectangle(img, (x, 200), (x+100, 300), (0, 255, 0), -1)
+        return img
+
+    def get_frame_with_meta(self, after_seq: int = 0, timeout: float = 0.0, first_frame_timeout: float = 2.0):
+        """
+        (frame, meta) for the newest captured frame; meta has seq, ts_mono_ns,
+        ts (wall clock at capture) and age_ms. With after_seq, waits up to
+        `timeout` for a newer frame before returning the current one again.
+        Frames are never written to after capture, so no copy is made.
+        """
         if self.cap == "VIRTUAL":
-            # Generate a test pattern
-            img = np.zeros((720, 1280, 3), dtype=np.uint8)
-            # Draw some moving graphics based on time (mock)
-            import time
-            t = time.time()
-            cv2.putText(img, f"Virtual Camera Test {t:.2f}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-            # Moving rectangle
-            x = int((t * 100) % 1200)
-            cv2.rectangle(img, (x, 200), (x+100, 300), (0, 255, 0), -1)
-            return img
-
-        if self.cap is None or (isinstance(self.cap, cv2.VideoCapture) and not self.cap.isOpened()):
-             raise Exception("Camera not connected")
-        
-        ret, frame = self.cap.read()
-        if not ret:
-            raise Exception("Failed to read frame")
-        return frame
+            # Rendered on demand: capture time is the moment it is drawn
+            ts_mono_ns, ts = time.monotonic_ns(), time.time()
+            self._store(self._virtual_frame(), ts_mono_ns, ts)
+        elif self.cap is None or self._thread is None or not self._thread.is_alive():
+            raise Exception("Camera not connected")
+
+        deadline = time.monotonic() + max(timeout, 0.0)
+        first_deadline = time.monotonic() + first_frame_timeout
+        with self._cond:
+            while True:
+                latest = self._latest
+                now = time.monotonic()
+                if latest is None:
+                    if now >= first_deadline:
+                        raise Exception(self.last_error or "Failed to read frame")
+                    self._cond.wait(first_deadline - now)
+                    continue
+                if latest[1]["seq"] > after_seq or now >= deadline:
+                    break
+                self._cond.wait(deadline - now)
+            frame, meta = latest
+            if meta["seq"] == self._last_read_seq:
+                self.duplicates += 1
+            self._last_read_seq = max(self._last_read_seq, meta["seq"])
+            self._cond.notify_all()
+        meta = dict(meta)
+        meta["age_ms"] = round((time.monotonic_ns() - meta["ts_mono_ns"]) / 1e6, 3)
+        return frame, meta
+
+    def get_frame(self):
+        return self.get_frame_with_meta()[0]
+
+    def stats(self) -> dict:
+        with self._cond:
+            latest = self._latest
+            return {
+                "camera_id": self.current_camera_id,
+                "capturing": self._thread is not None and self._thread.is_alive(),
+                "seq": self._seq,
+                "captured": self.captured,
+                "dropped": self.dropped,
+                "duplicates": self.duplicates,
+                "read_errors": self.read_errors,
+                "last_error": self.last_error,
+                "frame_age_ms": round((time.monotonic_ns() - latest[1]["ts_mono_ns"]) / 1e6, 3) if latest else None,
+                "source": self.cap.status() if isinstance(self.cap, FileFrameSource) else None,
+            }
 
     def set_settings(self, exposure=None, gain=None):
         if self.cap is None or self.cap == "VIRTUAL":
             return
         
         # Note: exposure mapping depends on camera driver
-        if exposure is not None:
-             try:
-                self.cap.set(cv2.CAP_PROP_EXPOSURE, exposure)
-             except:
-                 pass
-        
-        if gain is not None:
-             try:
-                self.cap.set(cv2.CAP_PROP_GAIN, gain)
-             except:
-                 pass
+        with self._cap_lock:
+            if exposure is not None:
+                 try:
+                    self.cap.set(cv2.CAP_PROP_EXPOSURE, exposure)
+                 except:
+                     pass
+            
+            if gain is not None:
+                 try:
+                    self.cap.set(cv2.CAP_PROP_GAIN, gain)
+                 except:
+                     pass
 
     def release(self):
-        if self.cap is not None and isinstance(self.cap, cv2.VideoCapture):
-            self.cap.release()
+        with self.connect_lock:
+            self._release()
+
+    def _release(self):
+        # Stop the capture thread before the device goes away under it
+        stop, self._stop_capture = self._stop_capture, None
+        if stop is not None:
+            stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=2.0)
+            if thread.is_alive():
+                logger.warning("Camera capture thread did not stop in time")
+        if self.cap is not None and isinstance(self.cap, (cv2.VideoCapture, FileFrameSource)):
+            with self._cap_lock:
+                self.cap.release()
         self.cap = None
+        with self._cond:
+            self._latest = None
+            self._last_read_seq = self._seq
@@ -0,0 +1,187 @@
+"""
+Camera supervisor
+- Vigila la llegada de frames de CameraService fuera del camino de inspección
+- Estados publicados: disconnected, connected, degraded, reconnecting
+- Reconexión en segundo plano con backoff exponencial
+- La lectura del estado es un atributo: el pipeline nunca espera al supervisor
+"""
+
+import threading
+import time
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DISCONNECTED = "disconnected"
+CONNECTED = "connected"
+DEGRADED = "degraded"
+RECONNECTING = "reconnecting"
+
+
+class CameraSupervisor:
+    """
+    Polls the camera's capture stats every `interval` seconds. Frames older
+    than `stale_after_s` mark the camera degraded; older than `lost_after_s`
+    (or no capture thread at all) trigger a reconnect, retried with backoff
+    from `backoff_min_s` up to `backoff_max_s`. Lockstep file sources only
+    produce a frame once the previous one is consumed, so for them only read
+    errors count. `desired_camera` returns the camera id to keep connected,
+    or None when no camera is wanted.
+    """
+
+    def __init__(self, camera, desired_camera: Callable[[], Optional[int]],
+                 on_change: Optional[Callable[[str, str, dict], None]] = None,
+                 interval: float = 0.5, stale_after_s: float = 1.0, lost_after_s: float = 3.0,
+                 backoff_min_s: float = 0.5, backoff_max_s: float = 30.0):
+        self.camera = camera
+        self.desired_camera = desired_camera
+        self.on_change = on_change
+        self.interval = interval
+        self.stale_after_s = stale_after_s
+        self.lost_after_s = lost_after_s
+        self.backoff_min_s = backoff_min_s
+        self.backoff_max_s = backoff_max_s
+        self.state = DISCONNECTED
+        self.reconnects = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.next_attempt_in_s = 0.0
+        self._backoff = backoff_min_s
+        self._next_attempt = 0.0
+        self._connected_at = 0.0
+        self._read_errors = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="camera-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self):
+        """Re-checks now and retries without waiting out the backoff (e.g. after a settings change)."""
+        self._next_attempt = 0.0
+        self._backoff = self.backoff_min_s
+        self._wake.set()
+
+    def report_failure(self, error):
+        """Called from the frame path when a read fails; never blocks."""
+        self.last_error = str(error)
+        self._wake.set()
+
+    @property
+    def usable(self) -> bool:
+        return self.state in (CONNECTED, DEGRADED)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "camera_id": self.camera.current_camera_id,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "next_attempt_in_s": self.next_attempt_in_s,
+        }
+
+    def _set_state(self, new_state: str, info: Optional[dict] = None):
+        old, self.state = self.state, new_state
+        if old != new_state and self.on_change is not None:
+            try:
+                self.on_change(old, new_state, info or {})
+            except Exception as e:
+                logger.warning(f"Camera state callback failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._check()
+            except Exception as e:
+                logger.warning(f"Camera supervisor check failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _check(self):
+        camera_id = self.desired_camera()
+        if camera_id is None:
+            self.next_attempt_in_s = 0.0
+            self._set_state(DISCONNECTED)
+            return
+        if camera_id != self.camera.current_camera_id and self.camera.cap is not None:
+            # Selection changed: reconnect to the new device
+            self._reconnect(camera_id, "camera changed")
+            return
+        stats = self.camera.stats()
+        if stats["source"] is not None and stats["source"]["finished"]:
+            # A non-looping file source ended: nothing to reconnect to
+            self._set_state(DISCONNECTED, {"camera_id": camera_id, "reason": "source finished"})
+            return
+        if self.camera.cap == "VIRTUAL":
+            # Rendered on demand: nothing to supervise
+            self._set_state(CONNECTED)
+            return
+        if not stats["capturing"]:
+            self._reconnect(camera_id, self.last_error or "not capturing")
+            return
+        read_errors, self._read_errors = stats["read_errors"] - self._read_errors, stats["read_errors"]
+        if stats["source"] is not None and stats["source"]["lockstep"]:
+            # Frames are read only when consumed: an idle line ages the frame, it is not a lost camera
+            if read_errors > 0:
+                self._set_state(DEGRADED, {"read_errors": stats["read_errors"]})
+            else:
+                self._set_state(CONNECTED, {"camera_id": camera_id})
+            return
+        age_ms = stats["frame_age_ms"]
+        if age_ms is None:
+            # No frame yet since (re)connecting
+            age_ms = (time.monotonic() - self._connected_at) * 1000.0
+        if age_ms > self.lost_after_s * 1000.0:
+            self._reconnect(camera_id, f"no frames for {self.lost_after_s:.1f}s")
+        elif age_ms > self.stale_after_s * 1000.0:
+            self._set_state(DEGRADED, {"frame_age_ms": age_ms, "read_errors": stats["read_errors"]})
+        else:
+            self._backoff = self.backoff_min_s
+            self.next_attempt_in_s = 0.0
+            self._set_state(CONNECTED, {"camera_id": camera_id})
+
+    def _reconnect(self, camera_id: int, reason: str):
+        now = time.monotonic()
+        if now < self._next_attempt:
+            self.next_attempt_in_s = round(self._next_attempt - now, 2)
+            return
+        with self.camera.connect_lock:
+            if self.desired_camera() != camera_id:
+                # Switched while this check ran; the next check uses the new selection
+                return
+            self._set_state(RECONNECTING, {"camera_id": camera_id, "reason": reason})
+            self._connect(camera_id, reason)
+
+    def _connect(self, camera_id: int, reason: str):
+        try:
+            self.camera.connect(camera_id, fallback_to_virtual=False)
+            self._connected_at = time.monotonic()
+            self.reconnects += 1
+            self.last_error = None
+            self._backoff = self.backoff_min_s
+            self._next_attempt = 0.0
+            self.next_attempt_in_s = 0.0
+            # Connected, but only healthy once frames arrive (next check)
+            self._set_state(DEGRADED, {"camera_id": camera_id, "reconnected": True})
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            self.camera.release()
+            self._next_attempt = time.monotonic() + self._backoff
+            self.next_attempt_in_s = round(self._backoff, 2)
+            logger.warning(f"Camera {camera_id} reconnect failed ({reason}): {e}; retry in {self._backoff:.1f}s")
+            self._backoff = min(self._backoff * 2.0, self.backoff_max_s)
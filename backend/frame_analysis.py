@@ -0,0 +1,209 @@
+"""
+Frame analysis (registration → diff → blobs → severity → color sample)
+- Sin estado global: recibe Inspector, maestro y receta
+- Grafo de etapas: register → diff | color, diagnostics en paralelo (ver stages.py)
+- Se ejecuta en el proceso principal o en un proceso worker (ver inspection_worker.py)
+- El proceso principal conserva las actualizaciones de SystemState
+"""
+
+import time
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from diagnostics import Diagnostics
+from inspection import Inspector, RoiPlan, empty_defects
+from lanes import LaneInspector, compile_lanes
+from stages import Stage, StageGraph
+
+
+def color_patch(recipe: dict, aligned: np.ndarray) -> np.ndarray:
+    """First recipe color ROI, or a 100x100 centre crop."""
+    color_rois = recipe.get("color_rois") or []
+    if color_rois:
+        r = color_rois[0]
+        x1 = int(r.get("x", 0))
+        y1 = int(r.get("y", 0))
+        x2 = min(aligned.shape[1], x1 + int(r.get("w", 0)))
+        y2 = min(aligned.shape[0], y1 + int(r.get("h", 0)))
+        return aligned[y1:y2, x1:x2]
+    h, w = aligned.shape[:2]
+    cy, cx = h // 2, w // 2
+    roi_size = 50
+    return aligned[max(0, cy - roi_size):min(h, cy + roi_size), max(0, cx - roi_size):min(w, cx + roi_size)]
+
+
+def _register(ctx: dict):
+    inspector, recipe = ctx["inspector"], ctx["recipe"]
+    tolerances = recipe.get("tolerances", {})
+    alignment = recipe.get("alignment") or {}
+    # Alignment and detection options (validated when the recipe is loaded or saved)
+    inspector.configure_recipe(recipe)
+    roi_plan = ctx["roi_plan"]
+    aligned, transform = inspector.align_images(
+        ctx["master"],
+        ctx["live"],
+        mode=alignment.get("mode", "full"),
+        regions=roi_plan.warp_boxes if roi_plan else None
+    )
+    partial_warp = inspector.last_partial_warp
+
+    # Registration checks
+    max_shift = float(tolerances.get("max_allowed_shift_px", 20))
+    allowed_rotation = float(tolerances.get("allowed_rotation_deg", 1.0))
+    allowed_stretch_ppm = float(tolerances.get("allowed_stretch_ppm", 500.0))
+    dx = abs(transform.get("dx", 0.0))
+    dy = abs(transform.get("dy", 0.0))
+    rot = abs(transform.get("rotation_deg", 0.0))
+    scale_x = transform.get("scale_x", 1.0)
+    stretch_ppm = abs(scale_x - 1.0) * 1_000_000
+    if dx > max_shift or dy > max_shift or rot > allowed_rotation or stretch_ppm > allowed_stretch_ppm:
+        inspector.last_registration_ok = False
+        inspector.reset_tracking()
+    return {
+        "aligned": aligned,
+        "transform": transform,
+        "registration_ok": inspector.last_registration_ok,
+        "registration_method": inspector.last_registration_method,
+        "match_count": inspector.last_match_count,
+        "match_stats": inspector.last_match_stats,
+        "partial_warp": partial_warp,
+    }
+
+
+def _diagnostics(ctx: dict):
+    return Diagnostics.calculate_image_quality(ctx["live"])
+
+
+def _diff(ctx: dict):
+    inspector, recipe, master = ctx["inspector"], ctx["recipe"], ctx["master"]
+    aligned = ctx["register"]["aligned"]
+    roi_plan = ctx["roi_plan"]
+    tolerances = recipe.get("tolerances", {})
+    diff_threshold = int(tolerances.get("diff_threshold", 30))
+    min_blob_area = int(tolerances.get("min_blob_area_px", 50))
+    rules = recipe.get("defect_rules", {})
+    crit_area = rules.get("critical_area_px", ctx["critical_area"])
+    major_area = rules.get("major_area_px", 200)
+
+    # Screening (default off) and its options were set from this recipe in _register
+    detection = recipe.get("detection") or {}
+
+    # Lane mode: each lane strip gets its own diff/blob/severity/color pass
+    lanes = []
+    lane_inspector = ctx["lane_inspector"]
+    if detection.get("lanes") and lane_inspector is not None:
+        lanes = compile_lanes(recipe, master.shape, diff_threshold, min_blob_area, crit_area, major_area)
+    lane_results = None
+    if len(lanes) > 1:
+        diff, thresh, heatmap, lane_results = lane_inspector.inspect(master, aligned, lanes, roi=roi_plan)
+        defects = np.concatenate([r.defects for r in lane_results]) if lane_results else empty_defects()
+    else:
+        # Include/exclude ROIs are applied as a mask inside compare_images
+        diff, thresh, heatmap, defects = inspector.compare_images(
+            master,
+            aligned,
+            diff_threshold=diff_threshold,
+            min_blob_area=min_blob_area,
+            roi=roi_plan,
+            pyramid=ctx["pyramid"]
+        )
+
+    # Cavity and severity are computed over the whole defect array at once
+    cavity_index = None
+    if lane_results is not None:
+        cavity_index = np.concatenate([np.full(len(r.defects), r.lane.lane_id, dtype=np.int64) for r in lane_results])
+        severities = np.concatenate([r.severities for r in lane_results])
+    else:
+        width = master.shape[1]
+        lane_count = ctx["lane_count"]
+        if lane_count > 1 and width > 0:
+            cavity_index = np.clip((defects["x"] / width * lane_count).astype(np.int64) + 1, 1, lane_count)
+        severities = np.select([defects["area"] >= crit_area, defects["area"] >= major_area], ["critical", "major"], "minor")
+
+    lanes_raw = None
+    if lane_results is not None:
+        lanes_raw = [{
+            "lane_id": r.lane.lane_id,
+            "x": r.lane.x,
+            "w": r.lane.w,
+            "defect_count": int(len(r.defects)),
+            "critical_count": int((r.severities == "critical").sum()),
+            "timing_ms": round(r.timing_ms, 2),
+            "mean_bgr": tuple(r.mean_bgr) if r.mean_bgr is not None else None
+        } for r in lane_results]
+
+    return {
+        "heatmap": heatmap,
+        "defects": defects,
+        "severities": severities,
+        "cavity_index": cavity_index,
+        "lanes": lanes_raw,
+        "screen_stats": inspector.last_screen_stats,
+    }
+
+
+def _color(ctx: dict):
+    # Color sample (Lab conversion and recording stay with the ColorMonitor owner)
+    patch = color_patch(ctx["recipe"], ctx["register"]["aligned"])
+    return tuple(cv2.mean(patch)[:3]) if patch.size > 0 else None
+
+
+def build_analysis_graph(workers: int = 1) -> StageGraph:
+    """register → diff / color in parallel; diagnostics only needs the acquired frame."""
+    return StageGraph([
+        Stage("register", _register, required=True),
+        Stage("diagnostics", _diagnostics),
+        Stage("diff", _diff, after=("register",), required=True),
+        Stage("color", _color, after=("register",)),
+    ], workers=workers)
+
+
+def analyze_frame(inspector: Inspector, lane_inspector: Optional[LaneInspector], master: np.ndarray,
+                  pyramid: Optional[List[np.ndarray]], live_img: np.ndarray, recipe: dict,
+                  roi_plan: Optional[RoiPlan], lane_count: int, default_critical_area: float,
+                  graph: Optional[StageGraph] = None) -> dict:
+    """
+    Runs the image side of one inspection cycle through the stage graph and
+    returns plain data: aligned/heatmap images (aligned covers only the ROIs
+    when partial_warp holds a homography), transform and registration
+    status, the defect array with severities and cavity indexes, the color
+    patch mean (BGR), image diagnostics, raw per-lane results and stage timings.
+    """
+    start = time.perf_counter()
+    recipe = recipe or {}
+    graph = graph or build_analysis_graph()
+    ctx = {
+        "inspector": inspector,
+        "lane_inspector": lane_inspector,
+        "master": master,
+        "pyramid": pyramid,
+        "live": live_img,
+        "recipe": recipe,
+        "roi_plan": roi_plan,
+        "lane_count": lane_count,
+        "critical_area": default_critical_area,
+    }
+    timings = graph.run(ctx, overrides=recipe.get("stages"))
+    register, diff = ctx["register"], ctx["diff"]
+
+    return {
+        "aligned": register["aligned"],
+        "heatmap": diff["heatmap"],
+        "transform": register["transform"],
+        "registration_ok": register["registration_ok"],
+        "registration_method": register["registration_method"],
+        "match_count": register["match_count"],
+        "match_stats": register["match_stats"],
+        "partial_warp": register["partial_warp"],
+        "screen_stats": diff["screen_stats"],
+        "defects": diff["defects"],
+        "severities": diff["severities"],
+        "cavity_index": diff["cavity_index"],
+        "mean_bgr": ctx["color"],
+        "diagnostics": ctx["diagnostics"],
+        "lanes": diff["lanes"],
+        "stages_ms": timings,
+        "analysis_ms": round((time.perf_counter() - start) * 1000.0, 2),
+    }
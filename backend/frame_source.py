@@ -0,0 +1,212 @@
+"""
+File-backed camera source
+- Un vídeo o un directorio de imágenes se comporta como una cámara (read/isOpened/set/release)
+- Ritmo configurable en fps, o fps=0 para "lo más rápido posible" (sin perder frames)
+- Repetición en bucle opcional
+- Precarga opcional en una caché de frames en disco mapeada en memoria (np.memmap)
+"""
+
+import hashlib
+import json
+import os
+import time
+import logging
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+FRAME_CACHE_DIR = os.path.join("data", "frame_cache")
+
+
+class FileFrameSource:
+    """
+    Mimics the cv2.VideoCapture calls CameraService makes. read() paces
+    frames at `fps` (the video's own rate when None; 30 for image folders).
+    With fps=0 the source is `lockstep`: CameraService reads the next frame
+    only after the previous one was consumed, so nothing is dropped.
+    """
+
+    def __init__(self, path: str, fps: Optional[float] = None, loop: bool = True, preload: bool = False,
+                 cache_dir: str = FRAME_CACHE_DIR):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Source not found: {path}")
+        self.path = path
+        self.loop = loop
+        self.kind = "images" if os.path.isdir(path) else "video"
+        self.position = 0
+        self.loops = 0
+        self.finished = False
+        self._files: List[str] = []
+        self._video = None
+        self._cache: Optional[np.ndarray] = None
+        self._shape = None
+
+        native_fps = 30.0
+        if self.kind == "images":
+            self._files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+            if not self._files:
+                raise ValueError(f"No images in {path}")
+        else:
+            self._video = cv2.VideoCapture(path)
+            if not self._video.isOpened():
+                raise ValueError(f"Could not open video {path}")
+            native_fps = self._video.get(cv2.CAP_PROP_FPS) or native_fps
+        self.fps = native_fps if fps is None else float(fps)
+        self.lockstep = self.fps <= 0
+        self._next_due = 0.0
+
+        if preload:
+            self._cache = self._load_cache(cache_dir)
+            if self._video is not None:
+                self._video.release()
+                self._video = None
+
+    @property
+    def frame_count(self) -> Optional[int]:
+        if self._cache is not None:
+            return len(self._cache)
+        if self.kind == "images":
+            return len(self._files)
+        return int(self._video.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+
+    # --- VideoCapture surface ------------------------------------------------
+
+    def isOpened(self) -> bool:
+        return self._cache is not None or self._video is not None or bool(self._files)
+
+    def set(self, prop, value) -> bool:
+        # Resolution/exposure requests do not apply to recorded footage
+        return False
+
+    def read(self):
+        if self.finished:
+            return False, None
+        frame = self._next()
+        if frame is None and self.loop and self.position > 0:
+            self._rewind()
+            frame = self._next()
+        if frame is None:
+            self.finished = True
+            return False, None
+        self._pace()
+        return True, frame
+
+    def release(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+        self._cache = None
+        self._files = []
+
+    def status(self) -> dict:
+        return {
+            "kind": self.kind,
+            "path": self.path,
+            "fps": self.fps,
+            "lockstep": self.lockstep,
+            "loop": self.loop,
+            "preloaded": self._cache is not None,
+            "position": self.position,
+            "frames": self.frame_count,
+            "loops": self.loops,
+            "finished": self.finished,
+        }
+
+    # --- internals ---------------------------------------------------------------
+
+    def _next(self) -> Optional[np.ndarray]:
+        if self._cache is not None:
+            if self.position >= len(self._cache):
+                return None
+            frame = self._cache[self.position]
+        elif self.kind == "images":
+            frame = None
+            # Unreadable files are skipped, not fatal
+            while frame is None and self.position < len(self._files):
+                frame = self._decode(cv2.imread(self._files[self.position], cv2.IMREAD_COLOR))
+                if frame is None:
+                    self.position += 1
+            if frame is None:
+                return None
+        else:
+            ok, frame = self._video.read()
+            if not ok:
+                return None
+            frame = self._decode(frame)
+        self.position += 1
+        return frame
+
+    def _decode(self, frame: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Frames keep the first frame's size, like a fixed camera sensor."""
+        if frame is None:
+            return None
+        if self._shape is None:
+            self._shape = frame.shape
+        elif frame.shape != self._shape:
+            frame = cv2.resize(frame, (self._shape[1], self._shape[0]))
+        return frame
+
+    def _rewind(self):
+        self.position = 0
+        self.loops += 1
+        if self._video is not None:
+            if not self._video.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                self._video.release()
+                self._video = cv2.VideoCapture(self.path)
+
+    def _pace(self):
+        if self.lockstep:
+            return
+        interval = 1.0 / self.fps
+        now = time.monotonic()
+        if self._next_due > now:
+            time.sleep(self._next_due - now)
+            self._next_due += interval
+        else:
+            # Behind (slow decode or first frame): resync instead of bursting
+            self._next_due = now + interval
+
+    def _cache_key(self) -> str:
+        if self.kind == "images":
+            parts = [(os.path.basename(f), os.path.getsize(f), int(os.path.getmtime(f))) for f in self._files]
+        else:
+            parts = [self.path, os.path.getsize(self.path), int(os.path.getmtime(self.path))]
+        digest = hashlib.sha1(json.dumps([os.path.abspath(self.path), parts]).encode("utf-8")).hexdigest()
+        return digest[:16]
+
+    def _load_cache(self, cache_dir: str) -> np.ndarray:
+        """Decodes every frame once into <key>.bin; later opens only map the file."""
+        os.makedirs(cache_dir, exist_ok=True)
+        key = self._cache_key()
+        data_path = os.path.join(cache_dir, f"{key}.bin")
+        meta_path = os.path.join(cache_dir, f"{key}.json")
+        if os.path.exists(data_path) and os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as fh:
+                meta = json.load(fh)
+            self._shape = tuple(meta["shape"][1:])
+            return np.memmap(data_path, dtype=np.uint8, mode="r", shape=tuple(meta["shape"]))
+
+        start = time.perf_counter()
+        tmp_path = data_path + ".tmp"
+        count = 0
+        with open(tmp_path, "wb") as fh:
+            while True:
+                frame = self._next()
+                if frame is None:
+                    break
+                fh.write(np.ascontiguousarray(frame).tobytes())
+                count += 1
+        if count == 0:
+            os.remove(tmp_path)
+            raise ValueError(f"No decodable frames in {self.path}")
+        os.replace(tmp_path, data_path)
+        shape = (count,) + tuple(self._shape)
+        with open(meta_path, "w", encoding="utf-8") as fh:
+            json.dump({"path": os.path.abspath(self.path), "shape": shape}, fh)
+        logger.info(f"Frame cache {key}: {count} frames in {time.perf_counter() - start:.1f}s")
+        self.position = 0
+        return np.memmap(data_path, dtype=np.uint8, mode="r", shape=shape)
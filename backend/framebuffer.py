@@ -0,0 +1,317 @@
+"""
+Shared-memory frame ring
+- Slots de frame preasignados en multiprocessing.shared_memory
+- Número de secuencia y contador de referencias por slot
+- Captura, inspección, streaming y grabación leen el mismo buffer sin copiar
+"""
+
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Header layout (int64): [write_seq, latest_slot, drops] + per slot [seq, refs, ts_ns, h, w, c]
+_GLOBAL_FIELDS = 3
+_SLOT_FIELDS = 6
+_SEQ, _REFS, _TS, _H, _W, _C = range(_SLOT_FIELDS)
+_WRITING = -1
+
+
+class _Mapping:
+    """
+    Base object of every array built on a SharedMemory block. numpy views of a
+    buffer do not keep it mapped, but they do keep their base alive: the block
+    is unmapped (SharedMemory.__del__) only once the ring and every view of it
+    are gone.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        self.__array_interface__ = {"shape": (len(shm.buf),), "typestr": "|u1", "data": (address, False), "version": 3}
+
+
+class FrameRef:
+    """A held reference to one ring slot. Release it (or use `with`) when done."""
+
+    def __init__(self, ring: "FrameRing", slot: int, seq: int, array: np.ndarray, ts_ns: int):
+        self.ring = ring
+        self.slot = slot
+        self.seq = seq
+        self.array = array
+        self.ts_ns = ts_ns
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.ring._release(self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameRing:
+    """
+    Fixed ring of `slots` frames of at most `shape` (uint8 by default).
+    Writers reserve a free slot (refs == 0), fill it in place and publish it;
+    readers take references by sequence number. A slot is never reused while
+    referenced, so a reader's view stays valid until it releases it.
+
+    Thread-safe with the default lock. To share across processes, create the
+    ring with a multiprocessing.Lock and call FrameRing.attach(name, ...) with
+    the same lock in the other process.
+    """
+
+    def __init__(self, slots: int, shape: Tuple[int, int, int], dtype=np.uint8, name: Optional[str] = None,
+                 create: bool = True, lock=None):
+        self.slots = int(slots)
+        self.shape = tuple(int(v) for v in shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        header_nbytes = (_GLOBAL_FIELDS + self.slots * _SLOT_FIELDS) * 8
+        self._owner = create
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=header_nbytes + self.slots * self.slot_nbytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        raw = np.asarray(_Mapping(self._shm))
+        self._header = raw[:header_nbytes].view(np.int64)
+        self._frames = raw[header_nbytes:header_nbytes + self.slots * self.slot_nbytes].view(self.dtype).reshape((self.slots,) + self.shape)
+        self._slot_header = self._header[_GLOBAL_FIELDS:].reshape(self.slots, _SLOT_FIELDS)
+        if create:
+            self._header[:] = 0
+            self._header[1] = -1
+        self._lock = lock if lock is not None else threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._next = 0
+        self.retired = False
+
+    @classmethod
+    def attach(cls, name: str, slots: int, shape: Tuple[int, int, int], dtype=np.uint8, lock=None) -> "FrameRing":
+        return cls(slots, shape, dtype=dtype, name=name, create=False, lock=lock)
+
+    def fits(self, shape: tuple, dtype=np.uint8) -> bool:
+        shape = tuple(shape) + (1,) * (3 - len(shape))
+        return np.dtype(dtype) == self.dtype and all(a <= b for a, b in zip(shape, self.shape))
+
+    @property
+    def latest_seq(self) -> int:
+        return int(self._header[0])
+
+    @property
+    def drops(self) -> int:
+        return int(self._header[2])
+
+    # --- writer side -----------------------------------------------------------
+
+    def reserve(self, shape: tuple) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Reserves a free slot for writing and returns (slot, view) shaped `shape`.
+        Returns None (and counts a drop) when every slot is still referenced.
+        """
+        h, w = shape[:2]
+        c = shape[2] if len(shape) > 2 else 1
+        with self._lock:
+            if self.retired:
+                return None
+            latest = int(self._header[1])
+            for step in range(self.slots):
+                slot = (self._next + step) % self.slots
+                if slot != latest and self._slot_header[slot, _REFS] == 0:
+                    self._slot_header[slot, _REFS] = _WRITING
+                    self._next = (slot + 1) % self.slots
+                    break
+            else:
+                self._header[2] += 1
+                return None
+        return slot, self._view(slot, h, w, c, shape)
+
+    def publish(self, slot: int, shape: tuple, ts_ns: Optional[int] = None, hold: bool = True) -> Optional[FrameRef]:
+        """Publishes a reserved slot as the newest frame. With hold=True the writer keeps a reference."""
+        h, w = shape[:2]
+        c = shape[2] if len(shape) > 2 else 1
+        ts_ns = ts_ns if ts_ns is not None else time.monotonic_ns()
+        with self._cond:
+            seq = int(self._header[0]) + 1
+            self._slot_header[slot] = (seq, 1 if hold else 0, ts_ns, h, w, c)
+            self._header[0] = seq
+            self._header[1] = slot
+            self._cond.notify_all()
+        return FrameRef(self, slot, seq, self._view(slot, h, w, c, shape), ts_ns) if hold else None
+
+    def adopt(self, slot: int, seq: int) -> Optional[FrameRef]:
+        """
+        Takes over a reference published with hold=True by another process
+        (ownership moves with the (slot, seq) pair; the count is not changed).
+        """
+        with self._lock:
+            if self._slot_header is None or int(self._slot_header[slot, _SEQ]) != seq:
+                return None
+            _, _, ts_ns, h, w, c = (int(v) for v in self._slot_header[slot])
+        shape = (h, w, c) if c > 1 else (h, w)
+        return FrameRef(self, slot, seq, self._view(slot, h, w, c, shape), ts_ns)
+
+    def cancel(self, slot: int):
+        with self._lock:
+            self._slot_header[slot, _REFS] = 0
+
+    def write(self, frame: np.ndarray, ts_ns: Optional[int] = None, hold: bool = True) -> Optional[FrameRef]:
+        """Copies a frame that was produced elsewhere into the ring (one copy)."""
+        reserved = self.reserve(frame.shape)
+        if reserved is None:
+            return None
+        slot, view = reserved
+        np.copyto(view, frame)
+        return self.publish(slot, frame.shape, ts_ns=ts_ns, hold=hold)
+
+    # --- reader side -----------------------------------------------------------
+
+    def get(self, seq: int) -> Optional[FrameRef]:
+        """Reference to frame `seq`, or None if its slot has been reused."""
+        with self._lock:
+            if self._slot_header is None:
+                return None
+            matches = np.nonzero(self._slot_header[:, _SEQ] == seq)[0]
+            if seq <= 0 or len(matches) == 0:
+                return None
+            return self._take(int(matches[0]))
+
+    def latest(self) -> Optional[FrameRef]:
+        with self._lock:
+            if self._slot_header is None:
+                return None
+            slot = int(self._header[1])
+            return self._take(slot) if slot >= 0 else None
+
+    def wait_newer(self, after_seq: int, timeout: float = 1.0) -> Optional[FrameRef]:
+        """Blocks until a frame newer than after_seq is published, then references it."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self.retired and int(self._header[0]) <= after_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # Short waits so writers in other processes are noticed too
+                self._cond.wait(min(remaining, 0.01))
+            if self.retired:
+                return None
+            return self._take(int(self._header[1]))
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._slot_header is None:
+                return {"name": self.name, "closed": True}
+            refs = self._slot_header[:, _REFS]
+            return {
+                "name": self.name,
+                "slots": self.slots,
+                "shape": list(self.shape),
+                "latest_seq": int(self._header[0]),
+                "held_slots": int((refs > 0).sum()),
+                "drops": int(self._header[2]),
+            }
+
+    def retire(self):
+        """Stops new writes; held frames stay readable (and attachable by other processes)."""
+        with self._lock:
+            self.retired = True
+
+    def close(self, force: bool = False) -> bool:
+        """
+        Retires the ring and, as owner, unlinks it once no slot is referenced.
+        Returns False while references are held; call again later. Arrays
+        taken from the ring (results, stream renders) may outlive their
+        FrameRef: the memory is unmapped when the last of them is collected.
+        force=True unmaps it now, for an attached process that holds no views
+        of its own.
+        """
+        self.retire()
+        with self._lock:
+            if self._slot_header is None:
+                return True
+            if not force and (self._slot_header[:, _REFS] != 0).any():
+                return False
+            self._header = self._frames = self._slot_header = None
+            if force:
+                self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+            self._owner = False
+        return True
+
+    # --- internals -------------------------------------------------------------
+
+    def _view(self, slot: int, h: int, w: int, c: int, shape: tuple) -> np.ndarray:
+        view = self._frames[slot, :h, :w, :c]
+        return view if len(shape) > 2 else view[:, :, 0]
+
+    def _take(self, slot: int) -> Optional[FrameRef]:
+        seq, refs, ts_ns, h, w, c = (int(v) for v in self._slot_header[slot])
+        if refs == _WRITING or seq <= 0:
+            return None
+        self._slot_header[slot, _REFS] = refs + 1
+        shape = (h, w, c) if c > 1 else (h, w)
+        return FrameRef(self, slot, seq, self._view(slot, h, w, c, shape), ts_ns)
+
+    def _release(self, slot: int):
+        with self._lock:
+            if self._slot_header is not None and self._slot_header[slot, _REFS] > 0:
+                self._slot_header[slot, _REFS] -= 1
+
+
+def shm_available(nbytes: int, path: str = "/dev/shm") -> bool:
+    """True if the shared-memory filesystem can hold nbytes (always True where it can't be queried)."""
+    try:
+        stats = os.statvfs(path)
+    except (OSError, AttributeError):
+        return True
+    return stats.f_bavail * stats.f_frsize >= nbytes
+
+
+class SharedArrays:
+    """
+    Named read-only arrays packed into one shared-memory block (e.g. the master
+    and its pyramid). Create with a dict of arrays; other processes attach with
+    (name, manifest).
+    """
+
+    def __init__(self, arrays: Optional[dict] = None, name: Optional[str] = None, manifest: Optional[list] = None):
+        self._owner = arrays is not None
+        if arrays is not None:
+            manifest, offset = [], 0
+            for key, array in arrays.items():
+                manifest.append((key, tuple(array.shape), array.dtype.str, offset))
+                offset += (array.nbytes + 63) // 64 * 64
+            self._shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self.manifest = manifest
+        self.arrays = {}
+        for key, shape, dtype, offset in manifest:
+            view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._shm.buf, offset=offset)
+            if arrays is not None:
+                view[...] = arrays[key]
+            view.flags.writeable = False
+            self.arrays[key] = view
+
+    def close(self):
+        self.arrays = {}
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+            self._owner = False
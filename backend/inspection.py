@@ -1,76 +1,859 @@
 import cv2
 import numpy as np
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class MasterFeatures:
+    """ORB features of a master image, computed once per master."""
+    key: tuple
+    image: np.ndarray
+    gray: np.ndarray
+    points: np.ndarray  # (N, 2) float32 keypoint coordinates
+    descriptors: Optional[np.ndarray]
+    # Coarse-to-fine registration data, index 0 = full resolution
+    levels: List[np.ndarray] = field(default_factory=list)
+    level_points: List[np.ndarray] = field(default_factory=list)
+    level_descriptors: List[Optional[np.ndarray]] = field(default_factory=list)
+    level_corners: List[np.ndarray] = field(default_factory=list)
+    # Phase correlation: downscaled float master plus Hanning windows
+    phase_gray: Optional[np.ndarray] = None
+    phase_scale: float = 1.0
+    phase_windows: dict = field(default_factory=dict)
+    # Prepared FeatureMatcher instances keyed by (matcher name, level)
+    matchers: dict = field(default_factory=dict)
+
+
+class FeatureMatcher:
+    """
+    Matches live ORB descriptors against a fixed set of master descriptors.
+    prepare() runs once per master; match() returns index arrays
+    (master_idx, live_idx) of the accepted correspondences.
+    """
+    name = "base"
+
+    def prepare(self, master_descriptors: np.ndarray):
+        self.master_descriptors = master_descriptors
+        return self
+
+    def match(self, live_descriptors: np.ndarray, keep_ratio: float = 1.0):
+        raise NotImplementedError
+
+
+class CrossCheckMatcher(FeatureMatcher):
+    """Brute-force Hamming matching with cross-check, keeping the best keep_ratio."""
+    name = "bf"
+
+    def __init__(self):
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+
+    def match(self, live_descriptors: np.ndarray, keep_ratio: float = 1.0):
+        matches = self.matcher.match(self.master_descriptors, live_descriptors)
+        master_idx = np.fromiter((m.queryIdx for m in matches), dtype=np.int32, count=len(matches))
+        live_idx = np.fromiter((m.trainIdx for m in matches), dtype=np.int32, count=len(matches))
+        distances = np.fromiter((m.distance for m in matches), dtype=np.float32, count=len(matches))
+        keep = np.argsort(distances, kind="stable")[:int(len(matches) * keep_ratio)]
+        return master_idx[keep], live_idx[keep]
+
+
+class RatioTestMatcher(FeatureMatcher):
+    """Brute-force kNN (k=2) with Lowe's ratio test."""
+    name = "knn"
+
+    def __init__(self, ratio: float = 0.75):
+        self.ratio = ratio
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def _knn(self, live_descriptors: np.ndarray):
+        return self.matcher.knnMatch(live_descriptors, self.master_descriptors, k=2)
+
+    def match(self, live_descriptors: np.ndarray, keep_ratio: float = 1.0):
+        pairs = [p for p in self._knn(live_descriptors) if len(p) == 2]
+        if not pairs:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        best = np.array([(p[0].trainIdx, p[0].queryIdx, p[0].distance, p[1].distance) for p in pairs], dtype=np.float32)
+        good = best[:, 2] < self.ratio * best[:, 3]
+        return best[good, 0].astype(np.int32), best[good, 1].astype(np.int32)
+
+
+class LshMatcher(RatioTestMatcher):
+    """FLANN LSH index built once over the master descriptors, then kNN ratio test."""
+    name = "lsh"
+
+    def __init__(self, ratio: float = 0.75):
+        self.ratio = ratio
+        index_params = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)  # FLANN_INDEX_LSH
+        self.matcher = cv2.FlannBasedMatcher(index_params, dict(checks=50))
+
+    def prepare(self, master_descriptors: np.ndarray):
+        self.master_descriptors = master_descriptors
+        self.matcher.clear()
+        self.matcher.add([master_descriptors])
+        self.matcher.train()
+        return self
+
+    def _knn(self, live_descriptors: np.ndarray):
+        return self.matcher.knnMatch(live_descriptors, k=2)
+
+
+MATCHERS = {cls.name: cls for cls in (CrossCheckMatcher, RatioTestMatcher, LshMatcher)}
+
+@dataclass
+class RoiPlan:
+    """
+    Recipe ROIs compiled against the master geometry.
+    mask: 255 where pixels are inspected, 0 for excluded / not included pixels.
+    boxes: non-overlapping (x, y, w, h) regions that are diffed.
+    warp_boxes: boxes plus extra regions (color ROIs) that must be warped.
+    """
+    mask: np.ndarray
+    boxes: List[tuple]
+    warp_boxes: List[tuple]
+    coverage: float
+
+
+def _roi_rect(roi: dict, width: int, height: int) -> Optional[tuple]:
+    if "bounds" in roi and roi.get("bounds"):
+        x1, y1, x2, y2 = [int(v) for v in roi["bounds"]]
+    else:
+        x1, y1 = int(roi.get("x", 0)), int(roi.get("y", 0))
+        x2, y2 = x1 + int(roi.get("w", 0)), y1 + int(roi.get("h", 0))
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(width, x2), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def merge_boxes(boxes: List[tuple]) -> List[tuple]:
+    """Merges overlapping (x, y, w, h) boxes into their bounding union."""
+    merged = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        out = []
+        for box in merged:
+            x, y, w, h = box
+            for i, (ox, oy, ow, oh) in enumerate(out):
+                if x < ox + ow and ox < x + w and y < oy + oh and oy < y + h:
+                    nx, ny = min(x, ox), min(y, oy)
+                    out[i] = (nx, ny, max(x + w, ox + ow) - nx, max(y + h, oy + oh) - ny)
+                    changed = True
+                    break
+            else:
+                out.append(box)
+        merged = out
+    return merged
+
+
+def compile_roi_plan(recipe: dict, shape: tuple) -> Optional[RoiPlan]:
+    """
+    Compiles recipe include/exclude ROIs into a mask and bounding boxes.
+    Returns None when the whole frame is inspected.
+    """
+    height, width = shape[:2]
+    rois = recipe.get("inspection_rois") or recipe.get("rois") or []
+    includes = [r for r in rois if r.get("type", "include") == "include"]
+    excludes = list(recipe.get("exclude_rois") or []) + [r for r in rois if r.get("type") == "exclude"]
+
+    include_rects = [rect for rect in (_roi_rect(r, width, height) for r in includes) if rect]
+    exclude_rects = [rect for rect in (_roi_rect(r, width, height) for r in excludes) if rect]
+    if not include_rects and not exclude_rects:
+        return None
+
+    if include_rects:
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for x, y, w, h in include_rects:
+            mask[y:y + h, x:x + w] = 255
+        boxes = merge_boxes(include_rects)
+    else:
+        mask = np.full((height, width), 255, dtype=np.uint8)
+        boxes = [(0, 0, width, height)]
+    for x, y, w, h in exclude_rects:
+        mask[y:y + h, x:x + w] = 0
+
+    # Color ROIs (or the default centre patch) are measured on the aligned frame
+    color_rects = [rect for rect in (_roi_rect(r, width, height) for r in (recipe.get("color_rois") or [])) if rect]
+    if not color_rects:
+        cx, cy = width // 2, height // 2
+        color_rects = [_roi_rect({"x": cx - 50, "y": cy - 50, "w": 100, "h": 100}, width, height)]
+    if (recipe.get("detection") or {}).get("lanes"):
+        # Lane mode samples each lane's own color patch from the aligned frame
+        from lanes import lane_color_boxes
+        color_rects += lane_color_boxes(recipe, shape)
+    warp_boxes = merge_boxes(boxes + [r for r in color_rects if r])
+    coverage = float(cv2.countNonZero(mask)) / float(width * height)
+    return RoiPlan(mask=mask, boxes=boxes, warp_boxes=warp_boxes, coverage=coverage)
+
+
+# Blob stage output: one row per defect, converted to dicts only at the API edge
+DEFECT_DTYPE = np.dtype([
+    ("x", np.int32), ("y", np.int32), ("w", np.int32), ("h", np.int32),
+    ("area", np.float64), ("cx", np.float32), ("cy", np.float32), ("mean_diff", np.float32)
+])
+
+
+def empty_defects() -> np.ndarray:
+    return np.zeros(0, dtype=DEFECT_DTYPE)
+
+
+def defects_to_dicts(defects: np.ndarray, **columns) -> List[dict]:
+    """
+    Converts a DEFECT_DTYPE array to the JSON dicts used by the API.
+    Extra keyword arrays (e.g. cavity_index=...) are added per row.
+    """
+    names = DEFECT_DTYPE.names
+    rows = defects.tolist()
+    extra = {key: (values.tolist() if isinstance(values, np.ndarray) else list(values)) for key, values in columns.items() if values is not None}
+    out = []
+    for i, row in enumerate(rows):
+        item = dict(zip(names, row))
+        for key, values in extra.items():
+            item[key] = values[i]
+        out.append(item)
+    return out
+
+
+def _load_frame(source) -> np.ndarray:
+    """Batch frame source (array, file path or encoded bytes) -> BGR image."""
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+    elif isinstance(source, (str, os.PathLike)):
+        image = cv2.imread(os.fspath(source), cv2.IMREAD_COLOR)
+    else:
+        raise TypeError(f"Unsupported frame source: {type(source).__name__}")
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+
+def _component_stats(labels_count: int, labels: np.ndarray, stats: np.ndarray, centroids: np.ndarray, thresh: np.ndarray, gray_diff: np.ndarray, offset=(0, 0)) -> np.ndarray:
+    """Converts connectedComponentsWithStats output (background dropped) to DEFECT_DTYPE."""
+    count = labels_count - 1
+    blobs = np.zeros(count, dtype=DEFECT_DTYPE)
+    if count <= 0:
+        return blobs
+    on = thresh > 0
+    diff_sum = np.bincount(labels[on], weights=gray_diff[on], minlength=labels_count)[1:]
+    area = stats[1:, cv2.CC_STAT_AREA].astype(np.float64)
+    blobs["x"] = stats[1:, cv2.CC_STAT_LEFT] + offset[0]
+    blobs["y"] = stats[1:, cv2.CC_STAT_TOP] + offset[1]
+    blobs["w"] = stats[1:, cv2.CC_STAT_WIDTH]
+    blobs["h"] = stats[1:, cv2.CC_STAT_HEIGHT]
+    blobs["area"] = area
+    blobs["cx"] = centroids[1:, 0] + offset[0]
+    blobs["cy"] = centroids[1:, 1] + offset[1]
+    blobs["mean_diff"] = diff_sum / np.maximum(area, 1.0)
+    return blobs
+
+
+def label_components(thresh: np.ndarray):
+    """8-connected labelling with stats; the block-based (Grana/BBDT) scan is the fastest single-threaded."""
+    return cv2.connectedComponentsWithStatsWithAlgorithm(thresh, 8, cv2.CV_32S, cv2.CCL_GRANA)
+
+
+def extract_blobs(thresh: np.ndarray, gray_diff: np.ndarray, min_blob_area: int) -> np.ndarray:
+    """8-connected blobs of a binary map as a DEFECT_DTYPE array, area in pixels."""
+    n, labels, stats, centroids = label_components(thresh)
+    blobs = _component_stats(n, labels, stats, centroids, thresh, gray_diff)
+    return blobs[blobs["area"] > min_blob_area]
+
+
+# Opening kernel for the threshold map; tiles need a halo of at least 2 * radius
+OPEN_KERNEL = np.ones((5, 5), np.uint8)
+TILE_HALO_PX = 6
+
+ALIGN_MODES = ("full", "pyramid", "phase", "track")
+
+# Recipe "alignment" keys -> Inspector attributes
+ALIGN_OPTIONS = {
+    "matcher": "matcher_name",
+    "fallback": "phase_fallback",
+    "phase_min_response": "phase_min_response",
+    "phase_max_spread_px": "phase_max_spread_px",
+    "search_px": "pyramid_search_px",
+    "acquire_mode": "track_acquire_mode",
+    "reacquire_frames": "track_reacquire_frames",
+    "track_min_inliers": "track_min_inliers",
+    "track_max_error_px": "track_max_error_px",
+}
+
+# Recipe "detection" keys -> Inspector attributes
+DETECTION_OPTIONS = {
+    "screen": "screen_enabled",
+    "screen_level": "screen_level",
+    "screen_threshold": "screen_threshold",
+    "screen_pad_px": "screen_pad_px",
+    "screen_max_coverage": "screen_max_coverage",
+    "screen_max_candidates": "screen_max_candidates",
+}
+
+_TRUE_STRINGS = ("1", "true", "yes", "on")
+_FALSE_STRINGS = ("0", "false", "no", "off")
+
+
+def parse_option(key: str, value, default):
+    """Recipe value -> the type of the attribute's default; ValueError when it does not fit."""
+    if isinstance(default, bool):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in _TRUE_STRINGS + _FALSE_STRINGS:
+            return value.strip().lower() in _TRUE_STRINGS
+        raise ValueError(f"Option '{key}' expects a boolean, got {value!r}")
+    if isinstance(default, int):
+        if isinstance(value, bool):
+            raise ValueError(f"Option '{key}' expects an integer, got {value!r}")
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str):
+            try:
+                return int(value.strip())
+            except ValueError:
+                pass
+        raise ValueError(f"Option '{key}' expects an integer, got {value!r}")
+    if isinstance(default, float):
+        if isinstance(value, bool):
+            raise ValueError(f"Option '{key}' expects a number, got {value!r}")
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Option '{key}' expects a number, got {value!r}")
+    if not isinstance(value, str):
+        raise ValueError(f"Option '{key}' expects a string, got {value!r}")
+    return value
+
+
+def warp_to_master(live: np.ndarray, h: np.ndarray, shape: tuple) -> np.ndarray:
+    """Full-frame warp of the live image into master geometry."""
+    return cv2.warpPerspective(live, h, (shape[1], shape[0]))
+
 
 class Inspector:
     def __init__(self):
         # ORB detector for feature matching
         self.orb = cv2.ORB_create(nfeatures=5000)
-        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        self.matcher_name = "bf"
+        self.last_match_stats = {}
         self.last_registration_ok = True
         self.last_match_count = 0
         self.last_transform = {}
+        self.master_features: Optional[MasterFeatures] = None
+
+        # Pyramid registration: template search around projected master corners
+        self.pyramid_refine_points = 200
+        self.pyramid_patch_px = 7
+        self.pyramid_search_px = 4
+        self.pyramid_min_score = 0.6
+
+        # Phase correlation fast path (translation only)
+        self.phase_max_side = 512
+        self.phase_min_response = 0.2
+        self.phase_max_spread_px = 1.5
+        self.phase_fallback = "full"
+
+        # Temporal tracking seeded from the last good homography
+        self.track_acquire_mode = "full"
+        self.track_reacquire_frames = 50
+        self.track_min_inliers = 20
+        self.track_max_error_px = 1.5
+        self.last_homography: Optional[np.ndarray] = None
+        self.frames_since_acquire = 0
+        # Homography of the last ROI-only warp (None after a full-frame warp)
+        self.last_partial_warp: Optional[np.ndarray] = None
+
+        self.last_registration_method = "full"
+
+        # Two-stage detection: screen at a pyramid level, confirm at full resolution.
+        # screen_threshold 0 = diff_threshold // 3, low enough that blurred
+        # min-area blobs still pass at level 2.
+        self.screen_enabled = False
+        self.screen_level = 2
+        self.screen_threshold = 0
+        self.screen_pad_px = 16
+        self.screen_max_coverage = 0.5
+        self.screen_max_candidates = 512
+        self.last_screen_stats = {}
+
+        # Tiled comparison on a thread pool (1 worker = single full-frame pass)
+        self.compare_workers = 1
+        self.compare_tile_px = 512
+        self._compare_pool: Optional[ThreadPoolExecutor] = None
 
-    def align_images(self, master: np.ndarray, live: np.ndarray):
+        # Class defaults of every recipe option, restored before each configure()
+        self._option_defaults = {attr: getattr(self, attr) for table in (ALIGN_OPTIONS, DETECTION_OPTIONS) for attr in table.values()}
+        self._recipe_options = None  # alignment/detection options last applied by configure_recipe
+
+    def set_compare_workers(self, workers: int):
+        workers = max(1, int(workers or 1))
+        if workers == self.compare_workers and (workers == 1 or self._compare_pool is not None):
+            return
+        if self._compare_pool is not None:
+            self._compare_pool.shutdown(wait=False)
+            self._compare_pool = None
+        self.compare_workers = workers
+        if workers > 1:
+            self._compare_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compare")
+
+    def configure(self, options: dict, table: dict = ALIGN_OPTIONS):
         """
-        Aligns the live image to the master image using feature matching.
+        Applies recipe options (ALIGN_OPTIONS or DETECTION_OPTIONS): every
+        option of the table is reset to its default, then the given ones are
+        parsed and set. A bad value raises ValueError and changes nothing.
         """
-        # Convert to grayscale
-        gray_master = cv2.cvtColor(master, cv2.COLOR_BGR2GRAY)
+        values = self._parse_options(options, table)
+        self._recipe_options = None
+        for attr, value in values.items():
+            setattr(self, attr, value)
+
+    def _parse_options(self, options: dict, table: dict) -> dict:
+        values = {}
+        for key, attr in table.items():
+            default = self._option_defaults[attr]
+            value = options.get(key)
+            values[attr] = default if value is None else parse_option(key, value, default)
+        return values
+
+    def check_recipe(self, recipe: dict) -> dict:
+        """Parses a recipe's alignment and detection options; ValueError on a bad value."""
+        values = self._parse_options(recipe.get("alignment") or {}, ALIGN_OPTIONS)
+        values.update(self._parse_options(recipe.get("detection") or {}, DETECTION_OPTIONS))
+        return values
+
+    def configure_recipe(self, recipe: dict):
+        """
+        Applies a recipe's alignment and detection options (see configure).
+        Called per frame, but only re-parses when the options changed.
+        """
+        options = (recipe.get("alignment") or {}, recipe.get("detection") or {})
+        if options == self._recipe_options:
+            return
+        for attr, value in self.check_recipe(recipe).items():
+            setattr(self, attr, value)
+        self._recipe_options = (dict(options[0]), dict(options[1]))
+
+    def reset_tracking(self):
+        """Forces the next tracked frame to run a full re-acquisition."""
+        self.last_homography = None
+        self.frames_since_acquire = 0
+
+    def set_master(self, master: np.ndarray, key: tuple = None, pyramid: List[np.ndarray] = None) -> MasterFeatures:
+        """
+        Builds (or reuses) the feature cache for a new master.
+        The key identifies the master render, e.g. (master_hash, dpi, page_index).
+        """
+        cached = self.master_features
+        if cached is not None and key is not None and cached.key == key and cached.gray.shape == master.shape[:2]:
+            cached.image = master
+            return cached
+        self.reset_tracking()
+        self.master_features = self._extract_master_features(master, key, pyramid)
+        return self.master_features
+
+    def clear_master(self):
+        self.master_features = None
+
+    def inspect_batch(self, master: np.ndarray, frames, recipe: dict = None, workers: int = 4, key: tuple = None,
+                      pyramid: List[np.ndarray] = None, lane_count: int = 1, critical_area: float = 500.0):
+        """
+        Offline inspection of many frames against one master, without line state.
+        `frames` yields (name, source) with source an image array, a file path or
+        encoded image bytes. Frames run in parallel, each thread on its own
+        Inspector (tracking reset per frame, so results do not depend on
+        scheduling). Yields one plain dict per frame, in input order.
+        """
+        from frame_analysis import analyze_frame, build_analysis_graph
+        from lanes import LaneInspector
+
+        recipe = recipe or {}
+        key = key if key is not None else ("batch", id(master))
+        roi_plan = compile_roi_plan(recipe, master.shape)
+        local = threading.local()
+
+        def run(index: int, name: str, source):
+            start = time.perf_counter()
+            try:
+                if not hasattr(local, "inspector"):
+                    local.inspector = Inspector()
+                    local.inspector.set_master(master, key=key, pyramid=pyramid)
+                    local.lanes = LaneInspector(local.inspector)
+                    local.graph = build_analysis_graph()
+                image = _load_frame(source)
+                load_ms = (time.perf_counter() - start) * 1000.0
+                local.inspector.reset_tracking()
+                analysis = analyze_frame(local.inspector, local.lanes, master, pyramid, image, recipe,
+                                         roi_plan, lane_count, critical_area, graph=local.graph)
+            except Exception as e:
+                return {"index": index, "name": name, "ok": False, "error": str(e)}
+            defects = analysis["defects"]
+            return {
+                "index": index,
+                "name": name,
+                "ok": True,
+                "defect_count": int(len(defects)),
+                "defects": defects_to_dicts(defects, severity=analysis["severities"], cavity_index=analysis["cavity_index"]),
+                "registration_ok": analysis["registration_ok"],
+                "registration_method": analysis["registration_method"],
+                "match_count": analysis["match_count"],
+                "load_ms": round(load_ms, 2),
+                "stages_ms": analysis["stages_ms"],
+                "analysis_ms": analysis["analysis_ms"],
+            }
+
+        # Bounded look-ahead keeps memory flat for large batches; results stay in order
+        workers = max(1, int(workers or 1))
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+            for index, (name, source) in enumerate(frames):
+                pending.append(pool.submit(run, index, name, source))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _extract_master_features(self, master: np.ndarray, key: tuple = None, pyramid: List[np.ndarray] = None) -> MasterFeatures:
+        gray = cv2.cvtColor(master, cv2.COLOR_BGR2GRAY)
+        points, descriptors = self._detect(gray)
+        features = MasterFeatures(key=key, image=master, gray=gray, points=points, descriptors=descriptors)
+
+        levels = [gray]
+        for level in (pyramid or [])[1:]:
+            levels.append(cv2.cvtColor(level, cv2.COLOR_BGR2GRAY) if level.ndim == 3 else level)
+        features.levels = levels
+        for index, level in enumerate(levels):
+            if index == 0:
+                features.level_points.append(points)
+                features.level_descriptors.append(descriptors)
+            elif index == len(levels) - 1:
+                level_points, level_descriptors = self._detect(level)
+                features.level_points.append(level_points)
+                features.level_descriptors.append(level_descriptors)
+            else:
+                features.level_points.append(np.empty((0, 2), dtype=np.float32))
+                features.level_descriptors.append(None)
+            features.level_corners.append(self._refine_corners(level))
+
+        features.phase_scale = min(1.0, self.phase_max_side / float(max(gray.shape[:2])))
+        phase_size = (max(1, int(round(gray.shape[1] * features.phase_scale))), max(1, int(round(gray.shape[0] * features.phase_scale))))
+        features.phase_gray = cv2.resize(gray, phase_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        return features
+
+    def _detect(self, gray: np.ndarray):
+        keypoints, descriptors = self.orb.detectAndCompute(gray, None)
+        points = np.array([kp.pt for kp in keypoints], dtype=np.float32).reshape(-1, 2)
+        return points, descriptors
+
+    def _refine_corners(self, gray: np.ndarray) -> np.ndarray:
+        """Well-spread corners used as anchors when refining a homography."""
+        min_distance = max(4, min(gray.shape[:2]) // 50)
+        corners = cv2.goodFeaturesToTrack(gray, maxCorners=self.pyramid_refine_points, qualityLevel=0.01, minDistance=min_distance)
+        if corners is None:
+            return np.empty((0, 2), dtype=np.float32)
+        return corners.reshape(-1, 2).astype(np.float32)
+
+    def _get_master_features(self, master: np.ndarray) -> MasterFeatures:
+        """Returns cached features for this master, rebuilding them if the master changed."""
+        cached = self.master_features
+        if cached is None or cached.image is not master:
+            cached = self.set_master(master)
+        return cached
+
+    def align_images(self, master: np.ndarray, live: np.ndarray, mode: str = "full", regions: List[tuple] = None):
+        """
+        Aligns the live image to the master image.
+        Master features come from the per-master cache; only the live frame is processed.
+
+        Modes:
+        - full: ORB + brute-force matching + RANSAC at full resolution
+        - pyramid: ORB at the coarsest pyramid level, then template refinement
+          in a small window around projected corners at each finer level
+        - phase: FFT phase correlation on a downscaled image; falls back to
+          phase_fallback when the peak is weak or the quadrants disagree
+          (rotation/scale). "matches" then counts agreeing correlation windows.
+        - track: Lucas-Kanade tracking of master corners seeded with the last
+          good homography; re-acquires with track_acquire_mode after a
+          failure, drift, or every track_reacquire_frames frames.
+
+        The path actually used is left in last_registration_method.
+        When regions (x, y, w, h) are given, only those parts of the master
+        frame are warped; the rest of the aligned image stays black and
+        last_partial_warp keeps the homography for a full warp_to_master().
+        """
+        features = self._get_master_features(master)
         gray_live = cv2.cvtColor(live, cv2.COLOR_BGR2GRAY)
+        # Only paths that match points report stats; none carry over from an earlier frame
+        self.last_match_stats = {}
+
+        h = None
+        if mode == "track":
+            h, matches = self._estimate_tracked(features, gray_live)
+            if h is not None:
+                self.last_registration_method = "track"
+                self.last_match_count = matches
+                return self._apply_homography(master, live, h, matches, regions)
+            mode = self.track_acquire_mode
+
+        if mode == "phase":
+            h, matches = self._estimate_phase(features, gray_live)
+            if h is None:
+                mode = self.phase_fallback
+
+        if h is not None:
+            self.last_registration_method = "phase"
+        elif mode == "pyramid" and len(features.levels) > 1:
+            self.last_registration_method = "pyramid"
+            h, matches = self._estimate_pyramid(features, gray_live)
+        else:
+            self.last_registration_method = "full"
+            h, matches = self._estimate_features(features, 0, gray_live)
+
+        self.last_match_count = matches
+        self.frames_since_acquire = 0
+        if h is None:
+            self.last_homography = None
+            return self._registration_failed(master, live, matches)
+        return self._apply_homography(master, live, h, matches, regions)
+
+    def _estimate_tracked(self, features: MasterFeatures, gray_live: np.ndarray):
+        """
+        Predicts where the master corners land with the previous homography and
+        tracks them with sparse optical flow. Returns (None, 0) when a full
+        re-acquisition is needed.
+        """
+        if self.last_homography is None or self.frames_since_acquire >= self.track_reacquire_frames:
+            return None, 0
+        corners = features.level_corners[0] if features.level_corners else np.empty((0, 2), dtype=np.float32)
+        if len(corners) < self.track_min_inliers:
+            return None, 0
+        try:
+            h_inv = np.linalg.inv(self.last_homography)
+        except np.linalg.LinAlgError:
+            return None, 0
 
-        # Detect keypoints and descriptors
-        kp1, des1 = self.orb.detectAndCompute(gray_master, None)
-        kp2, des2 = self.orb.detectAndCompute(gray_live, None)
+        start = time.perf_counter()
+        master_pts = corners.reshape(-1, 1, 2)
+        predicted = cv2.perspectiveTransform(master_pts, h_inv).astype(np.float32)
+        tracked, status, _ = cv2.calcOpticalFlowPyrLK(
+            features.gray, gray_live, master_pts, predicted.copy(),
+            winSize=(21, 21), maxLevel=1,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+            flags=cv2.OPTFLOW_USE_INITIAL_FLOW
+        )
+        if tracked is None:
+            return None, 0
+        ok = status.reshape(-1) == 1
+        if int(ok.sum()) < self.track_min_inliers:
+            return None, 0
 
-        if des1 is None or des2 is None:
+        live_pts = tracked.reshape(-1, 2)[ok]
+        anchor_pts = corners[ok]
+        h, mask = cv2.findHomography(live_pts, anchor_pts, cv2.RANSAC, self.track_max_error_px * 2)
+        if h is None or mask is None:
+            return None, 0
+        inliers = mask.reshape(-1).astype(bool)
+        if int(inliers.sum()) < self.track_min_inliers or inliers.mean() < 0.5:
+            return None, 0
+
+        # Drift: reprojection error of the inliers under the new homography
+        projected = cv2.perspectiveTransform(live_pts[inliers].reshape(-1, 1, 2), h).reshape(-1, 2)
+        error = float(np.median(np.linalg.norm(projected - anchor_pts[inliers], axis=1)))
+        if error > self.track_max_error_px:
+            return None, 0
+
+        self.frames_since_acquire += 1
+        count = int(inliers.sum())
+        self.last_match_stats = {"matcher": "lk", "match_ms": round((time.perf_counter() - start) * 1000.0, 3),
+                                 "matches": len(live_pts), "inliers": count, "inlier_ratio": round(count / len(live_pts), 4)}
+        return h, count
+
+    def _get_matcher(self, features: MasterFeatures, level: int) -> Optional[FeatureMatcher]:
+        descriptors = features.level_descriptors[level] if features.level_descriptors else features.descriptors
+        if descriptors is None:
+            return None
+        key = (self.matcher_name, level)
+        matcher = features.matchers.get(key)
+        if matcher is None:
+            matcher = MATCHERS.get(self.matcher_name, CrossCheckMatcher)().prepare(descriptors)
+            features.matchers[key] = matcher
+        return matcher
+
+    def _estimate_features(self, features: MasterFeatures, level: int, gray_live: np.ndarray, keep_ratio: float = 0.15):
+        """ORB match against the master descriptors of a level and fit a homography live -> master."""
+        master_points = features.level_points[level] if features.level_points else features.points
+        matcher = self._get_matcher(features, level)
+        live_points, live_descriptors = self._detect(gray_live)
+
+        if matcher is None or live_descriptors is None:
             print("Warning: No features found")
-            self.last_registration_ok = False
-            self.last_match_count = 0
-            height, width, _ = master.shape
-            aligned_live = cv2.resize(live, (width, height)) if live.shape[:2] != (height, width) else live
-            return aligned_live, {"matches": 0, "dx": 0.0, "dy": 0.0, "rotation_deg": 0.0, "scale_x": 1.0, "scale_y": 1.0}
-
-        # Match descriptors
-        matches = self.matcher.match(des1, des2)
-        matches = sorted(matches, key=lambda x: x.distance)
-
-        # Keep top matches
-        num_matches = int(len(matches) * 0.15)
-        matches = matches[:num_matches]
-        self.last_match_count = len(matches)
-
-        if len(matches) < 4:
-            print("Warning: Not enough matches for homography")
-            self.last_registration_ok = False
-            height, width, _ = master.shape
-            aligned_live = cv2.resize(live, (width, height)) if live.shape[:2] != (height, width) else live
-            return aligned_live, {"matches": len(matches), "dx": 0.0, "dy": 0.0, "rotation_deg": 0.0, "scale_x": 1.0, "scale_y": 1.0}
+            self.last_match_stats = {"matcher": self.matcher_name, "match_ms": 0.0, "matches": 0, "inliers": 0, "inlier_ratio": 0.0}
+            return None, 0
+
+        start = time.perf_counter()
+        master_idx, live_idx = matcher.match(live_descriptors, keep_ratio=keep_ratio)
+        match_ms = (time.perf_counter() - start) * 1000.0
+        count = len(master_idx)
+        self.last_match_stats = {"matcher": matcher.name, "match_ms": round(match_ms, 3), "matches": count, "inliers": 0, "inlier_ratio": 0.0}
 
-        # Extract location of good matches
-        points1 = np.zeros((len(matches), 2), dtype=np.float32)
-        points2 = np.zeros((len(matches), 2), dtype=np.float32)
+        if count < 4:
+            print("Warning: Not enough matches for homography")
+            return None, count
 
-        for i, match in enumerate(matches):
-            points1[i, :] = kp1[match.queryIdx].pt
-            points2[i, :] = kp2[match.trainIdx].pt
+        # Vectorized gather of matched coordinates
+        points1 = master_points[master_idx]
+        points2 = live_points[live_idx]
 
         # Find Homography
         h, mask = cv2.findHomography(points2, points1, cv2.RANSAC)
+        if mask is not None:
+            inliers = int(mask.sum())
+            self.last_match_stats["inliers"] = inliers
+            self.last_match_stats["inlier_ratio"] = round(inliers / count, 4)
+        return h, count
+
+    def _phase_window(self, features: MasterFeatures, shape: tuple) -> np.ndarray:
+        window = features.phase_windows.get(shape)
+        if window is None:
+            window = cv2.createHanningWindow((shape[1], shape[0]), cv2.CV_32F)
+            features.phase_windows[shape] = window
+        return window
 
+    def _estimate_phase(self, features: MasterFeatures, gray_live: np.ndarray):
+        """
+        Translation-only homography from phase correlation. Returns (None, 0)
+        when the correlation peak is weak or the four quadrants report
+        different shifts, i.e. the frame is rotated or scaled.
+        """
+        small_master = features.phase_gray
+        sh, sw = small_master.shape[:2]
+        small_live = cv2.resize(gray_live, (sw, sh), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+        (sx, sy), response = cv2.phaseCorrelate(small_master, small_live, self._phase_window(features, (sh, sw)))
+        if response < self.phase_min_response:
+            return None, 0
+
+        qh, qw = sh // 2, sw // 2
+        quad_window = self._phase_window(features, (qh, qw))
+        max_spread = self.phase_max_spread_px * features.phase_scale
+        agreeing = 1
+        for y in (0, qh):
+            for x in (0, qw):
+                (qx, qy), _ = cv2.phaseCorrelate(
+                    small_master[y:y + qh, x:x + qw],
+                    small_live[y:y + qh, x:x + qw],
+                    quad_window
+                )
+                if abs(qx - sx) > max_spread or abs(qy - sy) > max_spread:
+                    return None, agreeing
+                agreeing += 1
+
+        # live full -> live small -> shifted back onto master small -> master full
+        lh, lw = gray_live.shape[:2]
+        mh, mw = features.gray.shape[:2]
+        to_small = np.array([[sw / lw, 0, 0], [0, sh / lh, 0], [0, 0, 1.0]])
+        shift = np.array([[1.0, 0, -sx], [0, 1.0, -sy], [0, 0, 1.0]])
+        to_master = np.array([[mw / sw, 0, 0], [0, mh / sh, 0], [0, 0, 1.0]])
+        return to_master @ shift @ to_small, agreeing
+
+    def _estimate_pyramid(self, features: MasterFeatures, gray_live: np.ndarray):
+        """Coarse-to-fine homography: full matching only at the coarsest level."""
+        live_levels = [gray_live]
+        for _ in range(len(features.levels) - 1):
+            live_levels.append(cv2.pyrDown(live_levels[-1]))
+
+        coarsest = len(features.levels) - 1
+        h, matches = self._estimate_features(
+            features,
+            coarsest,
+            live_levels[coarsest],
+            keep_ratio=1.0  # few features at the coarse level; let RANSAC reject outliers
+        )
         if h is None:
-            self.last_registration_ok = False
-            height, width, _ = master.shape
-            aligned_live = cv2.resize(live, (width, height)) if live.shape[:2] != (height, width) else live
-            return aligned_live, {"matches": len(matches), "dx": 0.0, "dy": 0.0, "rotation_deg": 0.0, "scale_x": 1.0, "scale_y": 1.0}
+            return None, matches
+
+        upscale = np.array([[2.0, 0, 0], [0, 2.0, 0], [0, 0, 1.0]])
+        downscale = np.array([[0.5, 0, 0], [0, 0.5, 0], [0, 0, 1.0]])
+        for level in range(coarsest - 1, -1, -1):
+            h = upscale @ h @ downscale
+            refined, refined_matches = self._refine_homography(h, features.levels[level], features.level_corners[level], live_levels[level])
+            if refined is not None:
+                h, matches = refined, refined_matches
+        return h, matches
 
+    def _refine_homography(self, h: np.ndarray, gray_master: np.ndarray, corners: np.ndarray, gray_live: np.ndarray):
+        """
+        Re-estimates h from master corners located by template matching
+        inside a small search window around their predicted live position.
+        """
+        if len(corners) < 8:
+            return None, 0
+        try:
+            h_inv = np.linalg.inv(h)
+        except np.linalg.LinAlgError:
+            return None, 0
+        predicted = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), h_inv).reshape(-1, 2)
+
+        patch = self.pyramid_patch_px
+        search = self.pyramid_search_px
+        mh, mw = gray_master.shape[:2]
+        lh, lw = gray_live.shape[:2]
+        master_pts = []
+        live_pts = []
+        for (mx, my), (px, py) in zip(corners, predicted):
+            mx, my = int(round(mx)), int(round(my))
+            px, py = int(round(px)), int(round(py))
+            if mx - patch < 0 or my - patch < 0 or mx + patch >= mw or my + patch >= mh:
+                continue
+            x0, y0 = px - patch - search, py - patch - search
+            x1, y1 = px + patch + search + 1, py + patch + search + 1
+            if x0 < 0 or y0 < 0 or x1 > lw or y1 > lh:
+                continue
+            template = gray_master[my - patch:my + patch + 1, mx - patch:mx + patch + 1]
+            result = cv2.matchTemplate(gray_live[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, loc = cv2.minMaxLoc(result)
+            if score < self.pyramid_min_score:
+                continue
+            master_pts.append((mx, my))
+            live_pts.append((x0 + loc[0] + patch, y0 + loc[1] + patch))
+
+        if len(master_pts) < 8:
+            return None, len(master_pts)
+        refined, mask = cv2.findHomography(np.float32(live_pts), np.float32(master_pts), cv2.RANSAC, 2.0)
+        if refined is None or mask is None or int(mask.sum()) < 8:
+            return None, len(master_pts)
+        # Refinement must stay within the search window of the prediction
+        drift = cv2.perspectiveTransform(predicted.reshape(-1, 1, 2), refined).reshape(-1, 2) - corners
+        if float(np.abs(drift).max()) > 2 * search + 1:
+            return None, len(master_pts)
+        return refined, int(mask.sum())
+
+    def _registration_failed(self, master: np.ndarray, live: np.ndarray, matches: int):
+        self.last_registration_ok = False
+        self.last_partial_warp = None
+        height, width, _ = master.shape
+        aligned_live = cv2.resize(live, (width, height)) if live.shape[:2] != (height, width) else live
+        return aligned_live, {"matches": matches, "dx": 0.0, "dy": 0.0, "rotation_deg": 0.0, "scale_x": 1.0, "scale_y": 1.0}
+
+    def _apply_homography(self, master: np.ndarray, live: np.ndarray, h: np.ndarray, matches: int, regions: List[tuple] = None):
         self.last_registration_ok = True
+        self.last_homography = h
         dx = float(h[0, 2])
         dy = float(h[1, 2])
         rotation_deg = float(np.degrees(np.arctan2(h[1, 0], h[0, 0])))
         scale_x = float(np.sqrt(h[0, 0] ** 2 + h[1, 0] ** 2))
         scale_y = float(np.sqrt(h[0, 1] ** 2 + h[1, 1] ** 2))
         self.last_transform = {
-            "matches": len(matches),
+            "matches": matches,
             "dx": dx,
             "dy": dy,
             "rotation_deg": rotation_deg,
@@ -80,16 +863,41 @@ class Inspector:
 
         # Warps live image to match master
         height, width, channels = master.shape
-        aligned_live = cv2.warpPerspective(live, h, (width, height))
+        if not regions:
+            self.last_partial_warp = None
+            return warp_to_master(live, h, master.shape), self.last_transform
 
+        self.last_partial_warp = h
+        aligned_live = np.zeros_like(master)
+        for x, y, w, bh in regions:
+            shifted = np.array([[1.0, 0, -x], [0, 1.0, -y], [0, 0, 1.0]]) @ h
+            aligned_live[y:y + bh, x:x + w] = cv2.warpPerspective(live, shifted, (w, bh))
         return aligned_live, self.last_transform
 
-    def compare_images(self, master: np.ndarray, aligned_live: np.ndarray, diff_threshold: int = 30, min_blob_area: int = 50):
+    def compare_images(self, master: np.ndarray, aligned_live: np.ndarray, diff_threshold: int = 30, min_blob_area: int = 50, roi: Optional[RoiPlan] = None, pyramid: Optional[List[np.ndarray]] = None):
         """
-        Compares two aligned images and returns the difference map and defect list.
+        Compares two aligned images and returns the difference map, threshold map,
+        heatmap and defects as a DEFECT_DTYPE structured array (area in pixels).
+        With an RoiPlan only its boxes are diffed and masked-out pixels are zeroed
+        before blob extraction. With compare_workers > 1 the work is split in
+        overlapping tiles on a thread pool. With screening enabled and the master
+        pyramid given, only candidate regions found at screen_level are diffed
+        at full resolution; outside them the maps stay zero and the heatmap shows
+        the upsampled screening diff.
         """
         if master.shape[:2] != aligned_live.shape[:2]:
             aligned_live = cv2.resize(aligned_live, (master.shape[1], master.shape[0]))
+        height, width = master.shape[:2]
+        self.last_screen_stats = {}
+        if self.screen_enabled and pyramid is not None and 0 < self.screen_level < len(pyramid):
+            boxes, screen_diff = self._screen_candidates(pyramid[self.screen_level], aligned_live, diff_threshold, roi)
+            if boxes is not None:
+                background = cv2.resize(screen_diff, (width, height), interpolation=cv2.INTER_LINEAR)
+                return self._compare_regions(master, aligned_live, boxes, roi.mask if roi is not None else None, diff_threshold, min_blob_area, background=background)
+        if roi is not None:
+            return self._compare_regions(master, aligned_live, roi.boxes, roi.mask, diff_threshold, min_blob_area)
+        if self.compare_workers > 1 and self._compare_pool is not None and max(height, width) > self.compare_tile_px:
+            return self._compare_regions(master, aligned_live, [(0, 0, width, height)], None, diff_threshold, min_blob_area)
         # Absolute difference
         diff = cv2.absdiff(master, aligned_live)
         
@@ -100,22 +908,218 @@ class Inspector:
         _, thresh = cv2.threshold(gray_diff, diff_threshold, 255, cv2.THRESH_BINARY)
         
         # Morphological operations to clean up noise
-        kernel = np.ones((5,5), np.uint8)
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, OPEN_KERNEL)
         
         # Generate Heatmap (JET colormap on difference)
         # Normalize diff for visualization
         norm_diff = cv2.normalize(gray_diff, None, 0, 255, cv2.NORM_MINMAX)
         heatmap = cv2.applyColorMap(norm_diff, cv2.COLORMAP_JET)
         
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        defects = []
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if area > min_blob_area: # Minimum defect size
-                x, y, w, h = cv2.boundingRect(cnt)
-                defects.append({"x": x, "y": y, "w": w, "h": h, "area": area})
-                
+        # Connected components with stats, no per-blob Python loop
+        defects = extract_blobs(thresh, gray_diff, min_blob_area)
         return diff, thresh, heatmap, defects
+
+    def _screen_candidates(self, master_small: np.ndarray, aligned_live: np.ndarray, diff_threshold: int, roi: Optional[RoiPlan]) -> Tuple[Optional[List[tuple]], np.ndarray]:
+        """
+        Low-resolution screening pass. Diffs the master pyramid level against
+        the aligned frame reduced the same way and returns padded full-resolution
+        (x, y, w, h) candidate boxes, or None when too much of the frame is
+        flagged (or too many candidates) and a normal full pass is cheaper,
+        together with the low-resolution gray diff.
+        """
+        height, width = aligned_live.shape[:2]
+        start = time.perf_counter()
+        small = aligned_live
+        for _ in range(self.screen_level):
+            small = cv2.pyrDown(small)
+        if small.shape[:2] != master_small.shape[:2]:
+            small = cv2.resize(small, (master_small.shape[1], master_small.shape[0]), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(cv2.absdiff(master_small, small), cv2.COLOR_BGR2GRAY)
+        level_threshold = self.screen_threshold or max(1, diff_threshold // 3)
+        _, candidates = cv2.threshold(gray, level_threshold, 255, cv2.THRESH_BINARY)
+        if roi is not None:
+            # Any include pixel inside a low-res cell keeps the cell
+            roi_small = cv2.resize(roi.mask, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_AREA)
+            candidates[roi_small == 0] = 0
+
+        n, _, stats, _ = label_components(candidates)
+        scale_x = width / float(gray.shape[1])
+        scale_y = height / float(gray.shape[0])
+        pad = self.screen_pad_px
+        x0 = np.clip(np.floor(stats[1:, cv2.CC_STAT_LEFT] * scale_x).astype(np.int64) - pad, 0, width)
+        y0 = np.clip(np.floor(stats[1:, cv2.CC_STAT_TOP] * scale_y).astype(np.int64) - pad, 0, height)
+        x1 = np.clip(np.ceil((stats[1:, cv2.CC_STAT_LEFT] + stats[1:, cv2.CC_STAT_WIDTH]) * scale_x).astype(np.int64) + pad, 0, width)
+        y1 = np.clip(np.ceil((stats[1:, cv2.CC_STAT_TOP] + stats[1:, cv2.CC_STAT_HEIGHT]) * scale_y).astype(np.int64) + pad, 0, height)
+        coverage = float(((x1 - x0) * (y1 - y0)).sum()) / float(width * height)
+        fallback = coverage > self.screen_max_coverage or n - 1 > self.screen_max_candidates
+        self.last_screen_stats = {
+            "level": self.screen_level,
+            "threshold": level_threshold,
+            "candidates": int(n - 1),
+            "coverage": round(coverage, 4),
+            "screen_ms": round((time.perf_counter() - start) * 1000.0, 2),
+            "fallback": fallback,
+        }
+        if fallback:
+            return None, gray
+        return merge_boxes(list(zip(x0.tolist(), y0.tolist(), (x1 - x0).tolist(), (y1 - y0).tolist()))), gray
+
+    def _split_tiles(self, boxes: List[tuple]) -> List[tuple]:
+        """Splits (x, y, w, h) boxes into (y0, y1, x0, x1) cores of at most compare_tile_px."""
+        tile = self.compare_tile_px if self._compare_pool is not None else None
+        cores = []
+        for x, y, w, h in boxes:
+            if tile is None:
+                cores.append((y, y + h, x, x + w))
+                continue
+            for y0 in range(y, y + h, tile):
+                for x0 in range(x, x + w, tile):
+                    cores.append((y0, min(y + h, y0 + tile), x0, min(x + w, x0 + tile)))
+        return cores
+
+    def _compare_regions(self, master: np.ndarray, aligned_live: np.ndarray, boxes: List[tuple], mask: Optional[np.ndarray], diff_threshold: int, min_blob_area: int,
+                         background: Optional[np.ndarray] = None):
+        """
+        Region/tile version of compare_images. Each core is processed with a
+        halo wide enough for the opening kernel, so the stitched threshold map
+        is identical to a full-frame pass. Components are labelled per core
+        into one global label map; components that touch across core edges
+        are merged afterwards, so the defect list matches single-threaded mode.
+        Pixels outside the boxes stay zero, except in the heatmap when a
+        full-frame gray `background` (the upsampled screening diff) is given.
+        """
+        height, width = master.shape[:2]
+        full_frame = mask is None and len(boxes) == 1 and boxes[0] == (0, 0, width, height)
+        alloc = np.empty_like if full_frame else np.zeros_like
+        diff = alloc(master)
+        heatmap = alloc(master)
+        gray_diff = background if background is not None else alloc(master[:, :, 0])
+        thresh = alloc(master[:, :, 0])
+        labels = np.zeros((height, width), dtype=np.int32)
+        cores = self._split_tiles(boxes)
+        # Disjoint label ranges per core: a core cannot hold more labels than pixels
+        bases = np.concatenate(([0], np.cumsum([(y1 - y0) * (x1 - x0) for y0, y1, x0, x1 in cores])))[:-1]
+
+        def process(index):
+            y0, y1, x0, x1 = cores[index]
+            hy0, hy1 = max(0, y0 - TILE_HALO_PX), min(height, y1 + TILE_HALO_PX)
+            hx0, hx1 = max(0, x0 - TILE_HALO_PX), min(width, x1 + TILE_HALO_PX)
+            d = cv2.absdiff(master[hy0:hy1, hx0:hx1], aligned_live[hy0:hy1, hx0:hx1])
+            g = cv2.cvtColor(d, cv2.COLOR_BGR2GRAY)
+            _, t = cv2.threshold(g, diff_threshold, 255, cv2.THRESH_BINARY)
+            if mask is not None:
+                t = cv2.bitwise_and(t, mask[hy0:hy1, hx0:hx1])
+            t = cv2.morphologyEx(t, cv2.MORPH_OPEN, OPEN_KERNEL)
+            inner = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+            t_core = np.ascontiguousarray(t[inner])
+            g_core = g[inner]
+            diff[y0:y1, x0:x1] = d[inner]
+            gray_diff[y0:y1, x0:x1] = g_core
+            thresh[y0:y1, x0:x1] = t_core
+            low, high, _, _ = cv2.minMaxLoc(g_core)
+
+            n, core_labels, stats, centroids = label_components(t_core)
+            base = int(bases[index])
+            labels[y0:y1, x0:x1] = np.where(core_labels > 0, core_labels + base, 0)
+            blobs = _component_stats(n, core_labels, stats, centroids, t_core, g_core, offset=(x0, y0))
+            ids = np.arange(1, n, dtype=np.int64) + base
+            return blobs, ids, low, high
+
+        run = self._compare_pool.map if self._compare_pool is not None else map
+        results = list(run(process, range(len(cores))))
+        if background is not None:
+            # Candidates at full resolution over the screening diff, on one color scale
+            heatmap = cv2.applyColorMap(cv2.normalize(gray_diff, None, 0, 255, cv2.NORM_MINMAX), cv2.COLORMAP_JET)
+        if not results:
+            return diff, thresh, heatmap, empty_defects()
+        low = min(r[2] for r in results)
+        high = max(r[3] for r in results)
+        alpha = 255.0 / (high - low) if high > low else 0.0
+
+        def colorize(core):
+            y0, y1, x0, x1 = core
+            norm = cv2.convertScaleAbs(gray_diff[y0:y1, x0:x1], alpha=alpha, beta=-low * alpha)
+            heatmap[y0:y1, x0:x1] = cv2.applyColorMap(norm, cv2.COLORMAP_JET)
+
+        if background is None:
+            list(run(colorize, cores))
+
+        blobs = np.concatenate([r[0] for r in results])
+        ids = np.concatenate([r[1] for r in results])
+        pairs = self._seam_pairs(labels, cores)
+        if len(pairs):
+            blobs = self._merge_components(blobs, ids, pairs)
+        blobs = blobs[blobs["area"] > min_blob_area]
+        order = np.lexsort((blobs["x"], blobs["y"]))
+        return diff, thresh, heatmap, blobs[order]
+
+    @staticmethod
+    def _seam_pairs(labels: np.ndarray, cores: List[tuple]) -> np.ndarray:
+        """(a, b) label pairs that are 8-connected across the left/top edge of a core."""
+        height, width = labels.shape
+        found = []
+        for y0, y1, x0, x1 in cores:
+            if x0 > 0:
+                inside = labels[y0:y1, x0]
+                for dy in (-1, 0, 1):
+                    rows = np.arange(y0, y1) + dy
+                    valid = (rows >= 0) & (rows < height)
+                    outside = np.zeros_like(inside)
+                    outside[valid] = labels[rows[valid], x0 - 1]
+                    hit = (inside > 0) & (outside > 0)
+                    if hit.any():
+                        found.append(np.stack([inside[hit], outside[hit]], axis=1))
+            if y0 > 0:
+                inside = labels[y0, x0:x1]
+                for dx in (-1, 0, 1):
+                    cols = np.arange(x0, x1) + dx
+                    valid = (cols >= 0) & (cols < width)
+                    outside = np.zeros_like(inside)
+                    outside[valid] = labels[y0 - 1, cols[valid]]
+                    hit = (inside > 0) & (outside > 0) & (inside != outside)
+                    if hit.any():
+                        found.append(np.stack([inside[hit], outside[hit]], axis=1))
+        if not found:
+            return np.empty((0, 2), dtype=np.int64)
+        pairs = np.unique(np.concatenate(found).astype(np.int64), axis=0)
+        return pairs[pairs[:, 0] != pairs[:, 1]]
+
+    @staticmethod
+    def _merge_components(blobs: np.ndarray, ids: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+        """Merges component rows linked by seam pairs (union-find over label ids)."""
+        parent = {}
+
+        def find(i):
+            parent.setdefault(i, i)
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for a, b in pairs.tolist():
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+
+        roots = np.array([find(i) if i in parent else i for i in ids.tolist()], dtype=np.int64)
+        unique_roots, group = np.unique(roots, return_inverse=True)
+        count = len(unique_roots)
+
+        area = np.bincount(group, weights=blobs["area"], minlength=count)
+        x1 = np.full(count, np.iinfo(np.int32).max, dtype=np.int64)
+        y1 = np.full(count, np.iinfo(np.int32).max, dtype=np.int64)
+        x2 = np.zeros(count, dtype=np.int64)
+        y2 = np.zeros(count, dtype=np.int64)
+        np.minimum.at(x1, group, blobs["x"])
+        np.minimum.at(y1, group, blobs["y"])
+        np.maximum.at(x2, group, blobs["x"].astype(np.int64) + blobs["w"])
+        np.maximum.at(y2, group, blobs["y"].astype(np.int64) + blobs["h"])
+
+        merged = np.zeros(count, dtype=DEFECT_DTYPE)
+        merged["x"], merged["y"] = x1, y1
+        merged["w"], merged["h"] = x2 - x1, y2 - y1
+        merged["area"] = area
+        merged["cx"] = np.bincount(group, weights=blobs["cx"] * blobs["area"], minlength=count) / area
+        merged["cy"] = np.bincount(group, weights=blobs["cy"] * blobs["area"], minlength=count) / area
+        merged["mean_diff"] = np.bincount(group, weights=blobs["mean_diff"] * blobs["area"], minlength=count) / area
+        return merged
@@ -0,0 +1,237 @@
+"""
+Process-pool inspection workers
+- El análisis de frame (Inspector + lanes) corre en procesos worker, fuera del GIL principal
+- Maestro y pirámide compartidos de solo lectura en memoria compartida
+- Frames vivos leídos del FrameRing; aligned/heatmap devueltos en un ring de resultados
+- El proceso principal conserva SystemState (color, contadores, alarmas, storage)
+"""
+
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from framebuffer import FrameRing, FrameRef, SharedArrays, shm_available
+from frame_analysis import analyze_frame, build_analysis_graph
+from inspection import Inspector, compile_roi_plan
+from lanes import LaneInspector
+
+logger = logging.getLogger(__name__)
+
+# Recipe fields the worker needs (ROI plan + analysis)
+JOB_RECIPE_KEYS = (
+    "tolerances", "alignment", "detection", "defect_rules", "lanes", "lane_count", "web_width_mm",
+    "rois", "inspection_rois", "exclude_rois", "color_rois", "stages",
+)
+
+# --- worker process side -------------------------------------------------------
+
+_worker = {}
+
+
+def _init_worker(lock):
+    # One OpenCV thread per process: the pool itself provides the parallelism
+    cv2.setNumThreads(1)
+    inspector = Inspector()
+    _worker.update(
+        lock=lock,
+        inspector=inspector,
+        lanes=LaneInspector(inspector),
+        graph=build_analysis_graph(),
+        rings={},
+        bundle=None,
+        master_key=None,
+        roi_key=None,
+        roi_plan=None,
+    )
+
+
+def _attach_ring(role: str, spec: tuple) -> FrameRing:
+    name, slots, shape = spec
+    ring = _worker["rings"].get(role)
+    if ring is None or ring.name != name:
+        # Rings are replaced when the frame shape changes; drop the stale attachment
+        if ring is not None:
+            ring.close(force=True)
+        ring = FrameRing.attach(name, slots, tuple(shape), lock=_worker["lock"])
+        _worker["rings"][role] = ring
+    return ring
+
+
+def _attach_master(spec: tuple):
+    key, name, manifest = spec
+    if _worker["master_key"] != key:
+        if _worker["bundle"] is not None:
+            _worker["inspector"].clear_master()
+            _worker["bundle"].close()
+        bundle = SharedArrays(name=name, manifest=manifest)
+        arrays = bundle.arrays
+        pyramid = [arrays[f"level{i}"] for i in range(len(arrays))]
+        _worker["inspector"].set_master(pyramid[0], key=key, pyramid=pyramid)
+        _worker.update(bundle=bundle, master_key=key, roi_key=None, roi_plan=None)
+    arrays = _worker["bundle"].arrays
+    return [arrays[f"level{i}"] for i in range(len(arrays))]
+
+
+def _analyze(job: dict) -> dict:
+    pyramid = _attach_master(job["master"])
+    master = pyramid[0]
+    recipe = job["recipe"]
+    roi_key = (job["master"][0], job["roi_key"])
+    if _worker["roi_key"] != roi_key:
+        _worker["roi_plan"] = compile_roi_plan(recipe, master.shape)
+        _worker["roi_key"] = roi_key
+
+    _worker["graph"].set_workers(job["stage_workers"])
+    live = _attach_ring("live", job["live_ring"]).get(job["live_seq"])
+    if live is None:
+        raise RuntimeError("Live frame superseded before analysis")
+    # The live slot stays held until aligned/heatmap no longer read it
+    # (a failed registration returns the live view itself as "aligned")
+    try:
+        analysis = analyze_frame(
+            _worker["inspector"], _worker["lanes"], master, pyramid, live.array, recipe,
+            _worker["roi_plan"], job["lane_count"], job["critical_area"], graph=_worker["graph"]
+        )
+        if job["result_ring"] is None:
+            # Pickled after this returns: detach from the live slot first
+            for key in ("aligned", "heatmap"):
+                if np.shares_memory(analysis[key], live.array):
+                    analysis[key] = analysis[key].copy()
+            return analysis
+        # Large images go back through shared memory; ownership of the slot moves to the main process
+        out = _attach_ring("result", job["result_ring"])
+        for key in ("aligned", "heatmap"):
+            image = analysis[key]
+            published = out.write(image, hold=True)
+            if published is not None:
+                analysis[key] = ("ring", published.slot, published.seq)
+            elif np.shares_memory(image, live.array):
+                analysis[key] = image.copy()
+        return analysis
+    finally:
+        live.release()
+
+
+# --- main process side ---------------------------------------------------------
+
+class ProcessInspector:
+    """
+    Pool of inspection worker processes. Jobs reference the live frame by ring
+    sequence number and the master by shared bundle; submit() returns a Future
+    whose analysis is turned back into arrays with resolve().
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, int(workers))
+        context = multiprocessing.get_context("spawn")
+        self.lock = context.Lock()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                         initializer=_init_worker, initargs=(self.lock,))
+        self._guard = threading.Lock()
+        self.result_ring: Optional[FrameRing] = None
+        self._bundle: Optional[Tuple[tuple, SharedArrays]] = None
+        self._retired: List[SharedArrays] = []
+        self._retired_rings: List[FrameRing] = []
+        self._inflight = {}
+
+    def set_master(self, key: tuple, pyramid: List[np.ndarray]):
+        """Publishes the master pyramid as a shared read-only bundle."""
+        bundle = SharedArrays({f"level{i}": level for i, level in enumerate(pyramid)})
+        with self._guard:
+            if self._bundle is not None:
+                self._retired.append(self._bundle[1])
+            self._bundle = (key, bundle)
+            shape = pyramid[0].shape
+            if self.result_ring is None or self.result_ring.shape != tuple(shape):
+                if self.result_ring is not None:
+                    self._retired_rings.append(self.result_ring)
+                    self.result_ring = None
+                # aligned + heatmap for every in-flight frame, the published result and readers;
+                # without room in /dev/shm the images are pickled back instead
+                slots = 2 * (self.workers + 3)
+                if shm_available(slots * int(np.prod(shape))):
+                    self.result_ring = FrameRing(slots, shape, lock=self.lock)
+            self._close_retired()
+
+    def submit(self, live: FrameRef, recipe: dict, lane_count: int, critical_area: float, stage_workers: int = 1) -> Future:
+        with self._guard:
+            if self._bundle is None:
+                raise RuntimeError("Master not shared with workers")
+            key, bundle = self._bundle
+            ring = self.result_ring
+            # Shared segments a queued job will attach to stay linked until it completes
+            names = [bundle.name] + ([ring.name] if ring is not None else [])
+            for name in names:
+                self._inflight[name] = self._inflight.get(name, 0) + 1
+        job_recipe = {k: recipe[k] for k in JOB_RECIPE_KEYS if k in recipe}
+        job = {
+            "master": (key, bundle.name, bundle.manifest),
+            "recipe": job_recipe,
+            "roi_key": json.dumps([job_recipe.get(k) for k in ("rois", "inspection_rois", "exclude_rois", "color_rois")], sort_keys=True, default=str),
+            "live_ring": (live.ring.name, live.ring.slots, live.ring.shape),
+            "live_seq": live.seq,
+            "result_ring": (ring.name, ring.slots, ring.shape) if ring is not None else None,
+            "lane_count": lane_count,
+            "critical_area": critical_area,
+            "stage_workers": stage_workers,
+        }
+        future = self._pool.submit(_analyze, job)
+        future.add_done_callback(lambda _: self._done(names))
+        future.result_ring = ring
+        return future
+
+    def resolve(self, future: Future) -> Tuple[dict, List[FrameRef]]:
+        """Waits for a job; returns the analysis with images as ring views plus the refs to release."""
+        analysis = future.result()
+        refs = []
+        for key in ("aligned", "heatmap"):
+            value = analysis[key]
+            if isinstance(value, tuple) and value and value[0] == "ring":
+                ref = future.result_ring.adopt(value[1], value[2])
+                if ref is None:
+                    raise RuntimeError(f"{key} frame lost in result ring")
+                refs.append(ref)
+                analysis[key] = ref.array
+        return analysis, refs
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._guard:
+            if self._bundle is not None:
+                self._retired.append(self._bundle[1])
+                self._bundle = None
+            self._close_retired(force=True)
+            if self.result_ring is not None:
+                self._retired_rings.append(self.result_ring)
+                self.result_ring = None
+            self._close_retired()
+
+    def _done(self, names: List[str]):
+        with self._guard:
+            for name in names:
+                self._inflight[name] = self._inflight.get(name, 1) - 1
+            self._close_retired()
+
+    def _close_retired(self, force: bool = False):
+        keep = []
+        for bundle in self._retired:
+            if force or self._inflight.get(bundle.name, 0) <= 0:
+                self._inflight.pop(bundle.name, None)
+                bundle.close()
+            else:
+                keep.append(bundle)
+        self._retired = keep
+        # Result rings are unmapped once no job can still write and every slot is released
+        keep = []
+        for ring in self._retired_rings:
+            if self._inflight.get(ring.name, 0) > 0 or not ring.close():
+                keep.append(ring)
+            else:
+                self._inflight.pop(ring.name, None)
+        self._retired_rings = keep
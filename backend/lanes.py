@@ -0,0 +1,177 @@
+"""
+Per-lane inspection for multi-lane webs
+- Geometría de carriles desde la receta (px, mm o reparto uniforme)
+- Diff, blobs, severidad y muestra de color por carril
+- Carriles en paralelo sobre un pool de hilos
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from inspection import Inspector, RoiPlan, empty_defects
+
+
+@dataclass
+class Lane:
+    """One lane strip in master/aligned pixel coordinates, with its own thresholds."""
+    lane_id: int
+    x: int
+    w: int
+    diff_threshold: int
+    min_blob_area: int
+    critical_area: float
+    major_area: float
+    color_box: tuple  # (x, y, w, h) in frame coordinates
+
+
+@dataclass
+class LaneResult:
+    lane: Lane
+    defects: np.ndarray  # DEFECT_DTYPE, frame coordinates
+    severities: np.ndarray
+    mean_bgr: Optional[tuple]
+    timing_ms: float
+
+
+def compile_lanes(recipe: dict, shape: tuple, diff_threshold: int, min_blob_area: int,
+                  critical_area: float, major_area: float) -> List[Lane]:
+    """
+    Builds the lane list from recipe["lanes"]. Each entry may give its strip as
+    x/w (px) or offset_mm/width_mm (scaled by web_width_mm); otherwise the frame
+    is split evenly into lane_count strips. Per-lane overrides: diff_threshold,
+    min_blob_area_px, critical_area_px, major_area_px, color_roi.
+    """
+    height, width = shape[:2]
+    specs = list(recipe.get("lanes") or [])
+    if not specs:
+        specs = [{} for _ in range(max(1, int(recipe.get("lane_count", 1) or 1)))]
+    web_width_mm = float(recipe.get("web_width_mm") or 0.0)
+    px_per_mm = width / web_width_mm if web_width_mm > 0 else None
+    step = width / float(len(specs))
+
+    lanes = []
+    for index, spec in enumerate(specs):
+        if "x" in spec and "w" in spec:
+            x, w = int(spec["x"]), int(spec["w"])
+        elif px_per_mm and "offset_mm" in spec and "width_mm" in spec:
+            x = int(round(float(spec["offset_mm"]) * px_per_mm))
+            w = int(round(float(spec["width_mm"]) * px_per_mm))
+        else:
+            x = int(round(index * step))
+            w = int(round((index + 1) * step)) - x
+        x = max(0, min(width, x))
+        w = max(0, min(width - x, w))
+        if w == 0:
+            continue
+
+        color = spec.get("color_roi")
+        if color:
+            cx, cy = max(0, int(color.get("x", 0))), max(0, int(color.get("y", 0)))
+            color_box = (cx, cy, max(0, min(width - cx, int(color.get("w", 0)))), max(0, min(height - cy, int(color.get("h", 0)))))
+        else:
+            # Default: 100x100 patch at the lane centre
+            size = min(100, w, height)
+            color_box = (x + (w - size) // 2, (height - size) // 2, size, size)
+
+        lanes.append(Lane(
+            lane_id=int(spec.get("lane_id", index + 1)),
+            x=x,
+            w=w,
+            diff_threshold=int(spec.get("diff_threshold", diff_threshold)),
+            min_blob_area=int(spec.get("min_blob_area_px", min_blob_area)),
+            critical_area=float(spec.get("critical_area_px", critical_area)),
+            major_area=float(spec.get("major_area_px", major_area)),
+            color_box=color_box,
+        ))
+    return lanes
+
+
+def lane_color_boxes(recipe: dict, shape: tuple) -> List[tuple]:
+    """Color patch of every lane, for the warp regions of the recipe's RoiPlan."""
+    lanes = compile_lanes(recipe, shape, 0, 0, 0.0, 0.0)
+    return [lane.color_box for lane in lanes if lane.color_box[2] > 0 and lane.color_box[3] > 0]
+
+
+def _lane_roi(roi: Optional[RoiPlan], lane: Lane) -> Optional[RoiPlan]:
+    """Crops an RoiPlan to a lane strip (boxes shifted to lane coordinates)."""
+    if roi is None:
+        return None
+    boxes = []
+    for x, y, w, h in roi.boxes:
+        x0, x1 = max(x, lane.x), min(x + w, lane.x + lane.w)
+        if x1 > x0:
+            boxes.append((x0 - lane.x, y, x1 - x0, h))
+    mask = roi.mask[:, lane.x:lane.x + lane.w]
+    return RoiPlan(mask=mask, boxes=boxes, warp_boxes=boxes, coverage=roi.coverage)
+
+
+class LaneInspector:
+    """Runs compare_images per lane strip on a worker pool (1 worker = sequential)."""
+
+    def __init__(self, inspector: Inspector):
+        self.inspector = inspector
+        self.workers = 1
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def set_workers(self, workers: int):
+        workers = max(1, int(workers or 1))
+        if workers == self.workers and (workers == 1 or self._pool is not None):
+            return
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self.workers = workers
+        if workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lane")
+
+    def inspect(self, master: np.ndarray, aligned: np.ndarray, lanes: List[Lane], roi: Optional[RoiPlan] = None):
+        """
+        Returns (diff, thresh, heatmap, results). The maps are stitched from the
+        lane strips (zero outside lanes, heatmap normalised per lane); results is
+        one LaneResult per lane with defects already in frame coordinates.
+        """
+        if master.shape[:2] != aligned.shape[:2]:
+            aligned = cv2.resize(aligned, (master.shape[1], master.shape[0]))
+
+        def run(lane: Lane):
+            start = time.perf_counter()
+            strip = slice(lane.x, lane.x + lane.w)
+            lane_roi = _lane_roi(roi, lane)
+            if lane_roi is not None and not lane_roi.boxes:
+                maps, defects = None, empty_defects()
+            else:
+                diff, thresh, heatmap, defects = self.inspector.compare_images(
+                    master[:, strip], aligned[:, strip],
+                    diff_threshold=lane.diff_threshold,
+                    min_blob_area=lane.min_blob_area,
+                    roi=lane_roi
+                )
+                maps = (diff, thresh, heatmap)
+                defects["x"] += lane.x
+                defects["cx"] += lane.x
+            area = defects["area"]
+            severities = np.select([area >= lane.critical_area, area >= lane.major_area], ["critical", "major"], "minor")
+
+            cx, cy, cw, ch = lane.color_box
+            patch = aligned[cy:cy + ch, cx:cx + cw]
+            mean_bgr = cv2.mean(patch)[:3] if patch.size > 0 else None
+            timing_ms = (time.perf_counter() - start) * 1000.0
+            return maps, LaneResult(lane=lane, defects=defects, severities=severities, mean_bgr=mean_bgr, timing_ms=timing_ms)
+
+        run_all = self._pool.map if self._pool is not None else map
+        outputs = list(run_all(run, lanes))
+
+        diff = np.zeros_like(master)
+        heatmap = np.zeros_like(master)
+        thresh = np.zeros(master.shape[:2], dtype=np.uint8)
+        for maps, result in outputs:
+            if maps is None:
+                continue
+            strip = slice(result.lane.x, result.lane.x + result.lane.w)
+            diff[:, strip], thresh[:, strip], heatmap[:, strip] = maps
+        return diff, thresh, heatmap, [result for _, result in outputs]
@@ -16,22 +16,33 @@ import math
 from datetime import datetime
 from collections import deque
 import uuid
-from typing import Optional
+from typing import List, Optional
 from PIL import Image, ImageDraw
 import hashlib
 import logging
+import threading
+import functools
 from logging.handlers import RotatingFileHandler
 
-from inspection import Inspector
-from simulator import DefectSimulator
-from camera import CameraService
+from inspection import Inspector, compile_roi_plan, defects_to_dicts, warp_to_master
+from lanes import LaneInspector
+from pipeline import InspectionPipeline
+from frame_analysis import analyze_frame, build_analysis_graph
+from inspection_worker import ProcessInspector
+from framebuffer import FrameRing, shm_available
+from stream_hub import LazyImage, StreamHub, encode_image
+from replay import RECORDINGS_DIR, RollRecorder, RollReplay, list_recordings
+from simulator import DefectSimulator, SimulatorFramePool, DetectionScore
+from roll_aggregate import RollAggregate
+from camera import CameraService, FILE_CAMERA_ID
+from camera_supervisor import CameraSupervisor, RECONNECTING, CONNECTED
 from auth import AuthService, LoginRequest
-from diagnostics import Diagnostics
 from recipes import RecipeManager, Recipe
 from color_module import ColorMonitor, ColorTarget
 from defects import DefectClassifier, DefectType, DefectSeverity
 from alarms import AlarmEngine, AlarmRule, TriggerType, ActionType, Action
-from storage import ensure_db, insert_job, insert_roll, close_roll, insert_defect, insert_color_event, insert_frame
+from storage import ensure_db, insert_job, insert_roll, close_roll, insert_defect, insert_color_event, insert_frame, start_writer, stop_writer, flush_writer, writer_stats
+from storage import query_defects, query_color_events, query_frames, query_roll_job, iso_to_ms
 
 def configure_logging():
     log_dir = os.path.join(os.path.dirname(__file__), "logs")
@@ -99,6 +110,8 @@ class SystemState:
     master_pyramid = []
     master_meta = {}
     inspector = Inspector()
+    lane_inspector = LaneInspector(inspector)
+    analysis_graph = build_analysis_graph()
     simulator = DefectSimulator()
     camera = CameraService()
     recipe_manager = RecipeManager()
@@ -162,7 +175,10 @@ class SystemState:
     segment_length_m: float = 100.0
     segment_index: int = 0
     roll_sequence: int = 1
+    roi_plan = None
+    roi_plan_key = None
     last_frame_ts: float = None
+    last_camera_seq: int = 0
     encoder_ticks: int = 0
     label_index: int = 0
     counters = {
@@ -174,6 +190,8 @@ class SystemState:
     settings = {
         "use_simulator": True,
         "camera_id": None,
+        # Video file / image folder used when camera_id is -2
+        "camera_source": None,
         "exposure": -5.0,
         "gain": None,
         "roll_diameter_mm": 600.0,
@@ -181,6 +199,21 @@ class SystemState:
         "material_thickness_mm": 0.05,
         "start_with_last_job": False,
         "simulated_speed_mpm": 30.0,
+        "compare_workers": 1,
+        "lane_workers": 1,
+        "stage_workers": 3,
+        "background_pipeline": True,
+        "pipeline_max_fps": 20.0,
+        "frame_ring_slots": 6,
+        "process_workers": 0,
+        "record_rolls": False,
+        # Pre-generated simulator frames (0: draw defects per frame)
+        "simulator_pool_size": 0,
+        "simulator_seed": 0,
+        # Background SQLite writer: rows per commit, max commit delay, queue bound
+        "db_batch_rows": 500,
+        "db_flush_ms": 200,
+        "db_queue_size": 10000,
         "plc_enabled": False,
         "plc_ip": "",
         "plc_port": 502,
@@ -216,12 +249,6 @@ class SystemState:
         "encoder_count": 0
     }
     recipe_lane_count: int = 1
-    last_frames = {
-        "live": None,
-        "aligned": None,
-        "heatmap": None,
-        "master": None
-    }
     uptime_start = time.time()
     
     # Current Job Info
@@ -231,6 +258,37 @@ class SystemState:
 
 state = SystemState()
 state.auth_service = AuthService()
+# One inspection cycle at a time (pipeline thread, inline polling, roll changes)
+state.inspection_lock = threading.RLock()
+state.pipeline = InspectionPipeline(lambda: run_inspection_cycle(), retire=lambda result: release_inspection_result(result))
+# Live frames live in a shared-memory ring (created for the first frame shape)
+state.frame_ring = None
+state.retired_rings = []
+state.cycle_frame_ref = None
+state.frame_ring_lock = None
+# Optional pool of analysis worker processes (settings.process_workers > 0)
+state.process_inspector = None
+# Roll recording (settings.record_rolls) and replay of recordings
+state.recorder = None
+state.replay = None
+# Encode-once fan-out of processed frames to MJPEG and polling clients
+state.stream_hub = StreamHub()
+state.replay_finishing = False
+state.last_replay = None
+# Seeded simulator frame pool (settings.simulator_pool_size) and online recall against its ground truth
+state.sim_pool = None
+state.sim_pool_lock = threading.Lock()
+state.sim_score = DetectionScore()
+# Running aggregate of the active roll, and those of recently closed rolls (persisted as aggregate.json)
+state.roll_aggregate = None
+state.roll_aggregates = {}
+ROLL_AGGREGATES_KEPT = 200
+# Camera health/reconnect off the frame path (started with the server)
+state.camera_supervisor = CameraSupervisor(
+    state.camera,
+    desired_camera=lambda: state.settings.get("camera_id") if not state.use_simulator and state.replay is None else None,
+    on_change=lambda old, new, info: camera_state_changed(old, new, info),
+)
 CONFIG_PATH = "config.json"
 
 # Initialize a default target for demo purposes
@@ -326,6 +384,14 @@ def clear_alarm(code: str):
         log_event("alarm_cleared", alarm.get("severity", "info"), alarm.get("message", ""), {"code": code})
     return alarm
 
+def camera_state_changed(old: str, new: str, info: dict):
+    severity = "warning" if new == RECONNECTING else "info"
+    log_event("camera_state", severity, f"Camera {old} -> {new}", info)
+    if new == RECONNECTING:
+        raise_alarm("camera_lost", "critical", "Camera lost, reconnecting", info)
+    elif new == CONNECTED:
+        clear_alarm("camera_lost")
+
 def reset_roll_counters():
     state.counters = {
         "total_frames": 0,
@@ -340,45 +406,85 @@ def reset_roll_counters():
     state.settings["roll_diameter_mm"] = state.settings.get("core_diameter_mm", 76.0)
     state.encoder_ticks = 0
     state.label_index = 0
-
-def _defect_bucket(area: float) -> str:
-    if area >= state.alarm_rules["critical_defect_area"]:
-        return "critical"
-    if area >= 200:
-        return "medium"
-    return "small"
+    state.roll_aggregate = new_roll_aggregate(state.roll_id, state.job_id) if state.roll_id else None
+
+def new_roll_aggregate(roll_id: str, job_id: str) -> RollAggregate:
+    return RollAggregate(roll_id, job_id, segment_length_m=state.segment_length_m,
+                         critical_area=state.alarm_rules["critical_defect_area"])
+
+def active_roll_aggregate():
+    """Aggregate of the active roll (created if the roll started without a counter reset)."""
+    agg = state.roll_aggregate
+    if state.roll_id and (agg is None or agg.roll_id != state.roll_id):
+        agg = state.roll_aggregate = new_roll_aggregate(state.roll_id, state.job_id)
+    return agg
+
+def roll_aggregate_path(job_id: str, roll_id: str) -> str:
+    return os.path.join("data", job_id or "unknown", roll_id or "roll", "aggregate.json")
+
+def keep_roll_aggregate(agg: RollAggregate):
+    state.roll_aggregates.pop(agg.roll_id, None)
+    state.roll_aggregates[agg.roll_id] = agg
+    while len(state.roll_aggregates) > ROLL_AGGREGATES_KEPT:
+        state.roll_aggregates.pop(next(iter(state.roll_aggregates)))
+
+def rebuild_roll_aggregate(roll_id: str, job_id: str) -> RollAggregate:
+    """One-off backfill from the defects/color_events tables (rolls recorded before aggregates existed)."""
+    agg = new_roll_aggregate(roll_id, job_id)
+    after = ""
+    while True:
+        items, after = query_defects(roll_id=roll_id, after=after, limit=5000)
+        for t in items:
+            agg.add_defect(t["meter"], (t["defect"] or {}).get("area", 0), t["severity"], t["cavity_index"])
+        if not after:
+            break
+    after = ""
+    while True:
+        items, after = query_color_events(roll_id, after=after, limit=5000)
+        for c in items:
+            agg.add_color(c["ts_utc_ms"], c["delta_e"] or 0.0, c["status"] or "")
+        if not after:
+            break
+    return agg
+
+def get_roll_aggregate(roll_id: str, job_id: str = ""):
+    """Active roll, recently closed rolls, aggregate.json on disk, then a DB rebuild."""
+    agg = state.roll_aggregate
+    if agg is not None and agg.roll_id == roll_id:
+        return agg
+    agg = state.roll_aggregates.get(roll_id)
+    if agg is not None:
+        return agg
+    path = roll_aggregate_path(job_id, roll_id)
+    try:
+        agg = RollAggregate.load(path) if os.path.exists(path) else rebuild_roll_aggregate(roll_id, job_id)
+    except Exception as e:
+        log_event("roll_aggregate_error", "warning", "Roll aggregate unavailable", {"roll_id": roll_id, "error": str(e)})
+        return None
+    keep_roll_aggregate(agg)
+    return agg
 
 def build_roll_report(roll_id: str):
     report = next((r for r in state.roll_reports if r.get("roll_id") == roll_id), None)
     if not report:
         return None
-
-    defects = [t for t in state.trace_entries if t.get("roll_id") == roll_id and t.get("type") == "defect"]
-    by_bucket = {"small": 0, "medium": 0, "critical": 0}
-    defect_map = {}
-    for d in defects:
-        area = d.get("defect", {}).get("area", 0)
-        bucket = _defect_bucket(area)
-        by_bucket[bucket] += 1
-        meter = d.get("meter", 0)
-        bin_key = int(meter // state.segment_length_m)
-        defect_map[bin_key] = defect_map.get(bin_key, 0) + 1
+    agg = get_roll_aggregate(roll_id, report.get("job_id", ""))
+    summary = agg.summary() if agg is not None else {}
 
     total_defects = report.get("total_defects", 0)
     yield_pct = max(0.0, 100.0 - (total_defects * 0.1))
-    color_trend = [
-        {"ts": m.timestamp, "delta_e": m.delta_e}
-        for m in state.color_monitor.measurements
-    ][-200:]
 
     return {
         "report_id": report.get("id"),
         "job_id": report.get("job_id"),
         "roll_id": roll_id,
         "yield_pct": round(yield_pct, 2),
-        "defects_by_bucket": by_bucket,
-        "defect_map_by_segment": defect_map,
-        "color_trend": color_trend,
+        "defects_by_bucket": summary.get("defects_by_bucket", {"small": 0, "medium": 0, "critical": 0}),
+        "defects_by_severity": summary.get("defects_by_severity", {}),
+        "defects_by_lane": summary.get("defects_by_lane", {}),
+        "defect_map_by_segment": summary.get("defect_map_by_segment", {}),
+        "delta_e_stats": summary.get("delta_e_stats"),
+        "color_trend": summary.get("color_trend", []),
         "metrics": report
     }
 
@@ -421,8 +527,8 @@ def report_to_pdf_bytes(report: dict) -> bytes:
     radius = size // 2 - 12
     draw.ellipse((center - radius, center - radius, center + radius, center + radius), outline=(180, 180, 180), width=4)
     circumference_m = (diameter_mm / 1000.0) * np.pi
-    defects = [t for t in state.trace_entries if t.get("roll_id") == report.get("roll_id") and t.get("type") == "defect"]
-    for item in defects:
+    agg = get_roll_aggregate(report.get("roll_id"), report.get("job_id", ""))
+    for item in (agg.roll_map_points() if agg is not None else []):
         meter = item.get("meter", 0) or 0
         if circumference_m > 0:
             angle = (meter % circumference_m) / circumference_m * 2 * np.pi
@@ -461,13 +567,34 @@ def persist_roll_report(report: dict) -> dict:
     report["pdf_path"] = pdf_path
     return report
 
-def build_wfl_package(roll_id: str):
-    defects = [t for t in state.trace_entries if t.get("roll_id") == roll_id and t.get("type") == "defect"]
+def roll_job_id(roll_id: str) -> str:
+    """Job a roll belongs to: the active roll, its report, then storage (the active job if unknown)."""
+    if roll_id == state.roll_id:
+        return state.job_id
+    report = next((r for r in reversed(state.roll_reports) if r.get("roll_id") == roll_id), None)
+    if report is not None and report.get("job_id"):
+        return report["job_id"]
+    try:
+        return query_roll_job(roll_id) or state.job_id
+    except Exception:
+        return state.job_id
+
+def build_wfl_package(roll_id: str, after: str = "", limit: int = 1000):
+    """
+    Roll summary from the aggregate plus one page of the defect map (web
+    order). Further pages: /api/rolls/{roll_id}/defects?after=<defect_map_next>.
+    """
+    job_id = roll_job_id(roll_id)
+    defects, next_cursor = query_defects(roll_id=roll_id, after=after, limit=limit)
+    agg = get_roll_aggregate(roll_id, job_id)
     return {
         "roll_id": roll_id,
-        "job_id": state.job_id,
-        "sku": state.sku,
+        "job_id": job_id,
+        "sku": state.sku if job_id == state.job_id else "",
         "segment_length_m": state.segment_length_m,
+        "defect_count": agg.defects if agg is not None else None,
+        "defect_map_next": next_cursor,
+        "defect_map_url": f"/api/rolls/{roll_id}/defects",
         "defect_map": [
             {
                 "meter": d.get("meter"),
@@ -477,15 +604,39 @@ def build_wfl_package(roll_id: str):
             }
             for d in defects
         ],
+        "segments": agg.summary()["defect_map_by_segment"] if agg is not None else {},
         "meta": {
             "encoder_resets": 0,
             "notes": ""
         }
     }
 
+def get_simulator_pool():
+    """Pool for the current master/settings (rebuilt when either changes), or None when disabled."""
+    size = int(state.settings.get("simulator_pool_size") or 0)
+    seed = int(state.settings.get("simulator_seed") or 0)
+    master = state.master_image
+    # Preview and pipeline threads both call this: one of them (re)builds the pool
+    with state.sim_pool_lock:
+        pool = state.sim_pool
+        if size <= 0 or master is None:
+            if pool is not None:
+                pool.close()
+                state.sim_pool = None
+            return None
+        if pool is None or pool.master is not master or pool.size != size or pool.seed != seed:
+            if pool is not None:
+                pool.close()
+            pool = state.sim_pool = SimulatorFramePool(master, size=size, seed=seed)
+            state.sim_score.reset()
+        return pool
+
 def acquire_live_frame():
     try:
         if state.use_simulator:
+            pool = get_simulator_pool()
+            if pool is not None:
+                return pool.next()[0]
             if state.master_image is not None:
                 live_img = state.master_image.copy()
                 live_img = state.simulator.add_defects(live_img, count=random.randint(1, 3))
@@ -495,48 +646,41 @@ def acquire_live_frame():
             return live_img
         return state.camera.get_frame()
     except Exception as e:
-        # Fallback automático a simulador si la cámara se pierde en runtime
+        if state.settings.get("camera_id") is not None:
+            # Reconnect is the supervisor's job: report and fail fast
+            state.camera_supervisor.report_failure(e)
+            raise HTTPException(status_code=503, detail=f"Camera {state.camera_supervisor.state}: {e}")
+        # Sin cámara configurada: fallback a simulador
         state.use_simulator = True
         state.settings["use_simulator"] = True
         save_config()
         raise HTTPException(status_code=503, detail=f"Camera unavailable, switched to simulator: {e}")
 
+def ensure_stream_preview():
+    """Without the pipeline, one preview thread acquires frames for every live viewer."""
+    if not state.pipeline.running:
+        state.stream_hub.ensure_preview(lambda: {"live": acquire_live_frame()}, lambda: not state.pipeline.running)
+
+def publish_stream_frame(result: dict):
+    """Hands a cycle result's images to the stream hub, pinning their ring slots."""
+    images = result.get("images")
+    if not images:
+        return
+    pins = []
+    for frame_ref in result.get("frame_refs") or []:
+        pin = frame_ref.ring.get(frame_ref.seq)
+        if pin is None:
+            for held in pins:
+                held.release()
+            return
+        pins.append(pin)
+    state.stream_hub.publish(images, pins, source=result)
+
 def mjpeg_stream(scale: float = 0.6, quality: int = 70):
-    while True:
-        try:
-            frame = acquire_live_frame()
-            if scale and scale > 0 and scale < 1:
-                h, w = frame.shape[:2]
-                frame = cv2.resize(frame, (int(w * scale), int(h * scale)))
-            success, encoded = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
-            if not success:
-                continue
-            yield (b"--frame\r\n"
-                   b"Content-Type: image/jpeg\r\n\r\n" + encoded.tobytes() + b"\r\n")
-            time.sleep(0.04)
-        except Exception as e:
-            print(f"Stream error: {e}")
-            time.sleep(0.2)
+    return state.stream_hub.mjpeg("live", scale=scale, quality=quality, on_idle=ensure_stream_preview)
 
 def mjpeg_heatmap_stream(scale: float = 0.6, quality: int = 70):
-    while True:
-        try:
-            heatmap = state.last_frames.get("heatmap")
-            if heatmap is None:
-                time.sleep(0.1)
-                continue
-            if scale and scale > 0 and scale < 1:
-                h, w = heatmap.shape[:2]
-                heatmap = cv2.resize(heatmap, (int(w * scale), int(h * scale)))
-            success, encoded = cv2.imencode(".jpg", heatmap, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
-            if not success:
-                continue
-            yield (b"--frame\r\n"
-                   b"Content-Type: image/jpeg\r\n\r\n" + encoded.tobytes() + b"\r\n")
-            time.sleep(0.04)
-        except Exception as e:
-            print(f"Heatmap stream error: {e}")
-            time.sleep(0.2)
+    return state.stream_hub.mjpeg("heatmap", scale=scale, quality=quality)
 
 def load_config():
     try:
@@ -556,6 +700,10 @@ def load_config():
         state.active_recipe = data.get("last_recipe", "")
     if "use_simulator" in state.settings:
         state.use_simulator = bool(state.settings.get("use_simulator"))
+    state.inspector.set_compare_workers(state.settings.get("compare_workers", 1))
+    state.lane_inspector.set_workers(state.settings.get("lane_workers", 1))
+    state.analysis_graph.set_workers(state.settings.get("stage_workers", 1))
+    state.camera.source_config = state.settings.get("camera_source")
 
 def save_config():
     data = {
@@ -575,8 +723,15 @@ def save_config():
 load_config()
 ensure_db()
 
+class CameraSource(BaseModel):
+    path: str
+    fps: Optional[float] = None  # None: the video's own rate; 0: as fast as the pipeline reads
+    loop: bool = True
+    preload: bool = False
+
 class CameraConfig(BaseModel):
     camera_id: int
+    source: Optional[CameraSource] = None  # required for camera_id -2 (file source)
 
 class CameraSettings(BaseModel):
     exposure: float = None
@@ -591,6 +746,13 @@ class JobStart(BaseModel):
 class RollStart(BaseModel):
     roll_id: str = ""
 
+class ReplayStart(BaseModel):
+    recording: str
+    pace: str = "fast"  # fast | original
+    speed: float = 1.0  # original pace multiplier
+    recipe: Optional[str] = None  # default: the recorded recipe (tuning runs can override)
+    job_id: Optional[str] = None
+
 class AlarmAck(BaseModel):
     code: str
     clear: bool = False
@@ -615,6 +777,15 @@ class AppSettings(BaseModel):
     start_with_last_job: bool = None
     core_diameter_mm: float = None
     material_thickness_mm: float = None
+    compare_workers: Optional[int] = None
+    lane_workers: Optional[int] = None
+    stage_workers: Optional[int] = None
+    background_pipeline: Optional[bool] = None
+    record_rolls: Optional[bool] = None
+    simulator_pool_size: Optional[int] = None
+    simulator_seed: Optional[int] = None
+    pipeline_max_fps: Optional[float] = None
+    process_workers: Optional[int] = None
     plc_enabled: Optional[bool] = None
     plc_ip: Optional[str] = None
     plc_port: Optional[int] = None
@@ -749,8 +920,51 @@ def build_master_pyramid(img: np.ndarray, levels: int = 3):
         pyramid.append(current)
     return pyramid
 
+def mean_bgr_to_lab(mean_bgr) -> tuple:
+    """Mean BGR of a color ROI -> (L, a, b) via the color monitor's legacy conversion."""
+    b, g, r = mean_bgr
+    pixel_rgb = cv2.cvtColor(np.uint8([[[b, g, r]]]), cv2.COLOR_BGR2RGB)
+    return state.color_monitor.rgb_to_lab(pixel_rgb[0, 0])
+
+def master_cache_key(meta: dict) -> tuple:
+    return (meta.get("master_hash"), meta.get("dpi"), meta.get("page_index"))
+
+def set_master_image(img: np.ndarray, meta: dict):
+    """Installs a new master and rebuilds everything derived from it (pyramid, feature cache)."""
+    pyramid = build_master_pyramid(img, levels=3)
+    with state.inspection_lock:
+        state.master_image = img
+        state.master_image_bytes = array_to_bytes(img)
+        state.master_pyramid = pyramid
+        state.master_meta = meta
+        state.inspector.set_master(img, key=master_cache_key(meta), pyramid=pyramid)
+        if state.process_inspector is not None:
+            state.process_inspector.set_master(master_cache_key(meta), pyramid)
+
+def get_roi_plan(recipe: dict):
+    """Compiled include/exclude mask for the active recipe; rebuilt only when the ROIs or master change."""
+    if state.master_image is None:
+        return None
+    key = (
+        state.active_recipe,
+        state.master_image.shape[:2],
+        json.dumps([recipe.get("inspection_rois"), recipe.get("rois"), recipe.get("exclude_rois"), recipe.get("color_rois")], sort_keys=True, default=str)
+    )
+    if key != state.roi_plan_key:
+        state.roi_plan = compile_roi_plan(recipe, state.master_image.shape)
+        state.roi_plan_key = key
+    return state.roi_plan
+
+def check_recipe_options(data: dict):
+    """Rejects (400) alignment/detection options the inspector cannot parse."""
+    try:
+        state.inspector.check_recipe(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid recipe option: {e}")
+
 def apply_recipe(name: str):
     data = state.recipe_manager.load_recipe(name)
+    check_recipe_options(data)
     state.client = data.get("client", "")
     state.job_number = data.get("job_number", "")
     state.recipe_lane_count = int(data.get("lane_count", 1) or 1)
@@ -766,12 +980,22 @@ def apply_recipe(name: str):
     master_file = data.get("master_file")
     if master_file:
         try:
-            img = cv2.imread(master_file)
+            with open(master_file, "rb") as fh:
+                contents = fh.read()
+            img = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
             if img is not None:
-                state.master_image = img
-                state.master_image_bytes = array_to_bytes(img)
+                dpi = int(data.get("master_render_dpi", 150) or 150)
+                set_master_image(img, {
+                    "page_index": 0,
+                    "dpi": dpi,
+                    "pixel_size_mm": 25.4 / dpi,
+                    "color_space": "sRGB",
+                    "master_hash": hashlib.sha256(contents).hexdigest(),
+                    "master_file": master_file
+                })
         except Exception as e:
             print(f"Failed to load master from recipe: {e}")
+    get_roi_plan(data)
     return data
 
 @app.post("/upload-master")
@@ -794,16 +1018,13 @@ async def upload_master(file: UploadFile = File(...), dpi: int = 150, page_index
         else:
              img = cv2.cvtColor(img_data, cv2.COLOR_GRAY2BGR)
              
-        state.master_image = img
-        state.master_image_bytes = array_to_bytes(img)
-        state.master_pyramid = build_master_pyramid(img, levels=3)
-        state.master_meta = {
+        set_master_image(img, {
             "page_index": page_index,
             "dpi": dpi,
             "pixel_size_mm": 25.4 / dpi,
             "color_space": "sRGB",
             "master_hash": master_hash
-        }
+        })
         
         return {"width": pix.width, "height": pix.height, "message": "Master loaded successfully", "master_hash": master_hash}
     except Exception as e:
@@ -817,20 +1038,39 @@ def get_master_image():
     return Response(content=state.master_image_bytes, media_type="image/png")
 
 @app.get("/cameras")
-def get_cameras():
-    return state.camera.list_cameras()
+def get_cameras(refresh: bool = False):
+    """Cached device list; probing runs in the background (refresh=true forces a new probe)."""
+    if refresh:
+        state.camera.refresh_cameras()
+    return state.camera.list_cameras(wait=5.0)
+
+@app.get("/camera/status")
+def get_camera_status():
+    return {**state.camera_supervisor.status(), "capture": state.camera.stats()}
 
 @app.post("/connect-camera")
 def connect_camera(config: CameraConfig):
-    try:
-        result = state.camera.connect(config.camera_id, fallback_to_virtual=True)
+    source = config.source.dict() if config.source is not None else None
+    # The selection is updated before connecting, under the camera's lock, so
+    # the supervisor never reconnects to the previous camera in between
+    with state.camera.connect_lock:
+        previous = {key: state.settings.get(key) for key in ("use_simulator", "camera_id", "camera_source")}
         state.use_simulator = False
         state.settings["use_simulator"] = False
+        state.settings["camera_id"] = config.camera_id
+        if source is not None and config.camera_id == FILE_CAMERA_ID:
+            state.settings["camera_source"] = source
+        try:
+            result = state.camera.connect(config.camera_id, fallback_to_virtual=True, source=source)
+        except Exception as e:
+            state.settings.update(previous)
+            state.use_simulator = bool(previous["use_simulator"])
+            raise HTTPException(status_code=500, detail=str(e))
+        # Fallback to the virtual camera
         state.settings["camera_id"] = result["camera_id"]
-        save_config()
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    save_config()
+    state.camera_supervisor.wake()
+    return result
 
 @app.post("/camera-settings")
 def update_camera_settings(settings: CameraSettings):
@@ -872,6 +1112,7 @@ def list_recipes():
 
 @app.post("/save-recipe")
 def save_recipe(recipe: Recipe):
+    check_recipe_options(recipe.dict())
     return state.recipe_manager.save_recipe(recipe)
 
 @app.get("/load-recipe/{name}")
@@ -879,6 +1120,8 @@ def load_recipe(name: str):
     try:
         data = apply_recipe(name)
         return data
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
 
@@ -930,6 +1173,7 @@ def toggle_source(use_simulator: bool):
     state.use_simulator = use_simulator
     state.settings["use_simulator"] = use_simulator
     save_config()
+    state.camera_supervisor.wake()
     return {"use_simulator": state.use_simulator}
 
 @app.get("/stream/live.mjpg")
@@ -960,6 +1204,8 @@ def start_job(payload: JobStart):
     if payload.recipe:
         try:
             apply_recipe(payload.recipe)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=404, detail=f"Recipe load failed: {e}")
     state.job_id = payload.job_id
@@ -969,6 +1215,7 @@ def start_job(payload: JobStart):
     save_config()
     insert_job(state.job_id, state.active_recipe, payload.sku, "", "running")
     log_event("job_started", "info", "Job started", payload.dict())
+    start_pipeline()
     return {"status": "ok", "job_id": state.job_id, "recipe": state.active_recipe}
 
 @app.post("/roll/start")
@@ -987,10 +1234,21 @@ def start_roll(payload: RollStart):
     reset_roll_counters()
     insert_roll(state.roll_id, state.job_id)
     log_event("roll_started", "info", "Roll started", {"roll_id": state.roll_id, "auto": auto})
+    start_pipeline()
     return {"status": "ok", "roll_id": state.roll_id, "auto": auto}
 
 @app.post("/roll/end")
 def end_roll():
+    # No cycle may run while counters are closed; the job's next roll starts with the next cycle
+    state.pipeline.stop()
+    try:
+        with state.inspection_lock:
+            return close_active_roll()
+    finally:
+        if state.job_id:
+            start_pipeline()
+
+def close_active_roll():
     if not state.roll_id:
         raise HTTPException(status_code=400, detail="No active roll")
     duration_sec = int(time.time() - state.roll_started_at) if state.roll_started_at else 0
@@ -1009,6 +1267,13 @@ def end_roll():
         "avg_deltae": round(avg_deltae, 3),
             "meters_processed": round(state.current_mm / 1000.0, 2)
     }
+    agg = active_roll_aggregate()
+    if agg is not None:
+        keep_roll_aggregate(agg)
+        try:
+            agg.save(roll_aggregate_path(agg.job_id, agg.roll_id))
+        except Exception as e:
+            log_event("roll_aggregate_error", "error", "Failed to persist roll aggregate", {"error": str(e)})
     try:
         report = persist_roll_report(report)
     except Exception as e:
@@ -1017,9 +1282,12 @@ def end_roll():
         report["pdf_path"] = ""
     state.roll_reports.append(report)
     try:
+        # The roll's frames/defects/color rows are on disk before it is marked closed
+        flush_writer()
         close_roll(state.roll_id, report.get("meters_processed", 0), 0.0)
     except Exception as e:
         log_event("roll_close_error", "error", "Failed to close roll in storage", {"error": str(e)})
+    close_roll_recorder()
     log_event("eor", "info", "End of roll", report)
     state.roll_id = ""
     reset_roll_counters()
@@ -1028,11 +1296,13 @@ def end_roll():
 
 @app.post("/job/stop")
 def stop_job():
+    state.pipeline.stop()
     # If a roll is active, close it first
     closed_report = None
     try:
         if state.roll_id:
-            roll_result = end_roll()
+            with state.inspection_lock:
+                roll_result = close_active_roll()
             closed_report = roll_result.get("report") if isinstance(roll_result, dict) else None
     except HTTPException as e:
         # If roll is already ended or invalid, just log it
@@ -1096,33 +1366,36 @@ def api_jobs_status(job_id: str):
     }
 
 
+def _page_limit(limit: int) -> int:
+    return max(1, min(int(limit), 5000))
+
+def _query_or_400(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/api/rolls/{roll_id}/defects")
-def api_roll_defects(roll_id: str, from_mm: float = 0.0, to_mm: float = 1e9, severity: str = None, type: str = None):
-    items = [t for t in state.trace_entries if t.get("roll_id") == roll_id and t.get("type") == "defect"]
-    out = []
-    for item in items:
-        meter = item.get("meter", 0) * 1000.0  # convert m to mm if stored in m
-        if meter < from_mm or meter > to_mm:
-            continue
-        defect = item.get("defect", {})
-        if severity and defect.get("severity") != severity:
-            continue
-        if type and defect.get("label") != type:
-            continue
-        out.append(item)
-    return {"items": out}
+def api_roll_defects(roll_id: str, from_mm: float = 0.0, to_mm: float = 1e9, severity: str = None, type: str = None,
+                     after: str = "", limit: int = 500):
+    """Defects by web position from the defects table; pass next_cursor back as `after` for the next page."""
+    items, next_cursor = _query_or_400(query_defects, roll_id=roll_id, from_mm=from_mm, to_mm=to_mm, severity=severity or "",
+                                       defect_type=type or "", after=after, limit=_page_limit(limit))
+    return {"items": items, "next_cursor": next_cursor}
 
 
 @app.get("/api/rolls/{roll_id}/color")
-def api_roll_color(roll_id: str, roi_id: str = None, from_mm: float = 0.0, to_mm: float = 1e9):
-    # Using stored measurements (no position available here), return latest N filtered by ROI
-    measurements = state.color_monitor.measurements[-500:]
-    out = []
-    for m in measurements:
-        if roi_id and m.roi_id != roi_id:
-            continue
-        out.append(m.dict())
-    return {"items": out}
+def api_roll_color(roll_id: str, roi_id: str = None, from_mm: float = 0.0, to_mm: float = 1e9,
+                   after: str = "", limit: int = 500):
+    items, next_cursor = _query_or_400(query_color_events, roll_id, roi_id=roi_id or "", from_mm=from_mm, to_mm=to_mm,
+                                       after=after, limit=_page_limit(limit))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@app.get("/api/rolls/{roll_id}/frames")
+def api_roll_frames(roll_id: str, from_mm: float = 0.0, to_mm: float = 1e9, after: str = "", limit: int = 500):
+    items, next_cursor = _query_or_400(query_frames, roll_id, from_mm=from_mm, to_mm=to_mm, after=after, limit=_page_limit(limit))
+    return {"items": items, "next_cursor": next_cursor}
 
 
 @app.post("/api/recipes")
@@ -1220,6 +1493,7 @@ def update_settings(payload: AppSettings):
     state.settings["use_simulator"] = payload.use_simulator
     if payload.camera_id is not None:
         state.settings["camera_id"] = payload.camera_id
+        state.camera_supervisor.wake()
     if payload.exposure is not None:
         state.settings["exposure"] = payload.exposure
     if payload.gain is not None:
@@ -1232,6 +1506,31 @@ def update_settings(payload: AppSettings):
         state.settings["material_thickness_mm"] = payload.material_thickness_mm
     if payload.start_with_last_job is not None:
         state.settings["start_with_last_job"] = payload.start_with_last_job
+    if payload.compare_workers is not None:
+        state.settings["compare_workers"] = max(1, payload.compare_workers)
+        state.inspector.set_compare_workers(state.settings["compare_workers"])
+    if payload.lane_workers is not None:
+        state.settings["lane_workers"] = max(1, payload.lane_workers)
+        state.lane_inspector.set_workers(state.settings["lane_workers"])
+    if payload.stage_workers is not None:
+        state.settings["stage_workers"] = max(1, payload.stage_workers)
+        state.analysis_graph.set_workers(state.settings["stage_workers"])
+    if payload.background_pipeline is not None:
+        state.settings["background_pipeline"] = payload.background_pipeline
+        if not payload.background_pipeline:
+            state.pipeline.stop()
+    if payload.record_rolls is not None:
+        state.settings["record_rolls"] = payload.record_rolls
+    if payload.simulator_pool_size is not None:
+        state.settings["simulator_pool_size"] = max(0, payload.simulator_pool_size)
+    if payload.simulator_seed is not None:
+        state.settings["simulator_seed"] = payload.simulator_seed
+    if payload.pipeline_max_fps is not None:
+        state.settings["pipeline_max_fps"] = max(0.0, payload.pipeline_max_fps)
+        state.pipeline.max_fps = state.settings["pipeline_max_fps"]
+    if payload.process_workers is not None:
+        state.settings["process_workers"] = max(0, payload.process_workers)
+        configure_process_workers(state.settings["process_workers"])
     if payload.plc_enabled is not None:
         state.settings["plc_enabled"] = payload.plc_enabled
     if payload.plc_ip is not None:
@@ -1260,39 +1559,41 @@ def update_settings(payload: AppSettings):
 
 @app.get("/traceability/query")
 def query_traceability(
+    response: Response,
     job_id: str = "",
     roll_id: str = "",
     severity: str = "",
     date_from: str = "",
-    date_to: str = ""
+    date_to: str = "",
+    after: str = "",
+    limit: int = 1000
 ):
-    items = list(state.trace_entries)
-    if job_id:
-        items = [i for i in items if i.get("job_id") == job_id]
-    if roll_id:
-        items = [i for i in items if i.get("roll_id") == roll_id]
-    if severity:
-        items = [i for i in items if i.get("severity") == severity]
-    if date_from:
-        items = [i for i in items if i.get("ts", "") >= date_from]
-    if date_to:
-        items = [i for i in items if i.get("ts", "") <= date_to]
+    """Defect trace entries from the defects table; the next page cursor is in X-Next-Cursor."""
+    try:
+        ts_from = iso_to_ms(date_from) if date_from else None
+        ts_to = iso_to_ms(date_to) if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_from/date_to must be ISO dates")
+    items, next_cursor = _query_or_400(query_defects, roll_id=roll_id, job_id=job_id, severity=severity,
+                                       ts_from=ts_from, ts_to=ts_to, after=after, limit=_page_limit(limit))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return items
 
 @app.get("/traceability/roll/{roll_id}/defects")
 def list_roll_defects(roll_id: str, limit: int = 500):
-    items = [
+    """The roll's last `limit` defects (furthest along the web), in web order."""
+    items, _ = query_defects(roll_id=roll_id, limit=_page_limit(limit), latest=True)
+    return [
         {
-            "meter": t.get("meter"),
-            "segment_index": t.get("segment_index"),
-            "severity": t.get("severity"),
-            "defect": t.get("defect"),
-            "cavity_index": t.get("cavity_index")
+            "meter": t["meter"],
+            "segment_index": t["segment_index"],
+            "severity": t["severity"],
+            "defect": t["defect"],
+            "cavity_index": t["cavity_index"]
         }
-        for t in state.trace_entries
-        if t.get("roll_id") == roll_id and t.get("type") == "defect"
+        for t in reversed(items)
     ]
-    return items[-limit:]
 
 @app.post("/evidence")
 def add_evidence(payload: EvidenceIn):
@@ -1452,8 +1753,8 @@ def sensor_encoder_pulse():
     return {"status": "ok"}
 
 @app.get("/wfl/package/{roll_id}")
-def get_wfl_package(roll_id: str):
-    return build_wfl_package(roll_id)
+def get_wfl_package(roll_id: str, after: str = "", limit: int = 1000):
+    return _query_or_400(build_wfl_package, roll_id, after=after, limit=_page_limit(limit))
 
 @app.post("/wfl/enqueue")
 def enqueue_wfl(payload: WflDispatch):
@@ -1700,28 +2001,199 @@ def get_alarm_statistics():
 @app.get("/inspection-frame")
 def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float = 0.6):
     """
-    Returns a processed frame.
+    Returns a processed frame. While the background pipeline runs this only
+    reads its latest result; otherwise one inspection cycle runs inline.
+    """
+    if state.pipeline.running:
+        seq, result = state.pipeline.latest()
+        if result is None:
+            seq, result = state.pipeline.wait_for_result(seq, timeout=2.0)
+        if result is None:
+            raise HTTPException(status_code=503, detail=state.pipeline.last_error or "Pipeline warming up")
+        return render_inspection_result(result, seq, format=format, quality=quality, scale=scale)
+    result = run_inspection_cycle()
+    try:
+        return render_inspection_result(result, 0, format=format, quality=quality, scale=scale)
+    finally:
+        release_inspection_result(result)
+
+def run_inspection_cycle() -> dict:
+    """One acquire → align → compare → color → alarms → persist cycle."""
+    with state.inspection_lock:
+        try:
+            result = _inspection_cycle()
+        except Exception:
+            release_cycle_frame()
+            raise
+        # The result owns the live frame's ring reference until it is retired
+        result["frame_refs"] = [state.cycle_frame_ref] if state.cycle_frame_ref is not None else []
+        state.cycle_frame_ref = None
+        publish_stream_frame(result)
+        return result
+
+def begin_process_cycle():
+    """Overlapped mode, stage 1: acquire the frame and hand it to a worker process."""
+    with state.inspection_lock:
+        try:
+            ctx = prepare_cycle()
+        except Exception:
+            release_cycle_frame()
+            raise
+        frame_ref = state.cycle_frame_ref
+        state.cycle_frame_ref = None
+        if "error" in ctx:
+            return ctx, frame_ref, None
+        if frame_ref is None:
+            # No ring slot: analyse in this process
+            return ctx, None, None
+        try:
+            future = state.process_inspector.submit(
+                frame_ref, ctx["recipe"], max(1, int(state.recipe_lane_count or 1)), state.alarm_rules["critical_defect_area"],
+                stage_workers=state.analysis_graph.workers
+            )
+        except Exception:
+            frame_ref.release()
+            raise
+        return ctx, frame_ref, future
+
+def finish_process_cycle(handle) -> dict:
+    """Overlapped mode, stage 2 (in submission order): collect the analysis and commit it here."""
+    ctx, frame_ref, future = handle
+    refs = [frame_ref] if frame_ref is not None else []
+    try:
+        if "error" in ctx:
+            ctx["frame_refs"] = refs
+            return ctx
+        if future is None:
+            with state.inspection_lock:
+                analysis = analyze_frame(
+                    state.inspector, state.lane_inspector, state.master_image, state.master_pyramid,
+                    ctx["live"], ctx["recipe"], get_roi_plan(ctx["recipe"]),
+                    max(1, int(state.recipe_lane_count or 1)), state.alarm_rules["critical_defect_area"],
+                    graph=state.analysis_graph
+                )
+        else:
+            analysis, image_refs = state.process_inspector.resolve(future)
+            refs.extend(image_refs)
+        with state.inspection_lock:
+            result = commit_cycle(ctx, analysis)
+    except Exception:
+        for ref in refs:
+            ref.release()
+        raise
+    result["frame_refs"] = refs
+    publish_stream_frame(result)
+    return result
+
+def configure_process_workers(workers: int):
+    """Starts/stops the analysis process pool and switches the pipeline mode accordingly."""
+    workers = max(0, int(workers or 0))
+    current = state.process_inspector
+    if (current.workers if current else 0) == workers:
+        return
+    was_running = state.pipeline.running
+    state.pipeline.stop()
+    with state.inspection_lock:
+        if current is not None:
+            state.process_inspector = None
+            current.shutdown()
+        if workers > 0:
+            state.process_inspector = ProcessInspector(workers)
+            if state.master_image is not None:
+                state.process_inspector.set_master(master_cache_key(state.master_meta or {}), state.master_pyramid)
+            state.pipeline.set_stages(begin_process_cycle, finish_process_cycle, depth=workers)
+        else:
+            state.pipeline.set_stages(None, None)
+    if was_running:
+        start_pipeline()
+
+def release_cycle_frame():
+    if state.cycle_frame_ref is not None:
+        state.cycle_frame_ref.release()
+        state.cycle_frame_ref = None
+
+def release_inspection_result(result: dict):
+    for frame_ref in (result.get("frame_refs") or []) if result else []:
+        frame_ref.release()
+
+def get_frame_ring(shape: tuple) -> Optional[FrameRing]:
+    """Ring sized for `shape`; rebuilt when the frame shape changes. None if shared memory is too small."""
+    if state.retired_rings:
+        state.retired_rings = [r for r in state.retired_rings if not r.close()]
+    # Worker processes need the ring under their cross-process lock
+    lock = state.process_inspector.lock if state.process_inspector is not None else None
+    ring = state.frame_ring
+    if ring is not None and ring.shape == tuple(shape) and state.frame_ring_lock is lock:
+        return ring
+    slots = max(2, int(state.settings.get("frame_ring_slots", 6) or 6))
+    nbytes = slots * int(np.prod(shape))
+    if ring is not None:
+        state.frame_ring = None
+        if not ring.close():
+            # Frames still referenced (results, streams); unmapped on a later call
+            state.retired_rings.append(ring)
+    if not shm_available(nbytes):
+        log_event("frame_ring_disabled", "warning", "Not enough shared memory for frame ring", {"bytes": nbytes})
+        return None
+    state.frame_ring = FrameRing(slots, shape, lock=lock)
+    state.frame_ring_lock = lock
+    return state.frame_ring
+
+def publish_live_frame(shape: tuple, render):
+    """
+    Produces the live frame directly into a ring slot: render(out) must fill
+    `out` (or return a new array when out is None). Returns (image, FrameRef);
+    without a free slot the frame is a plain array and the ref is None.
     """
+    ring = get_frame_ring(shape)
+    reserved = ring.reserve(shape) if ring is not None else None
+    if reserved is None:
+        return render(None), None
+    slot, view = reserved
+    try:
+        render(view)
+    except Exception:
+        ring.cancel(slot)
+        raise
+    frame_ref = ring.publish(slot, shape)
+    return frame_ref.array, frame_ref
+
+def _inspection_cycle() -> dict:
+    ctx = prepare_cycle()
+    if "error" in ctx:
+        return ctx
+    analysis = analyze_frame(
+        state.inspector,
+        state.lane_inspector,
+        state.master_image,
+        state.master_pyramid,
+        ctx["live"],
+        ctx["recipe"],
+        get_roi_plan(ctx["recipe"]),
+        max(1, int(state.recipe_lane_count or 1)),
+        state.alarm_rules["critical_defect_area"],
+        graph=state.analysis_graph
+    )
+    return commit_cycle(ctx, analysis)
+
+def prepare_cycle() -> dict:
+    """Checks, auto roll start, recipe load and frame acquisition (main process)."""
     if not state.job_id or not state.active_recipe:
         log_event("inspection_start_blocked", "warning", "Job and recipe required", {"job_id": state.job_id, "active_recipe": state.active_recipe})
         raise HTTPException(status_code=400, detail="Job and recipe required")
     if state.master_image is None:
         log_event("inspection_start_blocked", "warning", "Master not loaded", {})
         raise HTTPException(status_code=400, detail="Master not loaded")
-    if state.settings.get("camera_id") is not None and state.camera.cap is None and not state.use_simulator:
-        try:
-            state.camera.connect(state.settings["camera_id"])
-        except Exception as e:
-            print(f"Camera reconnect error: {e}")
-            state.use_simulator = True
-            state.settings["use_simulator"] = True
-            save_config()
+    if state.settings.get("camera_id") is not None and not state.use_simulator and state.replay is None and not state.camera_supervisor.usable:
+        # The supervisor (re)connects in the background; skip the cycle instead of waiting for it
+        return {"error": f"Camera {state.camera_supervisor.state}"}
     if state.job_id and not state.roll_id:
         state.roll_id = f"ROLL-{state.roll_sequence:04d}"
         state.roll_sequence += 1
         reset_roll_counters()
         log_event("roll_started", "info", "Roll started (auto)", {"roll_id": state.roll_id, "auto": True})
     now_ts = time.time()
+    start = time.perf_counter()
 
     try:
         active_recipe = state.recipe_manager.load_recipe(state.active_recipe)
@@ -1729,20 +2201,71 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
         active_recipe = {}
 
     # 1. Acquire Image
+    if state.replay is not None:
+        replayed = state.replay.next_frame()
+        if replayed is None:
+            if not state.replay_finishing:
+                state.replay_finishing = True
+                threading.Thread(target=finish_replay, name="replay-finish", daemon=True).start()
+            return {"error": "Replay finished"}
+        frame, sensor = replayed
+
+        def copy_replayed(out):
+            if out is None:
+                return frame
+            np.copyto(out, frame)
+            return out
+
+        live_img, state.cycle_frame_ref = publish_live_frame(frame.shape, copy_replayed)
+        return {"recipe": active_recipe, "live": live_img, "now_ts": now_ts, "sensor": sensor,
+                "acquire_ms": round((time.perf_counter() - start) * 1000.0, 2)}
+
+    capture = None
+    ground_truth = None
     try:
-        if state.use_simulator:
-            live_img = state.master_image.copy()
-            live_img = state.simulator.add_defects(live_img, count=random.randint(1, 5))
-            # Add slight misalignment for realism
-            rows, cols, _ = live_img.shape
+        pool = get_simulator_pool() if state.use_simulator else None
+        if pool is not None:
+            # Pre-generated frame: one copy into the ring slot, no drawing or warping
+            frame, ground_truth, _ = pool.next()
+
+            def copy_pooled(out):
+                if out is None:
+                    return frame
+                np.copyto(out, frame)
+                return out
+
+            live_img, state.cycle_frame_ref = publish_live_frame(frame.shape, copy_pooled)
+        elif state.use_simulator:
+            # add_defects already returns a copy of the master
+            defective = state.simulator.add_defects(state.master_image, count=random.randint(1, 5))
+            # Add slight misalignment for realism, warped straight into a ring slot
+            rows, cols, _ = defective.shape
             M = np.float32([[1, 0, random.randint(-5, 5)], [0, 1, random.randint(-5, 5)]])
-            live_img = cv2.warpAffine(live_img, M, (cols, rows))
+            live_img, state.cycle_frame_ref = publish_live_frame(defective.shape, lambda out: cv2.warpAffine(defective, M, (cols, rows), dst=out))
         else:
-             # Real Camera
-             live_img = state.camera.get_frame()
+             # Real Camera: newest captured frame (waits briefly rather than re-inspecting the last one)
+             frame, capture = state.camera.get_frame_with_meta(after_seq=state.last_camera_seq, timeout=0.1)
+             if capture["seq"] <= state.last_camera_seq:
+                 # Nothing captured since the last cycle: the same frame is never inspected or recorded twice
+                 return {"error": "No new frame", "idle": True}
+             state.last_camera_seq = capture["seq"]
+             # Position and latency are computed from capture time, not processing time
+             now_ts = capture["ts"]
+
+             def copy_frame(out):
+                 if out is None:
+                     return frame
+                 np.copyto(out, frame)
+                 return out
+
+             live_img, state.cycle_frame_ref = publish_live_frame(frame.shape, copy_frame)
              # Resize if necessary to match master or vice versa? 
              # For MVP assuming similar aspect ratio or letting alignment handle it.
     except Exception as e:
+        if not state.use_simulator and state.settings.get("camera_id") is not None:
+            # Transient camera failure: the supervisor reconnects, the job keeps its source
+            state.camera_supervisor.report_failure(e)
+            return {"error": f"Camera error: {e}"}
         # Fallback if camera fails
         print(f"Camera error: {e}")
         state.use_simulator = True
@@ -1751,117 +2274,86 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
         log_event("camera_fallback", "warning", "Camera error, switched to simulator", {"error": str(e)})
         return {"error": str(e)}
 
-    # 2. Inspect
-    tolerances = active_recipe.get("tolerances", {}) if active_recipe else {}
-    diff_threshold = int(tolerances.get("diff_threshold", 30))
-    min_blob_area = int(tolerances.get("min_blob_area_px", 50))
-    max_shift = float(tolerances.get("max_allowed_shift_px", 20))
-    allowed_rotation = float(tolerances.get("allowed_rotation_deg", 1.0))
-    allowed_stretch_ppm = float(tolerances.get("allowed_stretch_ppm", 500.0))
+    return {"recipe": active_recipe, "live": live_img, "now_ts": now_ts, "sensor": None, "capture": capture,
+            "ground_truth": ground_truth, "acquire_ms": round((time.perf_counter() - start) * 1000.0, 2)}
+
+def commit_cycle(ctx: dict, analysis: dict) -> dict:
+    """Records an analysed frame: color, counters, events, alarms and storage (main process only)."""
+    start = time.perf_counter()
+    active_recipe = ctx["recipe"]
+    live_img = ctx["live"]
+    now_ts = ctx["now_ts"]
+    capture = ctx.get("capture")
+    aligned = analysis["aligned"]
+    if analysis.get("partial_warp") is not None:
+        # The diff only needed the ROIs warped; viewers get the full warp, built on first encode
+        aligned = LazyImage(functools.partial(warp_to_master, live_img, analysis["partial_warp"], aligned.shape))
+    heatmap = analysis["heatmap"]
+    defects = analysis["defects"]
+    ground_truth = ctx.get("ground_truth")
+    # Scored before any alarm handling drops defects (aligned coords == master coords)
+    truth_score = state.sim_score.update(ground_truth, defects) if ground_truth is not None else None
+    severities = analysis["severities"]
+    cavity_index = analysis["cavity_index"]
+    lane_results = analysis["lanes"]
+    rules = active_recipe.get("defect_rules", {})
+    # Worker processes register with their own Inspector; mirror the outcome here
+    state.inspector.last_registration_ok = analysis["registration_ok"]
+    state.inspector.last_match_count = analysis["match_count"]
 
-    aligned, transform = state.inspector.align_images(state.master_image, live_img)
-    diff, thresh, heatmap, defects = state.inspector.compare_images(
-        state.master_image,
-        aligned,
-        diff_threshold=diff_threshold,
-        min_blob_area=min_blob_area
-    )
-
-    # Registration checks
-    dx = abs(transform.get("dx", 0.0))
-    dy = abs(transform.get("dy", 0.0))
-    rot = abs(transform.get("rotation_deg", 0.0))
-    scale_x = transform.get("scale_x", 1.0)
-    stretch_ppm = abs(scale_x - 1.0) * 1_000_000
-    if dx > max_shift or dy > max_shift or rot > allowed_rotation or stretch_ppm > allowed_stretch_ppm:
-        state.inspector.last_registration_ok = False
-
-    # Apply ROIs (include/exclude) from recipe if present
-    rois = active_recipe.get("inspection_rois") or active_recipe.get("rois") or []
-    exclude_rois = active_recipe.get("exclude_rois") or []
-    if rois:
-        includes = [r for r in rois if r.get("type") == "include" or "type" not in r]
-        if includes:
-            filtered = []
-            for d in defects:
-                cx = d.get("x", 0) + d.get("w", 0) / 2
-                cy = d.get("y", 0) + d.get("h", 0) / 2
-                if any(cx >= r.get("x", 0) and cy >= r.get("y", 0) and cx <= r.get("x", 0) + r.get("w", 0) and cy <= r.get("y", 0) + r.get("h", 0) for r in includes):
-                    filtered.append(d)
-            defects = filtered
-    if exclude_rois:
-        filtered = []
-        for d in defects:
-            cx = d.get("x", 0) + d.get("w", 0) / 2
-            cy = d.get("y", 0) + d.get("h", 0) / 2
-            if not any(cx >= r.get("x", 0) and cy >= r.get("y", 0) and cx <= r.get("x", 0) + r.get("w", 0) and cy <= r.get("y", 0) + r.get("h", 0) for r in exclude_rois):
-                filtered.append(d)
-        defects = filtered
-    lane_count = max(1, int(state.recipe_lane_count or 1))
-    if lane_count > 1 and state.master_image is not None:
-        width = state.master_image.shape[1]
-        if width > 0:
-            for d in defects:
-                d["cavity_index"] = min(lane_count, max(1, int((d.get("x", 0) / width) * lane_count) + 1))
-    
     # 3. Color Monitoring
-    color_rois = active_recipe.get("color_rois") or []
-    if color_rois:
-        r = color_rois[0]
-        x1 = int(r.get("x", 0))
-        y1 = int(r.get("y", 0))
-        w = int(r.get("w", 0))
-        h = int(r.get("h", 0))
-        x2 = min(aligned.shape[1], x1 + w)
-        y2 = min(aligned.shape[0], y1 + h)
-        color_roi = aligned[y1:y2, x1:x2]
-    else:
-        # For MVP, take a center crop
-        h, w, _ = aligned.shape
-        cy, cx = h // 2, w // 2
-        roi_size = 50
-        y1, y2 = max(0, cy-roi_size), min(h, cy+roi_size)
-        x1, x2 = max(0, cx-roi_size), min(w, cx+roi_size)
-        color_roi = aligned[y1:y2, x1:x2]
-    
-    # Calculate average RGB
-    if color_roi.size > 0:
-        avg_rgb = cv2.mean(color_roi)[:3] # Tuple (B, G, R, alpha) -> takes first 3
-        # cv2.mean returns scalar per channel. 
-        # Note: cv2 is BGR. 
-        b, g, r = avg_rgb
-        # Convert to Lab
-        # Create a single pixel for conversion
-        pixel_bgr = np.uint8([[[b, g, r]]])
-        pixel_rgb = cv2.cvtColor(pixel_bgr, cv2.COLOR_BGR2RGB)
-        
-        l, a, b_lab = state.color_monitor.rgb_to_lab(pixel_rgb[0,0])
+    if analysis["mean_bgr"] is not None:
+        l, a, b_lab = mean_bgr_to_lab(analysis["mean_bgr"])
         
         # Record
         measurement = state.color_monitor.record_measurement(l, a, b_lab)
     else:
         measurement = None
 
-    # Run Diagnostics
-    diag_metrics = Diagnostics.calculate_image_quality(live_img)
+    # Per-lane summary (timing, counts, color vs active target)
+    lanes_summary = []
+    if lane_results is not None:
+        target = state.color_monitor.get_active_target()
+        for lane in lane_results:
+            entry = {key: value for key, value in lane.items() if key != "mean_bgr"}
+            entry["lab"] = None
+            entry["delta_e"] = None
+            if lane["mean_bgr"] is not None:
+                lab = mean_bgr_to_lab(lane["mean_bgr"])
+                entry["lab"] = {"L": float(lab[0]), "a": float(lab[1]), "b": float(lab[2])}
+                if target:
+                    entry["delta_e"] = float(state.color_monitor.calculate_delta_e(
+                        np.array(lab), np.array([target.l_target, target.a_target, target.b_target]), target.deltae_formula
+                    ))
+            lanes_summary.append(entry)
+
+    # Diagnostics ran as an analysis stage (None when disabled by the recipe)
+    diag_metrics = analysis["diagnostics"]
 
     # Mock Production Stats
-    if state.use_simulator:
+    sensor = ctx.get("sensor")
+    if sensor is not None:
+        # Replay: the recorded sensor context replaces live/simulated motion
+        speed_m_min = float(sensor.get("speed_mpm") or 0.0)
+        state.current_mm = float(sensor.get("web_pos_mm") or 0.0)
+        state.label_index = int(sensor.get("label_index") or 0)
+        state.encoder_ticks = int(sensor.get("encoder_ticks") or 0)
+        state.speed_mpm = speed_m_min
+    elif state.use_simulator:
         speed_m_min = 150.0 + random.uniform(-5, 5)
     else:
         # Simular encoder cuando se usa cámara real sin encoder físico
-        elapsed = time.time() - state.last_frame_ts if state.last_frame_ts else 0.05
-        state.last_frame_ts = time.time()
+        # (intervalo entre capturas; la posición se avanza abajo con el mismo dt)
+        elapsed = max(0.0, now_ts - state.last_frame_ts) if state.last_frame_ts else 0.05
         
         # Velocidad simulada en modo cámara real
         simulated_speed_mpm = state.settings.get("simulated_speed_mpm", 30.0)
         distance_m = (simulated_speed_mpm / 60.0) * elapsed  # metros recorridos
-        state.current_mm += distance_m * 1000.0  # convertir a mm
         state.speed_mpm = simulated_speed_mpm
         state.encoder_ticks += int(distance_m * 100)  # 100 ticks por metro
         speed_m_min = simulated_speed_mpm
     
-    ts_ms = int(time.time() * 1000)
+    ts_ms = int(now_ts * 1000)
 
     # Update counters and meters
     state.counters["total_frames"] += 1
@@ -1892,12 +2384,15 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
         color_event_dict = color_event.dict()
         state.color_events.append(color_event_dict)
         insert_color_event(color_event_dict)
-    if state.last_frame_ts is not None:
+        agg = active_roll_aggregate()
+        if agg is not None:
+            agg.add_color(ts_ms, measurement.delta_e, status)
+    if state.last_frame_ts is not None and sensor is None:
         dt = max(0.0, now_ts - state.last_frame_ts)
         meters_inc = (speed_m_min / 60.0) * dt
         state.current_mm += meters_inc * 1000.0
-        if (state.current_mm / 1000.0) // state.segment_length_m > state.segment_index:
-            state.segment_index = int((state.current_mm / 1000.0) // state.segment_length_m)
+    if (state.current_mm / 1000.0) // state.segment_length_m > state.segment_index:
+        state.segment_index = int((state.current_mm / 1000.0) // state.segment_length_m)
     state.last_frame_ts = now_ts
 
     # Update roll diameter from length (simple winding model)
@@ -1908,6 +2403,17 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
         diameter = ((4 * thickness * length_mm / np.pi) + (core_d ** 2)) ** 0.5
         state.settings["roll_diameter_mm"] = round(diameter, 2)
 
+    # Raw frame + sensor context for replay (never while replaying)
+    image_uri = "memory://live"
+    recorder = get_roll_recorder() if sensor is None else None
+    if recorder is not None:
+        image_uri = recorder.record(live_img, now_ts, {
+            "web_pos_mm": state.current_mm,
+            "speed_mpm": speed_m_min,
+            "label_index": state.label_index,
+            "encoder_ticks": state.encoder_ticks,
+        }) or image_uri
+
     # Frame envelope
     frame_id = str(uuid.uuid4())
     lane_id = 1
@@ -1918,16 +2424,19 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
         speed_mpm=float(speed_m_min),
         lane_id=lane_id,
         label_index=state.label_index,
-        image_uri="memory://live",
+        image_uri=image_uri,
         exposure_us=int(state.settings.get("exposure", -5.0) * 1000) if state.settings.get("exposure") else 0,
         illumination_state={}
     )
     frame_dict = frame_env.dict()
     state.frame_history.append(frame_dict)
-    insert_frame(frame_dict)
+    insert_frame({**frame_dict, "roll_id": state.roll_id, "job_id": state.job_id})
 
     # Alarm rules
-    critical_defect = any(d.get("area", 0) >= state.alarm_rules["critical_defect_area"] for d in defects)
+    if lane_results is not None:
+        critical_defect = bool((severities == "critical").any())
+    else:
+        critical_defect = bool((defects["area"] >= state.alarm_rules["critical_defect_area"]).any())
     if critical_defect:
         raise_alarm("critical_defect", "critical", "Critical defect detected", {"count": len(defects)})
     else:
@@ -1947,11 +2456,15 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
 
     if not state.inspector.last_registration_ok:
         raise_alarm("registration_lost", "critical", "Registration lost", {"matches": state.inspector.last_match_count})
-        defects = []
+        defects = defects[:0]
+        severities = severities[:0]
+        cavity_index = cavity_index[:0] if cavity_index is not None else None
     else:
         clear_alarm("registration_lost")
 
-    if not diag_metrics or diag_metrics.get("brightness", 0) < state.alarm_rules["brightness_min"] or diag_metrics.get("brightness", 0) > state.alarm_rules["brightness_max"]:
+    if diag_metrics is None:
+        pass  # diagnostics stage disabled: no sensor signal check
+    elif not diag_metrics or diag_metrics.get("brightness", 0) < state.alarm_rules["brightness_min"] or diag_metrics.get("brightness", 0) > state.alarm_rules["brightness_max"]:
         raise_alarm("sensor_signal_lost", "critical", "Sensor signal lost", {"brightness": diag_metrics.get("brightness", None) if diag_metrics else None})
     else:
         clear_alarm("sensor_signal_lost")
@@ -1980,24 +2493,15 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
             else:
                 clear_alarm("cmark_jitter")
 
+    # API edge: structured defect array -> dicts
+    defect_list = defects_to_dicts(defects, cavity_index=cavity_index)
+    cavities = cavity_index.tolist() if cavity_index is not None else [None] * len(defect_list)
+
     # Traceability entries
-    for d in defects:
-        area = d.get("area", 0)
-        rules = active_recipe.get("defect_rules", {})
-        crit_area = rules.get("critical_area_px", state.alarm_rules["critical_defect_area"])
-        major_area = rules.get("major_area_px", 200)
-        if area >= crit_area:
-            severity = "critical"
-        elif area >= major_area:
-            severity = "major"
-        else:
-            severity = "minor"
-        lane_count = max(1, int(state.recipe_lane_count or 1))
-        cavity_index = None
-        if lane_count > 1 and state.master_image is not None:
-            width = state.master_image.shape[1]
-            if width > 0:
-                cavity_index = min(lane_count, max(1, int((d.get("x", 0) / width) * lane_count) + 1))
+    agg = active_roll_aggregate()
+    for d, severity, cavity in zip(defect_list, severities.tolist(), cavities):
+        if agg is not None:
+            agg.add_defect(state.current_mm / 1000.0, d.get("area", 0), severity, cavity)
         entry = {
             "id": str(uuid.uuid4()),
             "ts": now_iso(),
@@ -2008,12 +2512,12 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
             "severity": severity,
             "type": "defect",
             "defect": d,
-            "cavity_index": cavity_index
+            "cavity_index": cavity
         }
         state.trace_entries.append(entry)
 
         crop_uri = ""
-        if active_recipe.get("store_full_frame_on_defect") or defects:
+        if active_recipe.get("store_full_frame_on_defect") or defect_list:
             try:
                 os.makedirs("evidence", exist_ok=True)
                 x, y, w, h = d.get("x", 0), d.get("y", 0), d.get("w", 0), d.get("h", 0)
@@ -2031,52 +2535,31 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
             roll_id=state.roll_id,
             ts_utc_ms=ts_ms,
             web_pos_mm=int(state.current_mm),
-            lane_id=cavity_index or 1,
+            lane_id=cavity or 1,
             label_index=state.label_index,
             defect_type=rules.get("default_type", "OTHER"),
             severity="CRITICAL" if severity == "critical" else "MAJOR" if severity == "major" else "MINOR",
             score=1.0,
             bbox=[d.get("x", 0), d.get("y", 0), d.get("w", 0), d.get("h", 0)],
             crop_uri=crop_uri,
-            frame_uri="memory://live",
+            frame_uri=image_uri,
             master_diff_uri="",
             notes=""
         )
         state.defect_events.append(defect_event.dict())
-        insert_defect(defect_event.dict())
-    
-    # Store last frames for streaming
-    state.last_frames["live"] = live_img
-    state.last_frames["aligned"] = aligned
-    state.last_frames["heatmap"] = heatmap
-    state.last_frames["master"] = state.master_image
+        insert_defect({**defect_event.dict(), "segment_index": state.segment_index, "cavity_index": cavity, "meta": {"defect": d}})
 
-    # Encode images for display
-    def encode_b64(img):
-        img_out = img
-        if scale and scale > 0 and scale < 1:
-            h, w = img.shape[:2]
-            img_out = cv2.resize(img, (int(w * scale), int(h * scale)))
-        fmt = ".jpg" if format.lower() in ["jpg", "jpeg"] else ".png"
-        if fmt == ".jpg":
-            success, encoded = cv2.imencode(fmt, img_out, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
-        else:
-            success, encoded = cv2.imencode(fmt, img_out)
-        if not success:
-            raise ValueError("Could not encode image")
-        return base64.b64encode(encoded.tobytes()).decode("utf-8")
+    stages_ms = {"acquire": ctx["acquire_ms"], **analysis["stages_ms"], "commit": round((time.perf_counter() - start) * 1000.0, 2)}
 
     return {
-        "defects": defects,
-        "live_image": encode_b64(live_img),
-        "aligned_image": encode_b64(aligned),
-        "heatmap_image": encode_b64(heatmap),
-        "master_image": encode_b64(state.master_image), # Return master to ensure sync
-        "frame_format": format,
+        "defects": defect_list,
+        "lanes": lanes_summary,
+        "images": {"live": live_img, "aligned": aligned, "heatmap": heatmap, "master": state.master_image},
         "defect_count": len(defects),
         "source": "simulator" if state.use_simulator else "camera",
         "color_measurement": measurement.dict() if measurement else None,
         "diagnostics": diag_metrics,
+        "ground_truth": ground_truth,
         "stats": {
             "speed_m_min": speed_m_min,
             "yield_pct": 98.5, 
@@ -2086,9 +2569,281 @@ def get_inspection_frame(format: str = "jpg", quality: int = 70, scale: float =
             "encoder_ticks": state.encoder_ticks,
             "label_index": state.label_index,
             "roll_diameter_mm": state.settings.get("roll_diameter_mm"),
-            "registration_ok": state.inspector.last_registration_ok
+            "registration_ok": analysis["registration_ok"],
+            "registration_method": analysis["registration_method"],
+            "match_stats": analysis["match_stats"],
+            "screen_stats": analysis["screen_stats"],
+            "analysis_ms": analysis["analysis_ms"],
+            "stages_ms": stages_ms,
+            "capture_seq": capture["seq"] if capture else None,
+            "capture_latency_ms": round((time.time() - now_ts) * 1000.0, 2),
+            "ground_truth": truth_score
         }
     }
 
+def render_inspection_result(result: dict, seq: int, format: str = "jpg", quality: int = 70, scale: float = 0.6) -> dict:
+    """
+    Encodes a cycle result for the HMI. Encodings are cached on the result per
+    (format, quality, scale), so several clients reading the same frame share them.
+    """
+    images = result.get("images")
+    if images is None:
+        return result
+
+    def encode_b64(img):
+        return base64.b64encode(encode_image(img, format=format, quality=quality, scale=scale)).decode("utf-8")
+
+    renders = result.setdefault("renders", {})
+    key = (format.lower(), int(quality), float(scale))
+    encoded = renders.get(key)
+    if encoded is None:
+        encoded = {}
+        # While this result is the hub's current frame, MJPEG viewers and pollers share encodes
+        for name in images:
+            item = state.stream_hub.encoded(name, format, quality, scale, source=result)
+            if item is not None:
+                encoded[name] = base64.b64encode(item[1]).decode("utf-8")
+        missing = [name for name in images if name not in encoded]
+        if missing:
+            # Pin the ring slots while encoding; they are only reused once released
+            pinned = []
+            try:
+                for frame_ref in result.get("frame_refs") or []:
+                    ref = frame_ref.ring.get(frame_ref.seq)
+                    if ref is None:
+                        raise HTTPException(status_code=409, detail="Frame superseded")
+                    pinned.append(ref)
+                encoded.update({name: encode_b64(images[name]) for name in missing})
+            finally:
+                for ref in pinned:
+                    ref.release()
+        renders[key] = encoded
+    response = {k: v for k, v in result.items() if k not in ("images", "renders", "frame_refs")}
+    response.update({
+        "live_image": encoded["live"],
+        "aligned_image": encoded["aligned"],
+        "heatmap_image": encoded["heatmap"],
+        "master_image": encoded["master"], # Return master to ensure sync
+        "frame_format": format,
+        "seq": seq,
+    })
+    return response
+
+@app.get("/pipeline/status")
+def pipeline_status():
+    status = state.pipeline.status()
+    status["frame_ring"] = state.frame_ring.stats() if state.frame_ring is not None else None
+    status["stages"] = state.analysis_graph.status()
+    status["stream_hub"] = state.stream_hub.stats()
+    status["camera"] = {**state.camera.stats(), "state": state.camera_supervisor.state}
+    status["storage"] = writer_stats()
+    return status
+
+def get_roll_recorder():
+    """Recorder for the active roll while settings.record_rolls is on (opened lazily, one per roll)."""
+    recorder = state.recorder
+    if recorder is not None and (recorder.roll_id != state.roll_id or not state.settings.get("record_rolls")):
+        close_roll_recorder()
+    if state.recorder is None and state.settings.get("record_rolls") and state.roll_id:
+        state.recorder = RollRecorder(state.job_id, state.roll_id, state.active_recipe,
+                                      master=state.master_image, master_meta=state.master_meta)
+        log_event("roll_recording", "info", "Roll recording started", {"roll_id": state.roll_id, "recording": state.recorder.name})
+    return state.recorder
+
+def close_roll_recorder():
+    recorder = state.recorder
+    if recorder is None:
+        return
+    state.recorder = None
+    recorder.close()
+    log_event("roll_recorded", "info", "Roll recording closed", recorder.status())
+
+def finish_replay():
+    """Ends the running replay like a job stop: pipeline stopped, replay roll and job closed."""
+    replay = state.replay
+    if replay is None:
+        return
+    try:
+        result = stop_job()
+    finally:
+        state.replay = None
+        replay.close()
+    state.last_replay = {**replay.status(), "report": result.get("report")}
+    log_event("replay_finished", "info", "Replay finished", {k: v for k, v in state.last_replay.items() if k != "report"})
+
+@app.get("/simulator/pool")
+def simulator_pool_status():
+    pool = state.sim_pool
+    return {"pool": pool.status() if pool is not None else None, "score": state.sim_score.status()}
+
+@app.post("/simulator/score/reset")
+def reset_simulator_score():
+    state.sim_score.reset()
+    return state.sim_score.status()
+
+@app.get("/replay/recordings")
+def replay_recordings():
+    return {"recordings": list_recordings(), "recording": state.recorder.status() if state.recorder else None}
+
+@app.post("/replay/start")
+def start_replay(payload: ReplayStart):
+    """
+    Replays a recorded roll through the full pipeline (registration, detection,
+    events, alarms, storage) under a replay job/roll, with the recorded sensor
+    context. pace="fast" runs as fast as the pipeline allows.
+    """
+    if state.job_id or state.roll_id or state.pipeline.running or state.replay is not None:
+        raise HTTPException(status_code=409, detail="Stop the active job before replaying")
+    path = os.path.join(RECORDINGS_DIR, os.path.basename(payload.recording))
+    try:
+        replay = RollReplay(path, pace=payload.pace, speed=payload.speed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    if replay.total == 0:
+        replay.close()
+        raise HTTPException(status_code=400, detail="Recording has no frames")
+    try:
+        apply_recipe(payload.recipe or replay.meta.get("recipe"))
+    except Exception as e:
+        replay.close()
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=404, detail=f"Recipe load failed: {e}")
+    # The recorded master keeps the replay faithful even if the recipe file changed since
+    master = replay.master()
+    if master is not None:
+        set_master_image(master, replay.meta.get("master_meta") or {})
+
+    state.job_id = payload.job_id or f"{replay.meta.get('job_id') or 'JOB'}-REPLAY"
+    state.roll_id = f"{replay.meta.get('roll_id') or 'ROLL'}-REPLAY-{datetime.now().strftime('%H%M%S')}"
+    reset_roll_counters()
+    insert_job(state.job_id, state.active_recipe, "", "", "replay")
+    insert_roll(state.roll_id, state.job_id)
+    state.replay = replay
+    state.replay_finishing = False
+    log_event("replay_started", "info", "Replay started", {"recording": replay.name, "pace": replay.pace, "job_id": state.job_id, "roll_id": state.roll_id})
+    # The replay paces itself (or not at all); the pipeline must not throttle it
+    state.pipeline.max_fps = 0.0
+    state.pipeline.start()
+    return {"status": "ok", "job_id": state.job_id, "roll_id": state.roll_id, "replay": replay.status()}
+
+@app.post("/replay/stop")
+def stop_replay():
+    if state.replay is None:
+        raise HTTPException(status_code=400, detail="No replay running")
+    finish_replay()
+    return {"status": "ok", "replay": state.last_replay}
+
+@app.get("/replay/status")
+def replay_status():
+    return {
+        "active": state.replay.status() if state.replay is not None else None,
+        "last": state.last_replay,
+        "pipeline": state.pipeline.status(),
+    }
+
+BATCH_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+def batch_master(recipe_name: str, recipe: dict):
+    """Master for offline inspection: the loaded one for the active recipe, else the recipe's master file."""
+    with state.inspection_lock:
+        if state.master_image is not None and (recipe_name == state.active_recipe or not recipe.get("master_file")):
+            return state.master_image, state.master_pyramid, master_cache_key(state.master_meta or {})
+    master_file = recipe.get("master_file")
+    if not master_file or not os.path.exists(master_file):
+        raise HTTPException(status_code=400, detail="Master not loaded")
+    with open(master_file, "rb") as fh:
+        contents = fh.read()
+    img = cv2.imdecode(np.frombuffer(contents, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise HTTPException(status_code=400, detail="Recipe master could not be decoded")
+    return img, build_master_pyramid(img, levels=3), (hashlib.sha256(contents).hexdigest(), recipe.get("master_render_dpi"), 0)
+
+@app.post("/inspection/batch")
+def inspect_batch(recipe: str, directory: Optional[str] = None, workers: int = 4,
+                  diff_threshold: Optional[float] = None, min_blob_area_px: Optional[float] = None,
+                  files: List[UploadFile] = File(None)):
+    """
+    Re-inspects saved frames (uploaded files and/or a server-side directory)
+    against the recipe master. No line state is touched (counters, rolls,
+    alarms, storage). Streams one NDJSON line per frame, in order, then a summary.
+    """
+    try:
+        recipe_data = state.recipe_manager.load_recipe(recipe)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    # Tolerance overrides for what-if runs (e.g. a new diff_threshold)
+    tolerances = dict(recipe_data.get("tolerances") or {})
+    if diff_threshold is not None:
+        tolerances["diff_threshold"] = diff_threshold
+    if min_blob_area_px is not None:
+        tolerances["min_blob_area_px"] = min_blob_area_px
+    recipe_data["tolerances"] = tolerances
+
+    paths = []
+    if directory:
+        if not os.path.isdir(directory):
+            raise HTTPException(status_code=400, detail="Directory not found")
+        paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(BATCH_IMAGE_EXTENSIONS))
+    uploads = [f for f in (files or []) if f is not None]
+    if not paths and not uploads:
+        raise HTTPException(status_code=400, detail="No images given")
+    master, pyramid, key = batch_master(recipe, recipe_data)
+    lane_count = max(1, int(recipe_data.get("lane_count", 1) or 1))
+    critical_area = state.alarm_rules["critical_defect_area"]
+
+    def frames():
+        for upload in uploads:
+            yield upload.filename, upload.file.read()
+        for path in paths:
+            yield os.path.basename(path), path
+
+    def stream():
+        start = time.perf_counter()
+        total = errors = defects = 0
+        for item in state.inspector.inspect_batch(master, frames(), recipe_data, workers=workers, key=key, pyramid=pyramid,
+                                            lane_count=lane_count, critical_area=critical_area):
+            total += 1
+            errors += 0 if item["ok"] else 1
+            defects += item.get("defect_count", 0)
+            yield json.dumps(item, default=str) + "\n"
+        elapsed = time.perf_counter() - start
+        yield json.dumps({"summary": {
+            "recipe": recipe,
+            "frames": total,
+            "errors": errors,
+            "defects": defects,
+            "elapsed_ms": round(elapsed * 1000.0, 2),
+            "fps": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        }}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.on_event("startup")
+def start_process_workers():
+    # Started with the server, not at import: spawned workers re-import this module
+    configure_process_workers(state.settings.get("process_workers", 0))
+    state.camera_supervisor.start()
+    state.camera.refresh_cameras()
+    start_writer(batch_rows=state.settings.get("db_batch_rows", 500),
+                 flush_ms=state.settings.get("db_flush_ms", 200),
+                 queue_size=state.settings.get("db_queue_size", 10000))
+
+@app.on_event("shutdown")
+def stop_pipeline_on_shutdown():
+    state.pipeline.stop()
+    state.camera_supervisor.stop()
+    state.camera.release()
+    stop_writer()
+    if state.process_inspector is not None:
+        state.process_inspector.shutdown()
+
+def start_pipeline():
+    state.pipeline.max_fps = float(state.settings.get("pipeline_max_fps", 20.0) or 0.0)
+    if state.settings.get("background_pipeline", True):
+        state.pipeline.start()
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
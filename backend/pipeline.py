@@ -0,0 +1,199 @@
+"""
+Background acquisition-and-inspection pipeline
+- Un hilo dedicado ejecuta el ciclo completo (adquirir → alinear → comparar → color → alarmas → persistir)
+- El último resultado se publica en un slot compartido
+- Los clientes HTTP solo leen el slot (varios HMI no duplican conteos)
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InspectionPipeline:
+    """
+    Runs `cycle` in a loop on a worker thread, paced to at most max_fps
+    (a real camera blocks in get_frame, so it sets the rate by itself).
+    Each cycle's return value is published with an increasing sequence number;
+    `retire` is called with a result once it has been replaced (e.g. to release
+    the frame buffers it references).
+
+    Overlapped mode (set_stages): `begin` acquires a frame and submits it,
+    returning a handle; up to `depth` handles are in flight and `finish`
+    completes them strictly in submission order.
+    """
+
+    def __init__(self, cycle: Callable[[], dict], max_fps: float = 20.0, error_backoff_s: float = 0.5,
+                 retire: Optional[Callable[[dict], None]] = None):
+        self.cycle = cycle
+        self.retire = retire
+        self.max_fps = max_fps
+        self.error_backoff_s = error_backoff_s
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._latest: Optional[dict] = None
+        self.cycles = 0
+        self.errors = 0
+        self.last_error = ""
+        self.last_cycle_ms = 0.0
+        self.started_at: Optional[float] = None
+        self.begin: Optional[Callable[[], object]] = None
+        self.finish: Optional[Callable[[object], dict]] = None
+        self.depth = 1
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        # A fresh Event per run: a thread that outlived stop()'s join timeout keeps its own (set) Event
+        self._stop = threading.Event()
+        self._publish(None)
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="inspection-pipeline", daemon=True)
+        self._thread.start()
+        logger.info("Inspection pipeline started")
+
+    def stop(self, timeout: float = 5.0):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+        self._publish(None)
+        logger.info("Inspection pipeline stopped")
+
+    def set_stages(self, begin: Optional[Callable[[], object]] = None, finish: Optional[Callable[[object], dict]] = None, depth: int = 1):
+        """Switches to overlapped begin/finish mode (or back to `cycle` with None). Applies on the next start()."""
+        self.begin = begin
+        self.finish = finish
+        self.depth = max(1, int(depth))
+
+    def latest(self) -> Tuple[int, Optional[dict]]:
+        with self._cond:
+            return self._seq, self._latest
+
+    def wait_for_result(self, after_seq: int = 0, timeout: float = 2.0) -> Tuple[int, Optional[dict]]:
+        """Blocks until a result newer than after_seq is published (or timeout)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._seq <= after_seq and self.running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._seq, self._latest
+
+    def status(self) -> dict:
+        elapsed = time.time() - self.started_at if self.started_at and self.running else 0.0
+        return {
+            "running": self.running,
+            "seq": self._seq,
+            "cycles": self.cycles,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_cycle_ms": round(self.last_cycle_ms, 2),
+            "fps": round(self.cycles / elapsed, 2) if elapsed > 0 else 0.0,
+            "max_fps": self.max_fps,
+            "mode": "overlapped" if self.begin is not None else "sequential",
+            "depth": self.depth if self.begin is not None else 1,
+        }
+
+    def _publish(self, result: Optional[dict]):
+        with self._cond:
+            previous = self._latest
+            if result is not None:
+                self._seq += 1
+            self._latest = result
+            self._cond.notify_all()
+        if previous is not None:
+            self._retire(previous)
+
+    @staticmethod
+    def _idle(result) -> bool:
+        # No new frame to inspect: the previous result stays published
+        return isinstance(result, dict) and bool(result.get("idle"))
+
+    def _completed(self, result: dict, start: float, stop: threading.Event):
+        if stop is not self._stop:
+            # A run that outlived stop(): its late result is never published over the current run's
+            self._retire(result)
+            return
+        self.last_cycle_ms = (time.monotonic() - start) * 1000.0
+        self.cycles += 1
+        self._publish(result)
+
+    def _retire(self, result: dict):
+        if self.retire is not None:
+            try:
+                self.retire(result)
+            except Exception as e:
+                logger.warning(f"Retiring pipeline result failed: {e}")
+
+    def _failed(self, e: Exception):
+        # HTTPException (no master, no job...) or a processing error: keep running
+        self.errors += 1
+        self.last_error = str(getattr(e, "detail", e))
+        logger.warning(f"Inspection cycle failed: {self.last_error}")
+
+    def _pace(self, start: float, stop: threading.Event):
+        if self.max_fps and self.max_fps > 0:
+            remaining = 1.0 / self.max_fps - (time.monotonic() - start)
+            if remaining > 0:
+                stop.wait(remaining)
+
+    def _run_overlapped(self, begin, finish, depth: int, stop: threading.Event):
+        inflight = deque()
+        while not stop.is_set() or inflight:
+            if not stop.is_set() and len(inflight) < depth:
+                start = time.monotonic()
+                try:
+                    inflight.append((start, begin()))
+                except Exception as e:
+                    self._failed(e)
+                    stop.wait(self.error_backoff_s)
+                    continue
+                if len(inflight) < depth:
+                    self._pace(start, stop)
+                    continue
+            # Oldest first, so results are committed and published in order
+            start, handle = inflight.popleft()
+            try:
+                result = finish(handle)
+            except Exception as e:
+                self._failed(e)
+                continue
+            if not self._idle(result):
+                self._completed(result, start, stop)
+            if not stop.is_set():
+                self._pace(start, stop)
+
+    def _run(self, stop: threading.Event):
+        self.cycles = 0
+        begin, finish = self.begin, self.finish
+        if begin is not None and finish is not None:
+            self._run_overlapped(begin, finish, self.depth, stop)
+            return
+        while not stop.is_set():
+            start = time.monotonic()
+            try:
+                result = self.cycle()
+            except Exception as e:
+                self._failed(e)
+                stop.wait(self.error_backoff_s)
+                continue
+            if not self._idle(result):
+                self._completed(result, start, stop)
+            self._pace(start, stop)
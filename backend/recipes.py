@@ -57,6 +57,9 @@ class Recipe(BaseModel):
     master_render_dpi: int = 150
     registration_mode: str = "TEMPLATE"  # FIDUCIALS, EDGE, TEMPLATE, HYBRID
     tolerances: Dict[str, float] = Field(default_factory=lambda: {"pos_px": 5.0, "scale_ppm": 500.0, "rotation_deg": 0.5, "diff_threshold": 30.0})
+    alignment: Dict[str, Any] = Field(default_factory=lambda: {"mode": "full", "matcher": "bf"})  # mode: full, pyramid, phase, track; matcher: bf, knn, lsh
+    detection: Dict[str, Any] = Field(default_factory=lambda: {"screen": False, "screen_level": 2, "screen_threshold": 0, "lanes": False})  # screen_threshold 0 = diff_threshold // 3; lanes: per-lane pipeline
+    stages: Dict[str, bool] = Field(default_factory=dict)  # optional analysis stages on/off, e.g. {"color": False, "diagnostics": False}
     
     # New Operational Parameters
     web_width_mm: float = 330.0
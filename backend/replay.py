@@ -0,0 +1,210 @@
+"""
+Roll recording and deterministic replay
+- Grabación de frames crudos con su contexto de sensor (web_pos_mm, speed_mpm, label_index, encoder)
+- Secuencia compacta en disco: frames.bin (PNG concatenados) + index.jsonl + meta.json + master.png
+- Reproducción a máxima velocidad o al ritmo original a través del pipeline completo
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RECORDINGS_DIR = "recordings"
+SENSOR_FIELDS = ("web_pos_mm", "speed_mpm", "label_index", "encoder_ticks")
+
+
+class RollRecorder:
+    """
+    Appends raw frames and their sensor context to a recording directory.
+    Encoding and disk writes run on a writer thread behind a bounded queue;
+    when the disk falls behind, frames are dropped (and counted) rather than
+    stalling the line.
+    """
+
+    def __init__(self, job_id: str, roll_id: str, recipe: str, master: Optional[np.ndarray] = None,
+                 master_meta: Optional[dict] = None, base_dir: str = RECORDINGS_DIR, queue_size: int = 64,
+                 png_level: int = 1):
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.name = f"{job_id}_{roll_id}_{stamp}".replace(os.sep, "_")
+        self.path = os.path.join(base_dir, self.name)
+        os.makedirs(self.path, exist_ok=True)
+        self.roll_id = roll_id
+        self.png_level = png_level
+        self.frames = 0
+        self.drops = 0
+        self.bytes = 0
+        self._seq = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        meta = {
+            "version": 1,
+            "job_id": job_id,
+            "roll_id": roll_id,
+            "recipe": recipe,
+            "started_at": datetime.now().isoformat(),
+            "master_meta": master_meta or {},
+            "has_master": master is not None,
+        }
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, indent=2, default=str)
+        if master is not None:
+            cv2.imwrite(os.path.join(self.path, "master.png"), master)
+        self._thread = threading.Thread(target=self._run, name="roll-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, frame: np.ndarray, ts: float, sensor: dict) -> Optional[str]:
+        """Queues a copy of `frame`; returns its URI, or None if dropped."""
+        self._seq += 1
+        item = (self._seq, np.array(frame, copy=True), ts, {k: sensor.get(k) for k in SENSOR_FIELDS})
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.drops += 1
+            return None
+        return f"rec://{self.name}#{self._seq}"
+
+    def close(self, timeout: float = 10.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "roll_id": self.roll_id,
+            "frames": self.frames,
+            "drops": self.drops,
+            "queued": self._queue.qsize(),
+            "bytes": self.bytes,
+        }
+
+    def _run(self):
+        with open(os.path.join(self.path, "frames.bin"), "ab") as data, \
+                open(os.path.join(self.path, "index.jsonl"), "a", encoding="utf-8") as index:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                seq, frame, ts, sensor = item
+                ok, encoded = cv2.imencode(".png", frame, [int(cv2.IMWRITE_PNG_COMPRESSION), self.png_level])
+                if not ok:
+                    self.drops += 1
+                    continue
+                offset = data.tell()
+                data.write(encoded.tobytes())
+                index.write(json.dumps({"seq": seq, "offset": offset, "length": int(encoded.size), "ts": ts, **sensor}) + "\n")
+                self.frames += 1
+                self.bytes += int(encoded.size)
+                # Flush per frame so a crash keeps everything recorded so far readable
+                data.flush()
+                index.flush()
+
+
+class RollReplay:
+    """
+    Reads a recording back frame by frame. pace="fast" returns frames as soon
+    as they are asked for; pace="original" waits so frames come out at the
+    recorded timestamps (scaled by `speed`).
+    """
+
+    def __init__(self, path: str, pace: str = "fast", speed: float = 1.0):
+        if pace not in ("fast", "original"):
+            raise ValueError("pace must be 'fast' or 'original'")
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self.pace = pace
+        self.speed = max(1e-3, float(speed or 1.0))
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as fh:
+            self.meta = json.load(fh)
+        with open(os.path.join(path, "index.jsonl"), "r", encoding="utf-8") as fh:
+            self.index = [json.loads(line) for line in fh if line.strip()]
+        self._data = open(os.path.join(path, "frames.bin"), "rb")
+        self._lock = threading.Lock()
+        self.position = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def total(self) -> int:
+        return len(self.index)
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self.index)
+
+    def master(self) -> Optional[np.ndarray]:
+        master_path = os.path.join(self.path, "master.png")
+        if not self.meta.get("has_master") or not os.path.exists(master_path):
+            return None
+        return cv2.imread(master_path, cv2.IMREAD_COLOR)
+
+    def next_frame(self) -> Optional[Tuple[np.ndarray, dict]]:
+        """Next (frame, sensor context), or None at the end of the recording."""
+        with self._lock:
+            if self.finished:
+                if self.finished_at is None:
+                    self.finished_at = time.monotonic()
+                return None
+            entry = self.index[self.position]
+            self.position += 1
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+            self._data.seek(entry["offset"])
+            encoded = self._data.read(entry["length"])
+        if self.pace == "original":
+            due = self.started_at + (entry["ts"] - self.index[0]["ts"]) / self.speed
+            remaining = due - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        frame = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError(f"Recorded frame {entry['seq']} could not be decoded")
+        sensor = {k: entry.get(k) for k in SENSOR_FIELDS}
+        sensor["ts"] = entry["ts"]
+        return frame, sensor
+
+    def close(self):
+        self._data.close()
+
+    def status(self) -> dict:
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "name": self.name,
+            "pace": self.pace,
+            "speed": self.speed,
+            "position": self.position,
+            "total": self.total,
+            "finished": self.finished,
+            "elapsed_s": round(elapsed, 3),
+            "fps": round(self.position / elapsed, 2) if elapsed > 0 else 0.0,
+            "source": {k: self.meta.get(k) for k in ("job_id", "roll_id", "recipe", "started_at")},
+        }
+
+
+def list_recordings(base_dir: str = RECORDINGS_DIR) -> list:
+    out = []
+    if not os.path.isdir(base_dir):
+        return out
+    for name in sorted(os.listdir(base_dir)):
+        meta_path = os.path.join(base_dir, name, "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        try:
+            with open(meta_path, "r", encoding="utf-8") as fh:
+                meta = json.load(fh)
+            with open(os.path.join(base_dir, name, "index.jsonl"), "r", encoding="utf-8") as fh:
+                frames = sum(1 for line in fh if line.strip())
+        except Exception as e:
+            logger.warning(f"Skipping recording {name}: {e}")
+            continue
+        out.append({"name": name, "frames": frames, **{k: meta.get(k) for k in ("job_id", "roll_id", "recipe", "started_at")}})
+    return out
@@ -0,0 +1,227 @@
+"""
+Incremental per-roll aggregates
+- Se actualiza con cada defecto y evento de color registrado (O(1) por evento)
+- Conteos por bucket de área y severidad, histogramas por segmento y por carril
+- ΔE: media/desviación/mín/máx acumulados (Welford) y tendencia submuestreada
+- Muestra acotada de posiciones para el mapa de bobina
+- Se persiste a JSON al cerrar la bobina; los reportes leen el agregado, no los trace entries
+"""
+
+import json
+import math
+import os
+import threading
+from typing import Callable, List, Optional
+
+
+class Downsampler:
+    """
+    Keeps at most `capacity` points of an unbounded series. When full, adjacent
+    pairs are merged and the stride doubles, so the kept points always cover
+    the whole series evenly. Every point carries the number of samples it
+    stands for; merge(a, b, na, nb) gets both counts.
+    """
+
+    def __init__(self, capacity: int, merge: Callable[[dict, dict, int, int], dict]):
+        self.capacity = max(2, int(capacity))
+        self.merge = merge
+        self.stride = 1
+        self.points: List[dict] = []
+        self.counts: List[int] = []
+        self._pending: Optional[dict] = None
+        self._pending_n = 0
+
+    def add(self, point: dict):
+        if self._pending is None:
+            self._pending = point
+        else:
+            self._pending = self.merge(self._pending, point, self._pending_n, 1)
+        self._pending_n += 1
+        if self._pending_n < self.stride:
+            return
+        self.points.append(self._pending)
+        self.counts.append(self._pending_n)
+        self._pending, self._pending_n = None, 0
+        if len(self.points) >= self.capacity:
+            pairs = range(0, len(self.points) - 1, 2)
+            merged = [self.merge(self.points[i], self.points[i + 1], self.counts[i], self.counts[i + 1]) for i in pairs]
+            counts = [self.counts[i] + self.counts[i + 1] for i in pairs]
+            if len(self.points) % 2:
+                merged.append(self.points[-1])
+                counts.append(self.counts[-1])
+            self.points, self.counts = merged, counts
+            self.stride *= 2
+
+    def values(self) -> List[dict]:
+        return self.points + ([self._pending] if self._pending is not None else [])
+
+    def to_dict(self) -> dict:
+        return {"capacity": self.capacity, "stride": self.stride, "points": self.values(),
+                "counts": self.counts + ([self._pending_n] if self._pending is not None else [])}
+
+    def load(self, data: dict):
+        self.capacity = data.get("capacity", self.capacity)
+        self.stride = data.get("stride", 1)
+        self.points = list(data.get("points", []))
+        # Files without counts: every kept point stood for one stride
+        self.counts = list(data.get("counts") or [self.stride] * len(self.points))
+
+
+def _mean_point(a: dict, b: dict, na: int, nb: int) -> dict:
+    # Weighted by sample count, so a bucket's value is the plain mean of its samples
+    return {"ts": a["ts"], "delta_e": (a["delta_e"] * na + b["delta_e"] * nb) / (na + nb)}
+
+
+def _keep_first(a: dict, b: dict, na: int, nb: int) -> dict:
+    # Roll-map samples: decimate, but a critical defect always wins its slot
+    if b.get("severity") == "critical" and a.get("severity") != "critical":
+        return b
+    return a
+
+
+class RollAggregate:
+    """
+    Running summary of one roll. add_defect/add_color are called as events are
+    recorded; report reads (summary()) never touch per-defect data.
+    """
+
+    def __init__(self, roll_id: str, job_id: str = "", segment_length_m: float = 100.0,
+                 critical_area: float = 500.0, medium_area: float = 200.0,
+                 trend_points: int = 200, map_points: int = 2000):
+        self.roll_id = roll_id
+        self.job_id = job_id
+        self.segment_length_m = segment_length_m
+        self.critical_area = critical_area
+        self.medium_area = medium_area
+        self.defects = 0
+        self.by_bucket = {"small": 0, "medium": 0, "critical": 0}
+        self.by_severity = {}
+        self.by_segment = {}
+        self.by_lane = {}
+        self.max_meter = 0.0
+        self.color_events = 0
+        self.color_status = {}
+        self._de_mean = 0.0
+        self._de_m2 = 0.0
+        self.de_min = None
+        self.de_max = None
+        self.trend = Downsampler(trend_points, _mean_point)
+        self.roll_map = Downsampler(map_points, _keep_first)
+        self._lock = threading.Lock()
+
+    def bucket(self, area: float) -> str:
+        if area >= self.critical_area:
+            return "critical"
+        if area >= self.medium_area:
+            return "medium"
+        return "small"
+
+    def add_defect(self, meter: float, area: float, severity: str, lane_id=None, segment_index: int = None):
+        segment = int(meter // self.segment_length_m) if segment_index is None else int(segment_index)
+        with self._lock:
+            self.defects += 1
+            self.by_bucket[self.bucket(area)] += 1
+            self.by_severity[severity] = self.by_severity.get(severity, 0) + 1
+            self.by_segment[segment] = self.by_segment.get(segment, 0) + 1
+            lane = int(lane_id) if lane_id is not None else 0
+            self.by_lane[lane] = self.by_lane.get(lane, 0) + 1
+            self.max_meter = max(self.max_meter, meter)
+            self.roll_map.add({"meter": round(meter, 3), "severity": severity})
+
+    def add_color(self, ts: float, delta_e: float, status: str = ""):
+        with self._lock:
+            self.color_events += 1
+            if status:
+                self.color_status[status] = self.color_status.get(status, 0) + 1
+            delta = delta_e - self._de_mean
+            self._de_mean += delta / self.color_events
+            self._de_m2 += delta * (delta_e - self._de_mean)
+            self.de_min = delta_e if self.de_min is None else min(self.de_min, delta_e)
+            self.de_max = delta_e if self.de_max is None else max(self.de_max, delta_e)
+            self.trend.add({"ts": ts, "delta_e": round(delta_e, 4)})
+
+    def delta_e_stats(self) -> dict:
+        n = self.color_events
+        return {
+            "count": n,
+            "mean": round(self._de_mean, 4) if n else None,
+            "std": round(math.sqrt(self._de_m2 / (n - 1)), 4) if n > 1 else None,
+            "min": self.de_min,
+            "max": self.de_max,
+        }
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "roll_id": self.roll_id,
+                "job_id": self.job_id,
+                "defects": self.defects,
+                "defects_by_bucket": dict(self.by_bucket),
+                "defects_by_severity": dict(self.by_severity),
+                "defect_map_by_segment": dict(sorted(self.by_segment.items())),
+                "defects_by_lane": dict(sorted(self.by_lane.items())),
+                "delta_e_stats": self.delta_e_stats(),
+                "color_status": dict(self.color_status),
+                "color_trend": [{"ts": p["ts"], "delta_e": round(p["delta_e"], 4)} for p in self.trend.values()],
+            }
+
+    def roll_map_points(self) -> List[dict]:
+        with self._lock:
+            return self.roll_map.values()
+
+    # --- persistence -------------------------------------------------------------
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "version": 1,
+                "roll_id": self.roll_id,
+                "job_id": self.job_id,
+                "segment_length_m": self.segment_length_m,
+                "critical_area": self.critical_area,
+                "medium_area": self.medium_area,
+                "defects": self.defects,
+                "by_bucket": self.by_bucket,
+                "by_severity": self.by_severity,
+                "by_segment": self.by_segment,
+                "by_lane": self.by_lane,
+                "max_meter": self.max_meter,
+                "color_events": self.color_events,
+                "color_status": self.color_status,
+                "de_mean": self._de_mean,
+                "de_m2": self._de_m2,
+                "de_min": self.de_min,
+                "de_max": self.de_max,
+                "trend": self.trend.to_dict(),
+                "roll_map": self.roll_map.to_dict(),
+            }
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.to_dict(), fh)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RollAggregate":
+        with open(path, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        agg = cls(data["roll_id"], data.get("job_id", ""), data.get("segment_length_m", 100.0),
+                  data.get("critical_area", 500.0), data.get("medium_area", 200.0))
+        agg.defects = data.get("defects", 0)
+        agg.by_bucket.update(data.get("by_bucket", {}))
+        agg.by_severity = data.get("by_severity", {})
+        # JSON object keys are strings
+        agg.by_segment = {int(k): v for k, v in data.get("by_segment", {}).items()}
+        agg.by_lane = {int(k): v for k, v in data.get("by_lane", {}).items()}
+        agg.max_meter = data.get("max_meter", 0.0)
+        agg.color_events = data.get("color_events", 0)
+        agg.color_status = data.get("color_status", {})
+        agg._de_mean = data.get("de_mean", 0.0)
+        agg._de_m2 = data.get("de_m2", 0.0)
+        agg.de_min = data.get("de_min")
+        agg.de_max = data.get("de_max")
+        agg.trend.load(data.get("trend", {}))
+        agg.roll_map.load(data.get("roll_map", {}))
+        return agg
@@ -1,37 +1,188 @@
 import cv2
 import numpy as np
 import random
+import threading
+import time
 
 class DefectSimulator:
-    def __init__(self):
-        pass
+    def __init__(self, seed: int = None):
+        # Own generator: seeded runs are reproducible and independent of the global `random`
+        self.rng = random.Random(seed)
+        # Ground truth of the last add_defects call (boxes in image coordinates)
+        self.last_defects = []
+
+    def seed(self, seed: int = None):
+        self.rng.seed(seed)
 
     def add_defects(self, image: np.ndarray, count=3) -> np.ndarray:
         """
         Adds synthetic defects (blobs/lines) to the image.
         :param image: Source image (OpenCV format)
         :param count: Number of defects to add
-        :return: Image with defects
+        :return: Image with defects (planted boxes in self.last_defects)
         """
         defective_image = image.copy()
         h, w, _ = defective_image.shape
+        rng = self.rng
+        planted = []
 
         for _ in range(count):
-            defect_type = random.choice(['blob', 'line'])
-            
+            defect_type = rng.choice(['blob', 'line'])
+
             # Random color (usually dark like ink or paper white)
-            color = (0, 0, 255) if random.random() > 0.5 else (0, 0, 0) # BGR
-            
-            x = random.randint(0, w-1)
-            y = random.randint(0, h-1)
+            color = (0, 0, 255) if rng.random() > 0.5 else (0, 0, 0) # BGR
+
+            x = rng.randint(0, w-1)
+            y = rng.randint(0, h-1)
 
             if defect_type == 'blob':
-                radius = random.randint(5, 20)
+                radius = rng.randint(5, 20)
                 cv2.circle(defective_image, (x, y), radius, color, -1)
+                box = (x - radius, y - radius, x + radius + 1, y + radius + 1)
             elif defect_type == 'line':
-                x2 = x + random.randint(-50, 50)
-                y2 = y + random.randint(-50, 50)
-                thickness = random.randint(2, 5)
+                x2 = x + rng.randint(-50, 50)
+                y2 = y + rng.randint(-50, 50)
+                thickness = rng.randint(2, 5)
                 cv2.line(defective_image, (x, y), (x2, y2), color, thickness)
-                
+                pad = thickness // 2 + 1
+                box = (min(x, x2) - pad, min(y, y2) - pad, max(x, x2) + pad + 1, max(y, y2) + pad + 1)
+
+            x1, y1 = max(0, box[0]), max(0, box[1])
+            x2b, y2b = min(w, box[2]), min(h, box[3])
+            # Pixels that actually changed (a black blob on black print is invisible)
+            changed = int(np.count_nonzero((defective_image[y1:y2b, x1:x2b] != image[y1:y2b, x1:x2b]).any(axis=2))) if x2b > x1 and y2b > y1 else 0
+            planted.append({"type": defect_type, "x": x1, "y": y1, "w": x2b - x1, "h": y2b - y1, "color": color, "changed_px": changed})
+
+        self.last_defects = planted
         return defective_image
+
+
+def score_detections(planted: list, detected: np.ndarray, min_changed_px: int = 50):
+    """
+    (visible planted, found, unmatched detections): planted defects changing at
+    least min_changed_px pixels that overlap a detected box (DEFECT_DTYPE rows).
+    """
+    visible = [d for d in planted if d["changed_px"] >= min_changed_px]
+    found = 0
+    used = np.zeros(len(detected), dtype=bool)
+    for d in visible:
+        hit = ((detected["x"] < d["x"] + d["w"]) & (d["x"] < detected["x"] + detected["w"]) &
+               (detected["y"] < d["y"] + d["h"]) & (d["y"] < detected["y"] + detected["h"]))
+        if hit.any():
+            found += 1
+            used |= hit
+    return len(visible), found, int((~used).sum())
+
+
+class SimulatorFramePool:
+    """
+    Seeded pool of `size` defective, shifted copies of a master, generated
+    once on a background thread into one preallocated array and served
+    round-robin as read-only views (no per-frame allocation). Ground truth
+    boxes are in master coordinates, i.e. where an aligned frame shows them.
+    """
+
+    def __init__(self, master: np.ndarray, size: int = 32, seed: int = 0, defects=(1, 5), max_shift: int = 5):
+        self.master = master
+        self.size = max(1, int(size))
+        self.seed = seed
+        self.defects = defects
+        self.max_shift = max_shift
+        self.frames = np.empty((self.size,) + master.shape, dtype=master.dtype)
+        self.truth = [None] * self.size
+        self.ready = 0
+        self.served = 0
+        self.error = None
+        self._next = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._started = time.perf_counter()
+        self.build_ms = None
+        self._thread = threading.Thread(target=self._generate, name="sim-pool", daemon=True)
+        self._thread.start()
+
+    def _generate(self):
+        simulator = DefectSimulator(seed=self.seed)
+        rng = random.Random(self.seed)
+        rows, cols = self.master.shape[:2]
+        try:
+            for i in range(self.size):
+                if self._stop:
+                    return
+                defective = simulator.add_defects(self.master, count=rng.randint(*self.defects))
+                M = np.float32([[1, 0, rng.randint(-self.max_shift, self.max_shift)],
+                                [0, 1, rng.randint(-self.max_shift, self.max_shift)]])
+                cv2.warpAffine(defective, M, (cols, rows), dst=self.frames[i])
+                with self._cond:
+                    self.truth[i] = list(simulator.last_defects)
+                    self.ready = i + 1
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self.error = str(e)
+                self._cond.notify_all()
+            return
+        self.build_ms = round((time.perf_counter() - self._started) * 1000.0, 1)
+
+    def next(self, timeout: float = 10.0):
+        """(frame view, ground truth, index) of the next pooled frame; waits only for the first one."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.ready > 0 or self.error is not None, timeout):
+                raise TimeoutError("Simulator pool produced no frame")
+            if self.ready == 0:
+                raise RuntimeError(f"Simulator pool failed: {self.error}")
+            # While still generating, cycle over the frames ready so far
+            index = self._next % self.ready
+            self._next = index + 1
+            self.served += 1
+            truth = self.truth[index]
+        frame = self.frames[index]
+        frame.flags.writeable = False
+        return frame, truth, index
+
+    def close(self):
+        self._stop = True
+
+    def status(self) -> dict:
+        return {
+            "size": self.size,
+            "ready": self.ready,
+            "seed": self.seed,
+            "served": self.served,
+            "shape": list(self.master.shape),
+            "megabytes": round(self.frames.nbytes / 1e6, 1),
+            "build_ms": self.build_ms,
+            "error": self.error,
+        }
+
+
+class DetectionScore:
+    """Running recall / unmatched-detection counts against pool ground truth."""
+
+    def __init__(self, min_changed_px: int = 50):
+        self.min_changed_px = min_changed_px
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.planted = 0
+        self.found = 0
+        self.unmatched = 0
+
+    def update(self, planted: list, detected: np.ndarray) -> dict:
+        visible, found, unmatched = score_detections(planted, detected, self.min_changed_px)
+        self.frames += 1
+        self.planted += visible
+        self.found += found
+        self.unmatched += unmatched
+        return {"planted": visible, "found": found, "unmatched": unmatched}
+
+    def status(self) -> dict:
+        return {
+            "frames": self.frames,
+            "planted": self.planted,
+            "found": self.found,
+            "recall": round(self.found / self.planted, 4) if self.planted else None,
+            "unmatched_detections": self.unmatched,
+            "unmatched_per_frame": round(self.unmatched / self.frames, 3) if self.frames else None,
+        }
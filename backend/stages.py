@@ -0,0 +1,156 @@
+"""
+Per-frame stage graph
+- Cada etapa tiene nombre, dependencias, flag de habilitación y tiempo medido
+- Las etapas independientes corren en paralelo sobre un pool de hilos
+- Las etapas opcionales se pueden desactivar por receta ("stages": {"color": false})
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class Stage:
+    """
+    One unit of per-frame work. `fn(ctx)` reads earlier results from ctx and
+    returns this stage's result, stored as ctx[name]. A disabled stage stores
+    None; required stages ignore the enable flag.
+    """
+
+    def __init__(self, name: str, fn: Callable[[dict], object], after: Sequence[str] = (),
+                 enabled: bool = True, required: bool = False):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.enabled = enabled
+        self.required = required
+        self.last_ms: Optional[float] = None
+        self.avg_ms = 0.0
+        self.runs = 0
+
+    def record(self, elapsed_ms: float):
+        self.last_ms = elapsed_ms
+        self.runs += 1
+        # Exponential average so the status follows the current recipe
+        self.avg_ms = elapsed_ms if self.runs == 1 else self.avg_ms * 0.9 + elapsed_ms * 0.1
+
+
+class StageGraph:
+    """
+    Runs stages in dependency order. With workers > 1, every stage whose
+    dependencies are done is submitted to a thread pool, so independent stages
+    (OpenCV releases the GIL) overlap; with one worker they run inline.
+    """
+
+    def __init__(self, stages: List[Stage], workers: int = 1):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage '{stage.name}'")
+            self.stages[stage.name] = stage
+        self.order = self._sort()
+        self.workers = 1
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.set_workers(workers)
+
+    def set_workers(self, workers: int):
+        workers = max(1, int(workers or 1))
+        if workers == self.workers and (workers == 1 or self._pool is not None):
+            return
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self.workers = workers
+        if workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage")
+
+    def set_enabled(self, name: str, enabled: bool):
+        stage = self.stages[name]
+        stage.enabled = bool(enabled) or stage.required
+
+    def is_enabled(self, name: str, overrides: Optional[dict] = None) -> bool:
+        stage = self.stages[name]
+        if stage.required:
+            return True
+        if overrides and overrides.get(name) is not None:
+            return bool(overrides[name])
+        return stage.enabled
+
+    def run(self, ctx: dict, overrides: Optional[dict] = None) -> Dict[str, Optional[float]]:
+        """
+        Executes the graph over ctx (overrides: per-recipe {stage: enabled}).
+        Returns {stage: elapsed ms}, None for skipped stages. The first stage
+        error is re-raised once running stages have finished.
+        """
+        timings: Dict[str, Optional[float]] = {}
+        active = []
+        for name in self.order:
+            if self.is_enabled(name, overrides):
+                active.append(self.stages[name])
+            else:
+                ctx[name] = None
+                timings[name] = None
+
+        if self._pool is None:
+            for stage in active:
+                ctx[stage.name], timings[stage.name] = self._call(stage, ctx)
+            return {name: timings[name] for name in self.order}
+
+        pending = list(active)
+        running = {}
+        error = None
+        while pending or running:
+            if error is None:
+                for stage in [s for s in pending if all(dep in timings for dep in s.after)]:
+                    pending.remove(stage)
+                    running[self._pool.submit(self._call, stage, ctx)] = stage
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    ctx[stage.name], timings[stage.name] = future.result()
+                except Exception as e:
+                    error = error or e
+        if error is not None:
+            raise error
+        return {name: timings[name] for name in self.order}
+
+    def status(self) -> List[dict]:
+        return [{
+            "name": stage.name,
+            "after": list(stage.after),
+            "enabled": stage.enabled,
+            "required": stage.required,
+            "last_ms": round(stage.last_ms, 2) if stage.last_ms is not None else None,
+            "avg_ms": round(stage.avg_ms, 2),
+        } for stage in (self.stages[name] for name in self.order)]
+
+    @staticmethod
+    def _call(stage: Stage, ctx: dict):
+        start = time.perf_counter()
+        value = stage.fn(ctx)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        stage.record(elapsed_ms)
+        return value, round(elapsed_ms, 2)
+
+    def _sort(self) -> List[str]:
+        order, state = [], {}
+
+        def visit(name: str, path: tuple):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Stage cycle: {' -> '.join(path + (name,))}")
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}' (required by '{path[-1]}')")
+            state[name] = "visiting"
+            for dep in self.stages[name].after:
+                visit(dep, path + (name,))
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, ())
+        return order
@@ -1,7 +1,13 @@
 import os
+import queue
 import sqlite3
 import json
-from datetime import datetime
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = "data/inspection.db"
 
@@ -16,6 +22,8 @@ def _ensure_column(conn, table: str, column: str, column_def: str):
 def ensure_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
+    # WAL is persistent: readers no longer block the writer (and vice versa)
+    conn.execute("PRAGMA journal_mode=WAL")
     cur = conn.cursor()
     cur.execute("""
         CREATE TABLE IF NOT EXISTS jobs (
@@ -59,6 +67,21 @@ def ensure_db():
             meta_json TEXT
         )
     """)
+    # Older databases created defects with another column set
+    _ensure_column(conn, "defects", "ts", "INTEGER")
+    _ensure_column(conn, "defects", "web_pos_mm", "REAL")
+    _ensure_column(conn, "defects", "lane_id", "INTEGER")
+    _ensure_column(conn, "defects", "label_index", "INTEGER")
+    _ensure_column(conn, "defects", "type", "TEXT")
+    _ensure_column(conn, "defects", "severity", "TEXT")
+    _ensure_column(conn, "defects", "score", "REAL")
+    _ensure_column(conn, "defects", "bbox_json", "TEXT")
+    _ensure_column(conn, "defects", "crop_uri", "TEXT")
+    _ensure_column(conn, "defects", "frame_uri", "TEXT")
+    _ensure_column(conn, "defects", "meta_json", "TEXT")
+    _ensure_column(conn, "defects", "job_id", "TEXT")
+    _ensure_column(conn, "defects", "segment_index", "INTEGER")
+    _ensure_column(conn, "defects", "cavity_index", "INTEGER")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS color_events (
             color_event_id TEXT PRIMARY KEY,
@@ -85,6 +108,7 @@ def ensure_db():
     _ensure_column(conn, "color_events", "delta_e", "REAL")
     _ensure_column(conn, "color_events", "status", "TEXT")
     _ensure_column(conn, "color_events", "meta_json", "TEXT")
+    _ensure_column(conn, "color_events", "job_id", "TEXT")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS recipes (
             recipe_id TEXT PRIMARY KEY,
@@ -130,6 +154,20 @@ def ensure_db():
             exposure_us INTEGER
         )
     """)
+    _ensure_column(conn, "frames", "roll_id", "TEXT")
+    _ensure_column(conn, "frames", "job_id", "TEXT")
+    # Roll queries: position ranges, severity filters and per-ROI color trends,
+    # on the same NULL-safe sort keys the queries use (see _sort_key)
+    # (rowid is implicit in every index and is the keyset tie-breaker)
+    for old in ("idx_defects_roll_pos", "idx_defects_roll_severity", "idx_defects_job_ts",
+                "idx_color_roll_roi_ts", "idx_color_roll_ts", "idx_frames_roll_pos"):
+        cur.execute(f"DROP INDEX IF EXISTS {old}")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_defects_roll_poskey ON defects (roll_id, {_sort_key('web_pos_mm')})")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_defects_roll_severity_poskey ON defects (roll_id, severity, {_sort_key('web_pos_mm')})")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_defects_job_tskey ON defects (job_id, {_sort_key('ts')})")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_color_roll_roi_tskey ON color_events (roll_id, roi_id, {_sort_key('ts')})")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_color_roll_tskey ON color_events (roll_id, {_sort_key('ts')})")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_frames_roll_poskey ON frames (roll_id, {_sort_key('web_pos_mm')})")
     conn.commit()
     conn.close()
 
@@ -166,68 +204,433 @@ def close_roll(roll_id: str, length_m: float, yield_pct: float = 0.0):
     conn.commit()
     conn.close()
 
-def insert_frame(frame: dict):
+FRAME_SQL = "INSERT OR REPLACE INTO frames (frame_id, ts_utc_ms, web_pos_mm, speed_mpm, lane_id, label_index, image_uri, exposure_us, roll_id, job_id) VALUES (?,?,?,?,?,?,?,?,?,?)"
+DEFECT_SQL = "INSERT OR REPLACE INTO defects (defect_id, roll_id, ts, web_pos_mm, lane_id, label_index, type, severity, score, bbox_json, crop_uri, frame_uri, meta_json, job_id, segment_index, cavity_index) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+COLOR_EVENT_SQL = "INSERT OR REPLACE INTO color_events (color_event_id, roll_id, ts, web_pos_mm, lane_id, roi_id, L, a, b, delta_e, status, meta_json, job_id) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)"
+
+
+class StorageWriter:
+    """
+    Owns one long-lived WAL connection on a background thread. Rows are
+    queued as (sql, params) and written with executemany in one transaction
+    per batch, committed every `batch_rows` rows or `flush_ms` milliseconds.
+    A full queue blocks the producer up to `put_timeout` seconds
+    (backpressure); only after that is a row dropped and counted.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, batch_rows: int = 500, flush_ms: int = 200,
+                 queue_size: int = 10000, put_timeout: float = 2.0):
+        self.db_path = db_path
+        self.batch_rows = max(1, int(batch_rows))
+        self.flush_ms = max(1, int(flush_ms))
+        self.put_timeout = put_timeout
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.rows = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+        self.blocked = 0
+        self.last_error = None
+        self.max_depth = 0
+        self.last_batch_rows = 0
+        self.last_batch_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql: str, params: tuple) -> bool:
+        item = (sql, params)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.blocked += 1
+            try:
+                self._queue.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                self.dropped += 1
+                return False
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Waits until everything queued before this call is committed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 10.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "max_depth": self.max_depth,
+            "rows": self.rows,
+            "batches": self.batches,
+            "last_batch_rows": self.last_batch_rows,
+            "last_batch_ms": self.last_batch_ms,
+            "blocked": self.blocked,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: durable across application crashes, fsync only at checkpoints
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            stop = False
+            while not stop:
+                item = self._queue.get()
+                batch, waiters = [], []
+                deadline = time.monotonic() + self.flush_ms / 1000.0
+                while True:
+                    if item is None:
+                        stop = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+                    if stop or waiters or len(batch) >= self.batch_rows:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._write_batch(conn, batch)
+                for waiter in waiters:
+                    waiter.set()
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn, batch: list):
+        start = time.perf_counter()
+        # One executemany per statement (tables are independent; per-table order is kept)
+        groups = {}
+        for sql, params in batch:
+            groups.setdefault(sql, []).append(params)
+        try:
+            with conn:
+                for sql, rows in groups.items():
+                    conn.executemany(sql, rows)
+            self.rows += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            logger.warning(f"Storage batch of {len(batch)} rows failed: {e}")
+        self.last_batch_rows = len(batch)
+        self.last_batch_ms = round((time.perf_counter() - start) * 1000.0, 2)
+
+
+_writer = None
+
+
+def start_writer(**kwargs) -> StorageWriter:
+    """Routes insert_frame/insert_defect/insert_color_event through a StorageWriter."""
+    global _writer
+    if _writer is None:
+        _writer = StorageWriter(DB_PATH, **kwargs)
+    return _writer
+
+
+def stop_writer(timeout: float = 10.0):
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close(timeout)
+
+
+def flush_writer(timeout: float = 10.0) -> bool:
+    return _writer.flush(timeout) if _writer is not None else True
+
+
+def writer_stats():
+    return _writer.stats() if _writer is not None else None
+
+
+def _write(sql: str, params: tuple):
+    writer = _writer
+    if writer is not None:
+        writer.submit(sql, params)
+        return
+    # No writer running (scripts, tests): one synchronous statement
     conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT OR REPLACE INTO frames (frame_id, ts_utc_ms, web_pos_mm, speed_mpm, lane_id, label_index, image_uri, exposure_us) VALUES (?,?,?,?,?,?,?,?)",
-        (
-            frame.get("frame_id"),
-            frame.get("ts_utc_ms"),
-            frame.get("web_pos_mm"),
-            frame.get("speed_mpm"),
-            frame.get("lane_id"),
-            frame.get("label_index"),
-            frame.get("image_uri"),
-            frame.get("exposure_us")
-        )
-    )
-    conn.commit()
-    conn.close()
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def insert_frame(frame: dict):
+    _write(FRAME_SQL, (
+        frame.get("frame_id"),
+        frame.get("ts_utc_ms"),
+        frame.get("web_pos_mm"),
+        frame.get("speed_mpm"),
+        frame.get("lane_id"),
+        frame.get("label_index"),
+        frame.get("image_uri"),
+        frame.get("exposure_us"),
+        frame.get("roll_id"),
+        frame.get("job_id")
+    ))
 
 def insert_defect(defect: dict):
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT OR REPLACE INTO defects (defect_id, roll_id, ts, web_pos_mm, lane_id, label_index, type, severity, score, bbox_json, crop_uri, frame_uri, meta_json) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
-        (
-            defect.get("defect_id"),
-            defect.get("roll_id"),
-            defect.get("ts"),
-            defect.get("web_pos_mm"),
-            defect.get("lane_id"),
-            defect.get("label_index"),
-            defect.get("type"),
-            defect.get("severity"),
-            defect.get("score"),
-            json.dumps(defect.get("bbox")),
-            defect.get("crop_uri"),
-            defect.get("frame_uri"),
-            json.dumps(defect.get("meta", {}))
-        )
-    )
-    conn.commit()
-    conn.close()
+    """DefectEvent dict (ts_utc_ms, defect_type), optionally with segment_index, cavity_index and meta."""
+    meta = dict(defect.get("meta") or {})
+    for key in ("master_diff_uri", "notes"):
+        if defect.get(key):
+            meta[key] = defect[key]
+    _write(DEFECT_SQL, (
+        defect.get("defect_id"),
+        defect.get("roll_id"),
+        defect.get("ts_utc_ms", defect.get("ts")),
+        defect.get("web_pos_mm"),
+        defect.get("lane_id"),
+        defect.get("label_index"),
+        defect.get("defect_type", defect.get("type")),
+        defect.get("severity"),
+        defect.get("score"),
+        json.dumps(defect.get("bbox")),
+        defect.get("crop_uri"),
+        defect.get("frame_uri"),
+        json.dumps(meta),
+        defect.get("job_id"),
+        defect.get("segment_index"),
+        defect.get("cavity_index")
+    ))
 
 def insert_color_event(color_event: dict):
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT OR REPLACE INTO color_events (color_event_id, roll_id, ts, web_pos_mm, lane_id, roi_id, L, a, b, delta_e, status, meta_json) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
-        (
-            color_event.get("color_event_id"),
-            color_event.get("roll_id"),
-            color_event.get("ts"),
-            color_event.get("web_pos_mm"),
-            color_event.get("lane_id"),
-            color_event.get("roi_id"),
-            color_event.get("L"),
-            color_event.get("a"),
-            color_event.get("b"),
-            color_event.get("delta_e"),
-            color_event.get("status"),
-            json.dumps(color_event.get("meta", {}))
-        )
-    )
-    conn.commit()
-    conn.close()
+    """ColorEvent dict (ts_utc_ms, lab_measured/lab_target) or flat L/a/b."""
+    lab = color_event.get("lab_measured") or color_event
+    meta = dict(color_event.get("meta") or {})
+    if color_event.get("lab_target"):
+        meta["lab_target"] = color_event["lab_target"]
+    _write(COLOR_EVENT_SQL, (
+        color_event.get("color_event_id"),
+        color_event.get("roll_id"),
+        color_event.get("ts_utc_ms", color_event.get("ts")),
+        color_event.get("web_pos_mm"),
+        color_event.get("lane_id"),
+        color_event.get("roi_id"),
+        lab.get("L"),
+        lab.get("a"),
+        lab.get("b"),
+        color_event.get("delta_e"),
+        color_event.get("status"),
+        json.dumps(meta),
+        color_event.get("job_id")
+    ))
+
+
+# --- roll queries (keyset pagination) -------------------------------------------
+
+def _read_connect():
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def iso_to_ms(value: str) -> int:
+    """ISO date/datetime (naive = UTC, trailing Z allowed) -> epoch ms."""
+    dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def _ms_to_iso(ms) -> str:
+    if ms is None:
+        return ""
+    return datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+def _sort_key(column: str) -> str:
+    """Sort/cursor expression: rows without a value sort first (-1) instead of dropping out of keyset pages."""
+    return f"COALESCE({column}, -1)"
+
+
+def _parse_cursor(after: str):
+    """Cursor "<sort value>:<rowid>" from a previous page, or None."""
+    if not after:
+        return None
+    value, _, rowid = after.rpartition(":")
+    try:
+        return float(value), int(rowid)
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{after}'")
+
+
+def _page(conn, sql: str, params: list, sort_column: str, limit: int, descending: bool = False):
+    direction = "DESC" if descending else "ASC"
+    rows = conn.execute(f"{sql} ORDER BY {sort_column} {direction}, rowid {direction} LIMIT ?", params + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last['sort_value']}:{last['rowid']}"
+    return rows, next_cursor
+
+
+def _keyset(where: list, params: list, sort_column: str, after: str, descending: bool = False):
+    cursor = _parse_cursor(after)
+    if cursor is not None:
+        where.append(f"({sort_column}, rowid) {'<' if descending else '>'} (?, ?)")
+        params.extend(cursor)
+
+
+def _defect_item(row) -> dict:
+    meta = json.loads(row["meta_json"] or "{}")
+    severity = (row["severity"] or "").lower()
+    return {
+        "id": row["defect_id"],
+        "ts": _ms_to_iso(row["ts"]),
+        "ts_utc_ms": row["ts"],
+        "job_id": row["job_id"],
+        "roll_id": row["roll_id"],
+        "segment_index": row["segment_index"],
+        "meter": round((row["web_pos_mm"] or 0.0) / 1000.0, 3),
+        "web_pos_mm": row["web_pos_mm"],
+        "lane_id": row["lane_id"],
+        "label_index": row["label_index"],
+        "severity": severity,
+        "type": "defect",
+        "defect_type": row["type"],
+        "score": row["score"],
+        "bbox": json.loads(row["bbox_json"]) if row["bbox_json"] else None,
+        "defect": meta.get("defect", {}),
+        "cavity_index": row["cavity_index"],
+        "crop_uri": row["crop_uri"],
+        "frame_uri": row["frame_uri"],
+    }
+
+
+def query_defects(roll_id: str = "", job_id: str = "", from_mm: float = None, to_mm: float = None,
+                  severity: str = "", defect_type: str = "", ts_from: int = None, ts_to: int = None,
+                  after: str = "", limit: int = 500, latest: bool = False):
+    """
+    Defects ordered by web position (by ts without a roll_id), `limit` per
+    page; returns (items, next_cursor). latest=True pages from the end.
+    """
+    where, params = [], []
+    sort_column = _sort_key("web_pos_mm" if roll_id else "ts")
+    if roll_id:
+        where.append("roll_id = ?")
+        params.append(roll_id)
+    if job_id:
+        where.append("job_id = ?")
+        params.append(job_id)
+    if severity:
+        where.append("severity = ?")
+        params.append(severity.upper())
+    if defect_type:
+        where.append("type = ?")
+        params.append(defect_type)
+    if from_mm is not None:
+        where.append(f"{_sort_key('web_pos_mm')} >= ?")
+        params.append(from_mm)
+    if to_mm is not None:
+        where.append(f"{_sort_key('web_pos_mm')} <= ?")
+        params.append(to_mm)
+    if ts_from is not None:
+        where.append(f"{_sort_key('ts')} >= ?")
+        params.append(ts_from)
+    if ts_to is not None:
+        where.append(f"{_sort_key('ts')} <= ?")
+        params.append(ts_to)
+    _keyset(where, params, sort_column, after, descending=latest)
+    sql = f"SELECT rowid, *, {sort_column} AS sort_value FROM defects"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    conn = _read_connect()
+    try:
+        rows, next_cursor = _page(conn, sql, params, sort_column, limit, descending=latest)
+    finally:
+        conn.close()
+    return [_defect_item(row) for row in rows], next_cursor
+
+
+def query_roll_job(roll_id: str) -> str:
+    """Job of a roll: the rolls table, else any of its recorded defects ("" if unknown)."""
+    conn = _read_connect()
+    try:
+        row = conn.execute("SELECT job_id FROM rolls WHERE roll_id=? AND job_id IS NOT NULL AND job_id != ''", (roll_id,)).fetchone()
+        if row is None:
+            # Auto-started rolls have no rolls row; their defects carry the job
+            row = conn.execute("SELECT job_id FROM defects WHERE roll_id=? AND job_id IS NOT NULL AND job_id != '' LIMIT 1",
+                               (roll_id,)).fetchone()
+        return row["job_id"] if row is not None else ""
+    finally:
+        conn.close()
+
+
+def query_color_events(roll_id: str, roi_id: str = "", from_mm: float = None, to_mm: float = None,
+                       after: str = "", limit: int = 500):
+    """Color events of a roll in time order; returns (items, next_cursor)."""
+    where, params = ["roll_id = ?"], [roll_id]
+    if roi_id:
+        where.append("roi_id = ?")
+        params.append(roi_id)
+    if from_mm is not None:
+        where.append(f"{_sort_key('web_pos_mm')} >= ?")
+        params.append(from_mm)
+    if to_mm is not None:
+        where.append(f"{_sort_key('web_pos_mm')} <= ?")
+        params.append(to_mm)
+    sort_column = _sort_key("ts")
+    _keyset(where, params, sort_column, after)
+    sql = f"SELECT rowid, *, {sort_column} AS sort_value FROM color_events WHERE " + " AND ".join(where)
+    conn = _read_connect()
+    try:
+        rows, next_cursor = _page(conn, sql, params, sort_column, limit)
+    finally:
+        conn.close()
+    items = []
+    for row in rows:
+        meta = json.loads(row["meta_json"] or "{}")
+        items.append({
+            "color_event_id": row["color_event_id"],
+            "job_id": row["job_id"],
+            "roll_id": row["roll_id"],
+            "ts_utc_ms": row["ts"],
+            "web_pos_mm": row["web_pos_mm"],
+            "lane_id": row["lane_id"],
+            "roi_id": row["roi_id"],
+            "lab_measured": {"L": row["L"], "a": row["a"], "b": row["b"]},
+            "lab_target": meta.get("lab_target"),
+            "delta_e": row["delta_e"],
+            "status": row["status"],
+        })
+    return items, next_cursor
+
+
+def query_frames(roll_id: str, from_mm: float = None, to_mm: float = None, after: str = "", limit: int = 500):
+    """Frames of a roll by web position; returns (items, next_cursor)."""
+    where, params = ["roll_id = ?"], [roll_id]
+    if from_mm is not None:
+        where.append(f"{_sort_key('web_pos_mm')} >= ?")
+        params.append(from_mm)
+    if to_mm is not None:
+        where.append(f"{_sort_key('web_pos_mm')} <= ?")
+        params.append(to_mm)
+    sort_column = _sort_key("web_pos_mm")
+    _keyset(where, params, sort_column, after)
+    sql = f"SELECT rowid, *, {sort_column} AS sort_value FROM frames WHERE " + " AND ".join(where)
+    conn = _read_connect()
+    try:
+        rows, next_cursor = _page(conn, sql, params, sort_column, limit)
+    finally:
+        conn.close()
+    columns = ("frame_id", "job_id", "roll_id", "ts_utc_ms", "web_pos_mm", "speed_mpm", "lane_id", "label_index", "image_uri", "exposure_us")
+    return [{k: row[k] for k in columns} for row in rows], next_cursor
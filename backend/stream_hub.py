@@ -0,0 +1,247 @@
+"""
+Encode-once stream hub
+- Cada frame procesado se publica una sola vez (live, aligned, heatmap, master)
+- Cada variante (formato, escala, calidad) se codifica una vez por frame, solo si algún cliente la pide
+- Fan-out a cualquier número de clientes MJPEG y de polling (/inspection-frame)
+- Sin pipeline activo, un único hilo de preview adquiere frames para todos los visores
+"""
+
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LazyImage:
+    """An image built on first use and then kept (e.g. a full warp that only viewers need)."""
+
+    def __init__(self, build: Callable[[], np.ndarray]):
+        self._build = build
+        self._image: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> np.ndarray:
+        with self._lock:
+            if self._image is None:
+                self._image = self._build()
+                self._build = None
+            return self._image
+
+
+def encode_image(img: np.ndarray, format: str = "jpg", quality: int = 70, scale: float = 1.0) -> bytes:
+    """Resize (scale < 1) and encode to JPEG or PNG bytes."""
+    if isinstance(img, LazyImage):
+        img = img.get()
+    if scale and 0 < scale < 1:
+        h, w = img.shape[:2]
+        img = cv2.resize(img, (int(w * scale), int(h * scale)))
+    fmt = ".jpg" if format.lower() in ("jpg", "jpeg") else ".png"
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)] if fmt == ".jpg" else []
+    success, encoded = cv2.imencode(fmt, img, params)
+    if not success:
+        raise ValueError("Could not encode image")
+    return encoded.tobytes()
+
+
+class FrameSet:
+    """One published frame: named images, the refs pinning them and the encodes made so far."""
+
+    def __init__(self, seq: int, images: Dict[str, np.ndarray], pins: List, source=None):
+        self.seq = seq
+        self.images = images
+        self.pins = pins
+        self.source = source
+        self.encoded: Dict[tuple, bytes] = {}
+        self.encoding: Dict[tuple, threading.Event] = {}
+        self.readers = 0
+        self.retired = False
+
+    def release(self):
+        for pin in self.pins:
+            pin.release()
+        self.pins = []
+        self.images = {}
+
+
+class StreamHub:
+    """
+    Holds the newest FrameSet. Readers ask for (channel, format, quality,
+    scale); the first reader of a variant encodes it, concurrent readers of
+    the same variant wait for that encode, later ones get the cached bytes.
+    Ring pins are released once a frame is replaced and no reader is encoding it.
+    """
+
+    def __init__(self, max_fps: float = 25.0):
+        self.max_fps = max_fps
+        self._cond = threading.Condition()
+        self._current: Optional[FrameSet] = None
+        self._seq = 0
+        self.subscribers: Dict[str, int] = {}
+        self.published = 0
+        self.encodes = 0
+        self.hits = 0
+        self._preview: Optional[threading.Thread] = None
+
+    # --- producer side ---------------------------------------------------------
+
+    def publish(self, images: Dict[str, np.ndarray], pins: Optional[List] = None, source=None) -> int:
+        """Replaces the current frame. `pins` (objects with release()) keep the images valid."""
+        with self._cond:
+            self._seq += 1
+            previous = self._current
+            self._current = FrameSet(self._seq, dict(images), list(pins or []), source)
+            self.published += 1
+            self._cond.notify_all()
+            if previous is not None:
+                previous.retired = True
+                if previous.readers == 0:
+                    previous.release()
+            return self._seq
+
+    def clear(self):
+        with self._cond:
+            previous, self._current = self._current, None
+            if previous is not None:
+                previous.retired = True
+                if previous.readers == 0:
+                    previous.release()
+            self._cond.notify_all()
+
+    # --- reader side -----------------------------------------------------------
+
+    def encoded(self, channel: str, format: str = "jpg", quality: int = 70, scale: float = 0.6,
+                after_seq: int = 0, timeout: float = 1.0, source=None) -> Optional[Tuple[int, bytes]]:
+        """
+        (seq, bytes) of the newest frame newer than after_seq, or None on
+        timeout / missing channel. With `source`, only that publication is
+        accepted (no waiting): used to share encodes with a specific result.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                frame = self._current
+                if source is not None:
+                    if frame is None or frame.source is not source:
+                        return None
+                    break
+                if frame is not None and frame.seq > after_seq:
+                    if channel in frame.images:
+                        break
+                    # e.g. a preview frame without heatmap: wait for the next one
+                    after_seq = frame.seq
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if channel not in frame.images:
+                return None
+            key = (channel, format.lower(), int(quality), float(scale))
+            data = frame.encoded.get(key)
+            if data is not None:
+                self.hits += 1
+                return frame.seq, data
+            pending = frame.encoding.get(key)
+            if pending is None:
+                # This reader encodes; the frame stays pinned until it is done
+                pending = frame.encoding[key] = threading.Event()
+                frame.readers += 1
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            pending.wait(timeout)
+            data = frame.encoded.get(key)
+            if data is not None:
+                with self._cond:
+                    self.hits += 1
+            return (frame.seq, data) if data is not None else None
+        try:
+            data = encode_image(frame.images[channel], format=format, quality=quality, scale=scale)
+        except Exception as e:
+            logger.warning(f"Stream encode failed: {e}")
+            data = None
+        with self._cond:
+            if data is not None:
+                frame.encoded[key] = data
+                self.encodes += 1
+            frame.encoding.pop(key, None)
+            frame.readers -= 1
+            if frame.retired and frame.readers == 0:
+                frame.release()
+        pending.set()
+        return (frame.seq, data) if data is not None else None
+
+    def mjpeg(self, channel: str, scale: float = 0.6, quality: int = 70,
+              on_idle: Optional[Callable[[], None]] = None):
+        """multipart/x-mixed-replace generator for one client."""
+        self._subscribe(channel, 1)
+        last_seq, data = 0, None
+        try:
+            while True:
+                if on_idle is not None:
+                    on_idle()
+                start = time.monotonic()
+                item = self.encoded(channel, "jpg", quality, scale, after_seq=last_seq, timeout=1.0)
+                if item is None:
+                    # No new frame: write anyway so a closed client ends the generator
+                    if data is None:
+                        yield b"\r\n"  # multipart preamble, ignored by clients
+                        continue
+                else:
+                    last_seq, data = item
+                yield (b"--frame\r\n"
+                       b"Content-Type: image/jpeg\r\n\r\n" + data + b"\r\n")
+                if self.max_fps and self.max_fps > 0:
+                    remaining = 1.0 / self.max_fps - (time.monotonic() - start)
+                    if remaining > 0:
+                        time.sleep(remaining)
+        finally:
+            self._subscribe(channel, -1)
+
+    # --- idle preview ------------------------------------------------------------
+
+    def ensure_preview(self, producer: Callable[[], Dict[str, np.ndarray]], active: Callable[[], bool], interval: float = 0.04):
+        """
+        Starts (once) a thread that publishes producer() frames while active()
+        and someone is subscribed, so idle viewers share one acquisition.
+        """
+        with self._cond:
+            if self._preview is not None and self._preview.is_alive():
+                return
+            self._preview = threading.Thread(target=self._run_preview, args=(producer, active, interval),
+                                             name="stream-preview", daemon=True)
+            self._preview.start()
+
+    def _run_preview(self, producer, active, interval: float):
+        while active() and sum(self.subscribers.values()) > 0:
+            start = time.monotonic()
+            try:
+                self.publish(producer())
+            except Exception as e:
+                logger.warning(f"Preview frame failed: {e}")
+                time.sleep(0.2)
+            remaining = interval - (time.monotonic() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _subscribe(self, channel: str, delta: int):
+        with self._cond:
+            self.subscribers[channel] = max(0, self.subscribers.get(channel, 0) + delta)
+
+    def stats(self) -> dict:
+        with self._cond:
+            frame = self._current
+            return {
+                "seq": self._seq,
+                "published": self.published,
+                "encodes": self.encodes,
+                "hits": self.hits,
+                "subscribers": dict(self.subscribers),
+                "channels": sorted(frame.images) if frame is not None else [],
+                "variants": len(frame.encoded) if frame is not None else 0,
+            }
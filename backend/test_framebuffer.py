@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test: FrameRing
+Un array tomado del ring sigue siendo legible después de close()
+y la memoria se libera cuando ya no queda ninguno
+"""
+
+import gc
+import sys
+import weakref
+from framebuffer import FrameRing
+
+def test_view_after_close():
+    """Test vista del frame después de cerrar el ring"""
+
+    print("\n" + "="*60)
+    print("TEST: FrameRing - vista después de close()")
+    print("="*60 + "\n")
+
+    # [1] Publicar un frame
+    print("[1] Publicando frame en el ring...")
+    ring = FrameRing(2, (4, 4, 3))
+    slot, view = ring.reserve((4, 4, 3))
+    view[:] = 7
+    ref = ring.publish(slot, (4, 4, 3))
+    arr = ref.array[1:3]
+    owner = arr
+    while getattr(owner, "base", None) is not None:
+        owner = owner.base
+    mapping = weakref.ref(owner)  # objeto que mantiene la memoria mapeada
+    del owner
+    print(f"    ✅ Frame publicado: seq={ref.seq}")
+
+    # [2] Liberar la referencia y cerrar el ring
+    print("\n[2] Liberando referencia y cerrando ring...")
+    ref.release()
+    if not ring.close():
+        print("    ❌ close() devolvió False sin referencias retenidas")
+        return False
+    if ring.get(ref.seq) is not None or ring.reserve((4, 4, 3)) is not None:
+        print("    ❌ El ring cerrado sigue entregando slots")
+        return False
+    del ring, ref, view
+    gc.collect()
+    print("    ✅ Ring cerrado")
+
+    # [3] Leer la vista retenida (antes: segfault al desmapear)
+    print("\n[3] Leyendo el array tomado antes de close()...")
+    total = int(arr.sum())
+    if total != 7 * arr.size:
+        print(f"    ❌ Contenido inesperado: suma={total}")
+        return False
+    print(f"    ✅ Array legible: suma={total}")
+
+    # [4] Sin vistas vivas la memoria se desmapea
+    print("\n[4] Soltando el último array...")
+    if mapping() is None:
+        print("    ❌ La memoria se liberó con un array todavía vivo")
+        return False
+    del arr
+    gc.collect()
+    if mapping() is not None:
+        print("    ❌ La memoria sigue mapeada sin arrays vivos")
+        return False
+    print("    ✅ Memoria liberada")
+
+    print("\n" + "="*60)
+    print("✅ TEST COMPLETADO")
+    print("="*60 + "\n")
+    return True
+
+if __name__ == "__main__":
+    success = test_view_after_close()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Test: Paginación por cursor (keyset) en storage
+Filas sin posición o sin timestamp (NULL) no rompen ni pierden páginas
+"""
+
+import os
+import sys
+import tempfile
+import storage
+
+def _all_pages(query, **kwargs):
+    ids, after = [], ""
+    while True:
+        items, after = query(after=after, limit=1, **kwargs)
+        ids.extend(item.get("id") or item.get("frame_id") for item in items)
+        if not after:
+            return ids
+
+def test_null_sort_values():
+    """Test páginas de 1 fila con valores de orden NULL"""
+
+    print("\n" + "="*60)
+    print("TEST: Paginación con web_pos_mm / ts NULL")
+    print("="*60 + "\n")
+
+    storage.DB_PATH = os.path.join(tempfile.mkdtemp(), "inspection.db")
+    storage.ensure_db()
+
+    # [1] Defectos, la mitad sin posición ni timestamp (filas legacy)
+    print("[1] Insertando defectos y frames...")
+    expected = []
+    for i in range(6):
+        legacy = i % 2 == 0
+        storage.insert_defect({
+            "defect_id": f"D{i}", "roll_id": "R1", "job_id": "J1", "severity": "MINOR",
+            "web_pos_mm": None if legacy else 100.0 * i, "ts_utc_ms": None if legacy else 1000 + i,
+        })
+        storage.insert_frame({"frame_id": f"F{i}", "roll_id": "R1", "job_id": "J1", "web_pos_mm": None if legacy else 100.0 * i})
+        expected.append(f"D{i}")
+    print(f"    ✅ {len(expected)} defectos insertados")
+
+    # [2] Por posición (roll), por timestamp (job) y frames
+    checks = [
+        ("defectos por posición", _all_pages(storage.query_defects, roll_id="R1"), expected),
+        ("defectos por timestamp", _all_pages(storage.query_defects, job_id="J1"), expected),
+        ("defectos recientes", _all_pages(storage.query_defects, roll_id="R1", latest=True), expected),
+        ("frames por posición", _all_pages(storage.query_frames, roll_id="R1"), [f"F{i}" for i in range(6)]),
+    ]
+    for label, got, want in checks:
+        print(f"\n[2] Paginando {label}...")
+        if sorted(got) != sorted(want) or len(got) != len(want):
+            print(f"    ❌ Filas perdidas o repetidas: {got}")
+            return False
+        print(f"    ✅ {len(got)} filas, sin cursores inválidos")
+
+    print("\n" + "="*60)
+    print("✅ TEST COMPLETADO")
+    print("="*60 + "\n")
+    return True
+
+if __name__ == "__main__":
+    try:
+        success = test_null_sort_values()
+    except ValueError as e:
+        print(f"    ❌ {e}")
+        success = False
+    sys.exit(0 if success else 1)